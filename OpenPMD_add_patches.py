@@ -2,11 +2,15 @@
 
 import argparse
 import os
+import tempfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import h5py
-from shutil import copyfile
 import re
 import numpy as np
 
+from hdf5_memory_map import get_memory_map, get_dataset_view
+
 
 class List_coorditates():
     """ Collect values from datasets in hdf file """
@@ -20,11 +24,11 @@ class List_coorditates():
         if name == 'position':
             for key in node.keys():
                 if key == 'x':
-                    self.list_x = node[key][()]
+                    self.list_x = get_dataset_view(node[key])[()]
                 elif key == 'y':
-                    self.list_y = node[key][()]
+                    self.list_y = get_dataset_view(node[key])[()]
                 elif key == 'z':
-                    self.list_z = node[key][()]
+                    self.list_z = get_dataset_view(node[key])[()]
         return None
 
 
@@ -99,84 +103,385 @@ def get_ranges(grid_sizes):
     return x_range, y_range, z_range
 
 
-def count_points_idx(coordinate_lists, grid_sizes, devices_numbers):
-    list_x = coordinate_lists.list_x
-    list_y = coordinate_lists.list_y
-    list_z = coordinate_lists.list_z
+def get_patch_data(list_x, list_y, list_z, grid_sizes, devices_numbers):
+    """ Particles_data for 3D patches if z is given and devicesNumber has 3 values, else for 2D """
 
     x_range, y_range, z_range = get_ranges(grid_sizes)
-    size_array = len(list_z)
-
-    patch_data = None
 
-    if size_array != 0 and len(devices_numbers) == 3:
+    if len(list_z) != 0 and len(devices_numbers) == 3:
         splitting_x = devices_numbers[0]
         splitting_y = devices_numbers[1]
         splitting_z = devices_numbers[2]
-        patch_data = Particles_data(list_x, splitting_x, x_range, list_y, splitting_y, y_range,
-                                    list_z, splitting_z, z_range)
+        return Particles_data(list_x, splitting_x, x_range, list_y, splitting_y, y_range,
+                              list_z, splitting_z, z_range)
     else:
         splitting_x = devices_numbers[0]
         splitting_y = devices_numbers[1]
-        patch_data = Particles_data(list_x, splitting_x, x_range, list_y, splitting_y, y_range)
+        return Particles_data(list_x, splitting_x, x_range, list_y, splitting_y, y_range)
 
-    size_indexes = patch_data.get_size_split()
+
+def count_points_idx(coordinate_lists, grid_sizes, devices_numbers):
+    list_x = coordinate_lists.list_x
+    list_y = coordinate_lists.list_y
+    list_z = coordinate_lists.list_z
+
+    patch_data = get_patch_data(list_x, list_y, list_z, grid_sizes, devices_numbers)
 
     list_number_particles_in_parts, links_to_array = \
         points_to_patches(patch_data)
 
-    resultArray, final_size = divide_points_to_patches(size_array, size_indexes, list_number_particles_in_parts,
-                                                       links_to_array)
+    resultArray, final_size = divide_points_to_patches(list_number_particles_in_parts, links_to_array)
 
    # test_print_2d(list_x, list_y, resultArray, final_size)
     return resultArray, final_size, list_number_particles_in_parts
 
 
-def move_values(file_with_patches, final_size, values_list, resultArray):
+def move_values(file_with_patches, final_size, values_list, resultArray, chunk_size=2**20, jobs=1):
+    """ Write each particle dataset reordered by permutation resultArray to file_with_patches,
+    with dtype, storage layout and attributes of the input dataset.
+    Datasets are read and written one by one by this thread, h5py handles one call at a time;
+    with jobs > 1 only the reordering of values in memory is done by a pool of threads.
+    Contiguous datasets are gathered from their memory map, other datasets are read whole, so peak memory
+    is one dataset and the permutation; memory_budget of OpenPMD_add_patches bounds it instead """
+
+    permutation = np.asarray(resultArray, dtype=np.int64)
+    executor = None
+    if jobs > 1:
+        executor = ThreadPoolExecutor(jobs)
 
     for dataset in values_list.list_values:
-        name_dataset = dataset.name
-        size = len(dataset.value)
-        moved_values = np.zeros(size)
-        for i in range(0, len(final_size) - 1):
-            for j in range(int(final_size[i]), int(final_size[i + 1])):
-                moved_values[j] = (dataset.value[int(resultArray[j])])
-        del file_with_patches[name_dataset]
-        file_with_patches.create_dataset(name_dataset, data=moved_values)
+        if not is_particle_dataset(dataset, len(permutation)):
+            copy_dataset(dataset, file_with_patches)
+            continue
+        values = get_memory_map(dataset)
+        if values is None:
+            values = dataset[()]
+        moved_dataset = create_moved_dataset(dataset, file_with_patches)
+        gather_values(values, permutation, moved_dataset, get_write_size(moved_dataset, chunk_size), executor, jobs)
+
+    if executor is not None:
+        executor.shutdown()
+
+
+def is_particle_dataset(dataset, size):
+    return len(dataset.shape) != 0 and dataset.shape[0] == size
+
+
+def copy_dataset(dataset, file_with_patches):
+    """ Copy dataset, which is not reordered, with its attributes and storage layout """
+
+    parent = file_with_patches.require_group(dataset.parent.name)
+    dataset.parent.copy(dataset, parent, name=dataset.name.split('/')[-1])
+
+
+def create_moved_dataset(dataset, file_with_patches):
+    """ Empty dataset with the same shape, dtype, chunking and compression as dataset """
+
+    moved_dataset = file_with_patches.create_dataset_like(dataset.name, dataset)
+    copy_attributes(dataset, moved_dataset)
+    return moved_dataset
+
+
+def copy_attributes(source, target):
+    """ Copy all attributes, keeping their types """
+
+    for name in source.attrs:
+        target.attrs.create(name, source.attrs[name], dtype=source.attrs.get_id(name).dtype)
 
 
-def handle_particle_group(group, file_with_patches, devices_numbers, grid_sizes, field_size):
-    """ move values according the patches,  count idxs, change grids """
+def get_write_size(dataset, chunk_size):
+    """ Number of rows written at once, a multiple of storage chunks of dataset """
+
+    if dataset.chunks is None:
+        return chunk_size
+    rows_in_chunk = dataset.chunks[0]
+    return max(1, chunk_size // rows_in_chunk) * rows_in_chunk
+
+
+def gather_values(values, permutation, dataset, chunk_size, executor=None, jobs=1):
+    """ Write values[permutation] to dataset, chunk by chunk of permutation.
+    With executor jobs chunks at a time are gathered by its threads, numpy releases the GIL there,
+    and written in order by this thread """
+
+    def gather(idx_start):
+        return values[permutation[idx_start:idx_start + chunk_size]]
+
+    starts = range(0, len(permutation), chunk_size)
+    if executor is None:
+        for idx_start in starts:
+            moved_values = gather(idx_start)
+            dataset[idx_start:idx_start + len(moved_values)] = moved_values
+        return
+
+    for batch_start in range(0, len(starts), jobs):
+        batch = starts[batch_start:batch_start + jobs]
+        for idx_start, moved_values in zip(batch, executor.map(gather, batch)):
+            dataset[idx_start:idx_start + len(moved_values)] = moved_values
+
+
+def handle_particle_group(group, file_with_patches, devices_numbers, grid_sizes, field_size, memory_budget=None,
+                          jobs=1, patches=None):
+    """ move values according the patches,  count idxs, change grids
+    patches - result of count_points_idx for group, if it is already computed
+    """
+
+    if memory_budget != None:
+        return handle_particle_group_out_of_core(group, file_with_patches, devices_numbers, grid_sizes,
+                                                 field_size, memory_budget)
 
     coordinate_lists = List_coorditates()
-    group.visititems(coordinate_lists)
+    if patches is None:
+        group.visititems(coordinate_lists)
+        patches = count_points_idx(coordinate_lists, grid_sizes, devices_numbers)
     values_list = List_values()
     group.visititems(values_list)
 
-    resultArray, final_size, list_number_particles_in_parts\
-        = count_points_idx(coordinate_lists, grid_sizes, devices_numbers)
+    resultArray, final_size, list_number_particles_in_parts = patches
 
     values_extent = Extent_values(field_size, grid_sizes, devices_numbers)
 
-    move_values(file_with_patches, final_size, values_list, resultArray)
+    move_values(file_with_patches, final_size, values_list, resultArray, jobs=jobs)
     return final_size, list_number_particles_in_parts, values_extent, coordinate_lists
 
 
-def OpenPMD_add_patches(hdf_file_name, name_of_file_with_patches, grid_sizes, devices_numbers, field_size):
-    """ Add patche to OpenPMD file """
+def count_group_patches(hdf_file_name, group_name, grid_sizes, devices_numbers):
+    """ count_points_idx for one particle group, the file is opened here to run in a worker process """
+
+    with h5py.File(hdf_file_name, 'r') as hdf_file:
+        coordinate_lists = List_coorditates()
+        hdf_file[group_name].visititems(coordinate_lists)
+        return count_points_idx(coordinate_lists, grid_sizes, devices_numbers)
+
+
+def submit_groups_patches(executor, hdf_file_name, particles_groups_names, grid_sizes, devices_numbers):
+    """ Start counting of patches for all particle groups, returns futures by group name """
+
+    patches_futures = {}
+    for group_name in particles_groups_names:
+        patches_futures[group_name] = executor.submit(count_group_patches, hdf_file_name, group_name,
+                                                      grid_sizes, devices_numbers)
+    return patches_futures
+
+
+class Out_of_core:
+    """ Sizes of external-memory patch sorting, bytes of working memory for one particle:
+    coordinates, patch index, order in window, value read, value sorted and value written """
+
+    bytes_per_particle = 64
+
+    def __init__(self, memory_budget, temporary_directory):
+        self.chunk_size = max(1, int(memory_budget // self.bytes_per_particle))
+        self.temporary_directory = temporary_directory
+
+    def create_buffer(self, name, dtype, shape):
+        """ Array in temporary file, mapped to memory """
+
+        return np.memmap(os.path.join(self.temporary_directory, name), dtype=dtype, mode='w+', shape=shape)
+
+
+def count_patches_out_of_core(group, grid_sizes, devices_numbers, patch_ids, out_of_core):
+    """ First pass: patch of each particle, chunk by chunk, and number of particles in each patch """
+
+    position = group['position']
+    axes = [get_dataset_view(position[axis]) for axis in ['x', 'y', 'z'] if axis in position]
+    size = len(patch_ids)
+    list_number_particles_in_parts = None
+    for idx_start in range(0, size, out_of_core.chunk_size):
+        idx_end = min(idx_start + out_of_core.chunk_size, size)
+        coordinates = [axis[idx_start:idx_end] for axis in axes]
+        list_z = coordinates[2] if len(coordinates) > 2 else []
+        patch_data = get_patch_data(coordinates[0], coordinates[1], list_z, grid_sizes, devices_numbers)
+        chunk_patch_ids = patch_data.get_position_indexes()
+        patch_ids[idx_start:idx_end] = chunk_patch_ids
+        chunk_numbers = np.bincount(chunk_patch_ids, minlength=patch_data.get_size_split() + 1)
+        if list_number_particles_in_parts is None:
+            list_number_particles_in_parts = chunk_numbers
+        else:
+            list_number_particles_in_parts += chunk_numbers
+
+    if list_number_particles_in_parts is None:
+        list_number_particles_in_parts = np.zeros(np.prod(devices_numbers[:len(axes)]) + 1, dtype=int)
+    return list_number_particles_in_parts
+
+
+def count_window_segments(patch_ids, number_patches, window_orders, out_of_core):
+    """ Second pass: order of particles of each window sorted by patch, stable as count_indexes,
+    and number of particles of each patch in each window. Sorted window is a sequence of patch segments """
+
+    size = len(patch_ids)
+    window_counts = []
+    for idx_start in range(0, size, out_of_core.chunk_size):
+        idx_end = min(idx_start + out_of_core.chunk_size, size)
+        chunk_patch_ids = np.asarray(patch_ids[idx_start:idx_end])
+        window_orders[idx_start:idx_end] = np.argsort(chunk_patch_ids, kind='stable')
+        window_counts.append(np.bincount(chunk_patch_ids, minlength=number_patches))
+    return np.array(window_counts, dtype=np.int64).reshape(-1, number_patches)
+
+
+def spill_sorted_windows(values, spilled_values, window_orders, out_of_core):
+    """ Copy values window by window sorted by patch, both files are read and written in order """
+
+    size = len(window_orders)
+    for idx_start in range(0, size, out_of_core.chunk_size):
+        idx_end = min(idx_start + out_of_core.chunk_size, size)
+        spilled_values[idx_start:idx_end] = values[idx_start:idx_end][window_orders[idx_start:idx_end]]
+
+
+def write_patches_sequentially(spilled_values, moved_dataset, window_counts, write_size):
+    """ Write result patch by patch: rows of a patch are its segments in all sorted windows,
+    they are gathered into a buffer of write_size rows, which is written in order """
+
+    window_sizes = window_counts.sum(axis=1)
+    segment_starts = np.cumsum(window_counts, axis=1) - window_counts
+    segment_starts += (np.cumsum(window_sizes) - window_sizes)[:, np.newaxis]
+    buffer = np.empty((write_size,) + spilled_values.shape[1:], dtype=spilled_values.dtype)
+    filled = 0
+    written = 0
+    for patch in range(window_counts.shape[1]):
+        for window in np.nonzero(window_counts[:, patch])[0]:
+            start = segment_starts[window, patch]
+            end = start + window_counts[window, patch]
+            while start < end:
+                part = min(end - start, write_size - filled)
+                buffer[filled:filled + part] = spilled_values[start:start + part]
+                filled += part
+                start += part
+                if filled == write_size:
+                    moved_dataset[written:written + filled] = buffer
+                    written += filled
+                    filled = 0
+    if filled != 0:
+        moved_dataset[written:written + filled] = buffer[:filled]
+
+
+def move_values_out_of_core(file_with_patches, values_list, window_orders, window_counts, out_of_core):
+    """ Reorder each particle dataset by patches through a temporary file: windows sorted by patch
+    are spilled, then the result dataset is written once, in order. Memory is bounded by windows
+    and write buffer, writes to temporary file and result are sequential """
+
+    size = len(window_orders)
+    for dataset in values_list.list_values:
+        if not is_particle_dataset(dataset, size):
+            copy_dataset(dataset, file_with_patches)
+            continue
+        spilled_values = out_of_core.create_buffer('values', dataset.dtype, dataset.shape)
+        spill_sorted_windows(get_dataset_view(dataset), spilled_values, window_orders, out_of_core)
+
+        moved_dataset = create_moved_dataset(dataset, file_with_patches)
+        write_size = get_write_size(moved_dataset, out_of_core.chunk_size)
+        write_patches_sequentially(spilled_values, moved_dataset, window_counts, write_size)
+        del spilled_values
 
-    copyfile(hdf_file_name, name_of_file_with_patches)
-    file_with_patches = h5py.File(name_of_file_with_patches)
-    hdf_file = h5py.File(hdf_file_name)
+
+def handle_particle_group_out_of_core(group, file_with_patches, devices_numbers, grid_sizes, field_size,
+                                      memory_budget):
+    """ move values according the patches in external memory: two-pass counting sort,
+    memory is bounded by memory_budget (bytes), temporary files are next to the result file """
+
+    values_list = List_values()
+    group.visititems(values_list)
+    size = group['position']['x'].shape[0]
+
+    result_directory = os.path.dirname(os.path.abspath(file_with_patches.filename))
+    with tempfile.TemporaryDirectory(dir=result_directory) as temporary_directory:
+        out_of_core = Out_of_core(memory_budget, temporary_directory)
+        patch_ids = out_of_core.create_buffer('patch_ids', np.int64, (size,))
+        list_number_particles_in_parts = count_patches_out_of_core(group, grid_sizes, devices_numbers,
+                                                                   patch_ids, out_of_core)
+        final_size = np.cumsum(list_number_particles_in_parts, dtype=int)
+        final_size = np.insert(final_size, 0, 0)
+
+        window_orders = out_of_core.create_buffer('window_orders', np.int64, (size,))
+        window_counts = count_window_segments(patch_ids, len(list_number_particles_in_parts), window_orders,
+                                              out_of_core)
+        del patch_ids
+        move_values_out_of_core(file_with_patches, values_list, window_orders, window_counts, out_of_core)
+        del window_orders
+
+    values_extent = Extent_values(field_size, grid_sizes, devices_numbers)
+    return final_size, list_number_particles_in_parts, values_extent, List_coorditates()
+
+
+def OpenPMD_add_patches(hdf_file_name, name_of_file_with_patches, grid_sizes, devices_numbers, field_size,
+                        memory_budget=None, jobs=1, order=None):
+    """ Add patche to OpenPMD file
+    The result file is written once: particle datasets reordered by patches,
+    everything else is copied from hdf_file_name.
+    memory_budget - bytes of working memory for one particle species, if given particles are sorted
+    in external memory, by default whole species is sorted in memory
+    jobs - number of processes sorting particle groups (iterations, species) in memory
+    and of threads reordering values of one dataset in memory, h5py reads and writes are not parallel
+    order - 'morton' or 'hilbert' to sort particles along space-filling curve, in memory, and cut
+    prod(devices_numbers) patches with equal numbers of particles, by default patches are a regular grid
+    """
+
+    hdf_file = h5py.File(hdf_file_name, 'r')
+    file_with_patches = h5py.File(name_of_file_with_patches, 'w')
     particles_name = get_particles_name(hdf_file)
     hdf_datasets = Particles_groups(particles_name)
 
-    file_with_patches.visititems(hdf_datasets)
+    hdf_file.visititems(hdf_datasets)
+
+    particles_groups_names = [group.name for group in hdf_datasets.particles_groups]
+
+    executor = None
+    patches_futures = {}
+    if jobs > 1 and memory_budget == None and order == None:
+        executor = ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context('spawn'))
+        patches_futures = submit_groups_patches(executor, hdf_file_name, particles_groups_names,
+                                                grid_sizes, devices_numbers)
+
+    copy_attributes(hdf_file, file_with_patches)
+    copy_other_groups(hdf_file, file_with_patches, particles_groups_names)
 
     for group in hdf_datasets.particles_groups:
+        patches = None
+        if group.name in patches_futures:
+            patches = patches_futures[group.name].result()
+        group_with_patches = create_particle_group_structure(group, file_with_patches)
+        if order != None:
+            patches = handle_particle_group_curve(group, file_with_patches, order, int(np.prod(devices_numbers)),
+                                                  jobs)
+            add_curve_patch_to_particle_group(group_with_patches, order, *patches)
+            continue
         final_size, list_number_particles_in_parts, values_extent, coordinate_lists = \
-            handle_particle_group(group, file_with_patches, devices_numbers, grid_sizes, field_size)
-        add_patch_to_particle_group(group, final_size, list_number_particles_in_parts, values_extent)
+            handle_particle_group(group, file_with_patches, devices_numbers, grid_sizes, field_size, memory_budget,
+                                  jobs, patches)
+        add_patch_to_particle_group(group_with_patches, final_size, list_number_particles_in_parts, values_extent)
+
+    if executor is not None:
+        executor.shutdown()
+    file_with_patches.close()
+    hdf_file.close()
+
+
+def copy_other_groups(group, file_with_patches, particles_groups_names):
+    """ Copy all items except of particle groups, parents of particle groups are created with attributes """
+
+    for name, item in group.items():
+        if item.name in particles_groups_names:
+            continue
+        if isinstance(item, h5py.Group) and \
+                any(particles_name.startswith(item.name + '/') for particles_name in particles_groups_names):
+            copy_attributes(item, file_with_patches.require_group(item.name))
+            copy_other_groups(item, file_with_patches, particles_groups_names)
+        else:
+            group.copy(item, file_with_patches.require_group(group.name), name=name)
+
+
+def create_particle_group_structure(group, file_with_patches):
+    """ Create particle group and all its subgroups (records) with attributes, without datasets """
+
+    group_with_patches = file_with_patches.require_group(group.name)
+    copy_attributes(group, group_with_patches)
+
+    def create_subgroup(name, node):
+        if isinstance(node, h5py.Group):
+            copy_attributes(node, group_with_patches.require_group(name))
+        return None
+
+    group.visititems(create_subgroup)
+    return group_with_patches
 
 
 class Particles_groups():
@@ -240,6 +545,17 @@ class Particles_data():
     def get_position_idx3d(self, x_patch, y_patch, z_patch):
         return (x_patch * self.y_split + y_patch) * self.z_split + z_patch
 
+    def get_position_indexes(self):
+        """ Patch index of each particle, computed for all particles at once """
+
+        patches = [get_positions(self.x_range[1], self.x_range[0], self.x_split, self.x_coord),
+                   get_positions(self.y_range[1], self.y_range[0], self.y_split, self.y_coord)]
+        splits = [self.x_split, self.y_split]
+        if self.z_split != None:
+            patches.append(get_positions(self.z_range[1], self.z_range[0], self.z_split, self.z_coord))
+            splits.append(self.z_split)
+        return np.ravel_multi_index(patches, splits)
+
     def get_position_idx(self, i):
         particle_idx = 0
         if self.z_split == None:
@@ -254,6 +570,174 @@ class Particles_data():
         return particle_idx
 
 
+class Space_filling_curve:
+    """ Keys of Morton (Z-order) or Hilbert curve, computed for all particles at once.
+    Coordinates are scaled to integers of bits_2d or bits_3d bits, so a key fits in 64 bits """
+
+    orders = ['morton', 'hilbert']
+    # attribute of offset components of patches, which marks boxes of this order
+    order_attribute = 'patchOrder'
+    bits_2d = 32
+    bits_3d = 21
+
+
+def get_record_component_values(record, axis, size):
+    """ Values of record component in SI, constant components are expanded, missing components are zero """
+
+    if axis not in record:
+        return np.zeros(size)
+    component = record[axis]
+    unit_si = component.attrs.get('unitSI', 1.)
+    if isinstance(component, h5py.Dataset):
+        return get_dataset_view(component)[()] * unit_si
+    return np.full(size, component.attrs.get('value', 0.) * unit_si)
+
+
+def get_absolute_coordinates(group):
+    """ position + positionOffset in SI for each axis of particle group """
+
+    position = group['position']
+    axes_names = [axis for axis in ['x', 'y', 'z'] if axis in position]
+    size = position[axes_names[0]].shape[0]
+    coordinates = []
+    for axis in axes_names:
+        absolute_coordinate = get_record_component_values(position, axis, size)
+        if 'positionOffset' in group:
+            absolute_coordinate += get_record_component_values(group['positionOffset'], axis, size)
+        coordinates.append(absolute_coordinate)
+    return axes_names, coordinates
+
+
+def quantize_coordinates(coordinates, bits):
+    """ Scale each axis from its minimum and maximum to integers 0 .. 2**bits - 1 """
+
+    max_value = float(2 ** bits - 1)
+    integer_coordinates = []
+    for coordinate in coordinates:
+        min_coord = coordinate.min()
+        lenght = coordinate.max() - min_coord
+        if lenght == 0:
+            integer_coordinates.append(np.zeros(len(coordinate), dtype=np.uint64))
+            continue
+        scaled = np.floor((coordinate - min_coord) * (max_value / lenght))
+        integer_coordinates.append(np.clip(scaled, 0, max_value).astype(np.uint64))
+    return integer_coordinates
+
+
+def interleave_bits(integer_coordinates, bits):
+    """ Key with bits of all axes interleaved, the first axis is the most significant """
+
+    keys = np.zeros(len(integer_coordinates[0]), dtype=np.uint64)
+    one = np.uint64(1)
+    for bit in range(bits - 1, -1, -1):
+        for coordinate in integer_coordinates:
+            keys = (keys << one) | ((coordinate >> np.uint64(bit)) & one)
+    return keys
+
+
+def hilbert_transpose(integer_coordinates, bits):
+    """ Convert coordinates in place to transposed Hilbert index (J. Skilling, AIP Conf. Proc. 707, 2004) """
+
+    dimension = len(integer_coordinates)
+    X = integer_coordinates
+    Q = 1 << (bits - 1)
+    while Q > 1:
+        P = np.uint64(Q - 1)
+        for i in range(dimension):
+            upper_bit = (X[i] & np.uint64(Q)) != 0
+            X[0][upper_bit] ^= P
+            swap = (X[0] ^ X[i]) & P
+            swap[upper_bit] = 0
+            X[0] ^= swap
+            X[i] ^= swap
+        Q >>= 1
+
+    for i in range(1, dimension):
+        X[i] ^= X[i - 1]
+    gray = np.zeros(len(X[0]), dtype=np.uint64)
+    Q = 1 << (bits - 1)
+    while Q > 1:
+        gray[(X[dimension - 1] & np.uint64(Q)) != 0] ^= np.uint64(Q - 1)
+        Q >>= 1
+    for i in range(dimension):
+        X[i] ^= gray
+    return X
+
+
+def get_curve_keys(coordinates, order):
+    """ Morton or Hilbert key of each particle """
+
+    bits = Space_filling_curve.bits_3d if len(coordinates) > 2 else Space_filling_curve.bits_2d
+    integer_coordinates = quantize_coordinates(coordinates, bits)
+    if order == 'hilbert':
+        integer_coordinates = hilbert_transpose(integer_coordinates, bits)
+    return interleave_bits(integer_coordinates, bits)
+
+
+def split_balanced(size, number_patches):
+    """ Number of particles in each of number_patches contiguous ranges of nearly equal size """
+
+    bounds = (np.arange(number_patches + 1, dtype=np.int64) * size) // number_patches
+    return np.diff(bounds)
+
+
+def get_patches_boxes(sorted_coordinates, list_number_particles_in_parts):
+    """ Bounding box (offset, extent) of particles of each patch, zero for empty patches """
+
+    starts = np.cumsum(list_number_particles_in_parts) - list_number_particles_in_parts
+    not_empty = list_number_particles_in_parts > 0
+    offsets = []
+    extents = []
+    for coordinate in sorted_coordinates:
+        offset = np.zeros(len(starts))
+        extent = np.zeros(len(starts))
+        if len(coordinate) != 0:
+            minimums = np.minimum.reduceat(coordinate, starts[not_empty])
+            maximums = np.maximum.reduceat(coordinate, starts[not_empty])
+            offset[not_empty] = minimums
+            extent[not_empty] = maximums - minimums
+        offsets.append(offset)
+        extents.append(extent)
+    return offsets, extents
+
+
+def handle_particle_group_curve(group, file_with_patches, order, number_patches, jobs=1):
+    """ Sort particles by key of space-filling curve and cut patches with equal numbers of particles """
+
+    axes_names, coordinates = get_absolute_coordinates(group)
+    keys = get_curve_keys(coordinates, order)
+    resultArray = np.argsort(keys, kind='stable')
+    del keys
+
+    list_number_particles_in_parts = split_balanced(len(resultArray), number_patches)
+    sorted_coordinates = [coordinate[resultArray] for coordinate in coordinates]
+    offsets, extents = get_patches_boxes(sorted_coordinates, list_number_particles_in_parts)
+    del sorted_coordinates, coordinates
+
+    values_list = List_values()
+    group.visititems(values_list)
+    final_size = np.cumsum(list_number_particles_in_parts) - list_number_particles_in_parts
+    move_values(file_with_patches, final_size, values_list, resultArray, jobs=jobs)
+    return final_size, list_number_particles_in_parts, axes_names, offsets, extents
+
+
+def add_curve_patch_to_particle_group(group, order, final_size, list_number_particles_in_parts, axes_names,
+                                      offsets, extents):
+    """Add patches of space-filling curve order: one entry for each patch, offset and extent in SI
+    of position + positionOffset, the order is stored in an attribute of each offset component """
+
+    patch_group = group.require_group('ParticlePatches')
+    patch_group.create_dataset('numParticlesOffset', data=final_size, dtype=np.dtype('int64'))
+    patch_group.create_dataset('numParticles', data=list_number_particles_in_parts, dtype=np.dtype('int64'))
+    extent_group = patch_group.require_group('extent')
+    offset_group = patch_group.require_group('offset')
+    for axis, offset, extent in zip(axes_names, offsets, extents):
+        offset_dataset = offset_group.create_dataset(axis, data=offset)
+        offset_dataset.attrs['unitSI'] = 1.
+        offset_dataset.attrs[Space_filling_curve.order_attribute] = order
+        extent_group.create_dataset(axis, data=extent).attrs['unitSI'] = 1.
+
+
 def add_patch_to_particle_group(group, final_size, list_number_particles_in_parts, values_extent):
     """Add patch to ecach particle group: """
 
@@ -306,105 +790,212 @@ def add_offset(offset_group, values_extent):
 
 
 def test_patches(grid_sizes, devices_numbers, numParticlesOffset, arrayX, arrayY):
-
-    maxX = max(arrayX)
-    minX = min(arrayX)
-    if len(devices_numbers) == 3:
-        print('3-D patches')
-    elif len(devices_numbers) == 2:
-        print('2-d patches')
-        len_x = (grid_sizes[1] - grid_sizes[0]) / devices_numbers[0]
-        len_y = (grid_sizes[3] - grid_sizes[2]) / devices_numbers[1]
-
-        patchX = []
-        patchY = []
-        for i in range(0, devices_numbers[0]):
-            Xstart = grid_sizes[0] + i * len_x
-            Xend = 0
-            if i == devices_numbers[0]:
-                Xend = grid_sizes[1]
+    """ Print particles of 2D patches, which are outside of their patch """
+
+    numParticles = np.diff(numParticlesOffset)
+    report = check_patches([np.asarray(arrayX), np.asarray(arrayY)], grid_sizes, devices_numbers,
+                           numParticlesOffset, numParticles)
+    print_patches_report({'': report})
+    return report
+
+
+class Patches_report:
+    """ Verification report, one row for each patch:
+    violations - number of particles outside of patch box,
+    first_violations - indexes of first of them, -1 if there are less """
+
+    max_indices = 10
+
+    @staticmethod
+    def get_dtype(max_indices):
+        return np.dtype([('patch', np.int64), ('start', np.int64), ('count', np.int64),
+                         ('violations', np.int64), ('first_violations', np.int64, (max_indices,))])
+
+
+def get_grid_patches_ranges(grid_sizes, devices_numbers, tolerance=1e-9):
+    """ Lower and upper bounds of each grid patch on each axis, numbered as in Particles_data.
+    Outer patches are open to outside of grid, because such particles are clipped to them """
+
+    patch_indexes = np.unravel_index(np.arange(int(np.prod(devices_numbers))), devices_numbers)
+    lows = []
+    highs = []
+    for i, split in enumerate(devices_numbers):
+        min_coord = grid_sizes[2 * i]
+        max_coord = grid_sizes[2 * i + 1]
+        patch_lenght = (max_coord - min_coord) / split
+        bounds = min_coord + np.arange(split + 1) * patch_lenght
+        bounds[0] = -np.inf
+        bounds[-1] = np.inf
+        slack = tolerance * abs(patch_lenght)
+        lows.append(bounds[patch_indexes[i]] - slack)
+        highs.append(bounds[patch_indexes[i] + 1] + slack)
+    return lows, highs
+
+
+def check_patch_rows(coordinates, idx_start, patch_starts, patch_ends, lows, highs):
+    """ Rows of chunk, which are outside of box of their patch, rows after all patches count to the last one
+        Returns:
+         rows and patches of bad particles
+        """
+
+    rows = np.arange(idx_start, idx_start + len(coordinates[0]))
+    patches = np.searchsorted(patch_starts, rows, side='right') - 1
+    outside = patches < 0
+    np.maximum(patches, 0, out=patches)
+    outside |= rows >= patch_ends[patches]
+    for values, low, high in zip(coordinates, lows, highs):
+        outside |= (values < low[patches]) | (values > high[patches])
+    return rows[outside], patches[outside]
+
+
+def add_violations(report, rows, patches):
+    """ Count bad rows of chunk and keep first indexes for each patch """
+
+    max_indices = report['first_violations'].shape[1]
+    for patch in np.unique(patches):
+        stored = min(report['violations'][patch], max_indices)
+        if stored < max_indices:
+            patch_rows = rows[patches == patch][:max_indices - stored]
+            report['first_violations'][patch, stored:stored + len(patch_rows)] = patch_rows
+    report['violations'] += np.bincount(patches, minlength=len(report))
+
+
+def get_stored_patches_ranges(patch_group, axes_names, number_patches, tolerance=1e-9):
+    """ Lower and upper bounds in SI of boxes stored in offset and extent of patches, one box for each patch,
+    as written with -order. None for grid patches, their offset components have no order attribute """
+
+    lows = []
+    highs = []
+    for axis in axes_names:
+        offset = patch_group['offset'].get(axis)
+        extent = patch_group['extent'].get(axis)
+        if offset is None or extent is None or Space_filling_curve.order_attribute not in offset.attrs \
+                or offset.shape != (number_patches,) or extent.shape != (number_patches,):
+            return None
+        low = offset[()] * offset.attrs.get('unitSI', 1.)
+        high = low + extent[()] * extent.attrs.get('unitSI', 1.)
+        slack = tolerance * (np.abs(low) + np.abs(high))
+        lows.append(low - slack)
+        highs.append(high + slack)
+    return lows, highs
+
+
+class Absolute_coordinate:
+    """ position + positionOffset in SI of one axis of particle group, computed for the rows asked for """
+
+    def __init__(self, group, axis):
+        self.components = [group[record][axis] for record in ['position', 'positionOffset']
+                           if record in group and axis in group[record]]
+        self.views = [get_dataset_view(component) if isinstance(component, h5py.Dataset) else None
+                      for component in self.components]
+        self.shape = group['position'][axis].shape
+
+    def __getitem__(self, rows):
+        values = 0.
+        for component, view in zip(self.components, self.views):
+            unit_si = component.attrs.get('unitSI', 1.)
+            if view is None:
+                values = values + component.attrs.get('value', 0.) * unit_si
             else:
-                Xend = grid_sizes[0] + (i + 1) * len_x
-            patchX.append((Xstart, Xend))
-
-        for i in range(0, devices_numbers[1]):
-            Ystart = grid_sizes[2] + i * len_y
-            Yend = 0
-            if i == devices_numbers[1]:
-                Yend = grid_sizes[3]
+                values = values + np.asarray(view[rows]) * unit_si
+        return values
+
+
+def check_patches(axes, grid_sizes, devices_numbers, numParticlesOffset, numParticles, chunk_size=2**20,
+                  max_indices=Patches_report.max_indices, ranges=None):
+    """ Check that particles of each patch are inside of its box, in 1D, 2D or 3D,
+    axes - coordinates datasets or arrays, one for each value of devices_numbers,
+    ranges - (lows, highs) of boxes of patches on each axis, by default grid cells of grid_sizes and devices_numbers
+        Returns:
+         report array with dtype Patches_report.get_dtype
+        """
+
+    if ranges is None:
+        number_patches = int(np.prod(devices_numbers))
+        lows, highs = get_grid_patches_ranges(grid_sizes, devices_numbers)
+    else:
+        lows, highs = ranges
+        number_patches = len(lows[0])
+    patch_starts = np.asarray(numParticlesOffset[:number_patches], dtype=np.int64)
+    patch_counts = np.asarray(numParticles[:number_patches], dtype=np.int64)
+    patch_ends = patch_starts + patch_counts
+
+    report = np.zeros(number_patches, dtype=Patches_report.get_dtype(max_indices))
+    report['patch'] = np.arange(number_patches)
+    report['start'] = patch_starts
+    report['count'] = patch_counts
+    report['first_violations'] = -1
+
+    size = axes[0].shape[0]
+    for idx_start in range(0, size, chunk_size):
+        idx_end = min(idx_start + chunk_size, size)
+        coordinates = [np.asarray(axis[idx_start:idx_end]) for axis in axes]
+        rows, patches = check_patch_rows(coordinates, idx_start, patch_starts, patch_ends, lows, highs)
+        if len(rows) != 0:
+            add_violations(report, rows, patches)
+    return report
+
+
+def verify_patches(hdf_file_name, grid_sizes, devices_numbers, chunk_size=2**20,
+                   max_indices=Patches_report.max_indices):
+    """ Check patches of all particle groups of file with patches. Patches of space-filling curve order
+    are checked against their stored boxes with position + positionOffset in SI, grid_sizes is not used for them;
+    grid patches are checked against grid cells of grid_sizes and devices_numbers with position
+        Returns:
+         dict particle group name -> report array
+        """
+
+    grid_axes_names = ['x', 'y', 'z'][:len(devices_numbers)]
+    reports = {}
+    with h5py.File(hdf_file_name, 'r') as hdf_file:
+        hdf_datasets = Particles_groups(get_particles_name(hdf_file))
+        hdf_file.visititems(hdf_datasets)
+        for group in hdf_datasets.particles_groups:
+            if 'ParticlePatches' not in group:
+                continue
+            patch_group = group['ParticlePatches']
+            axes_names = [axis for axis in ['x', 'y', 'z'] if axis in group['position']]
+            ranges = get_stored_patches_ranges(patch_group, axes_names, len(patch_group['numParticles']))
+            if ranges is None:
+                axes = [get_dataset_view(group['position'][axis]) for axis in grid_axes_names]
             else:
-                Yend = grid_sizes[2] + (i + 1) * len_y
-            patchY.append((Ystart, Yend))
-
-        numXpatch = devices_numbers[0]
-        numYpatch = devices_numbers[1]
-
-        for i in range(0, numXpatch):
-            for j in range(0, numYpatch):
-                idx = j + i * numYpatch
-                check_particles_in_patch(numParticlesOffset[idx], numParticlesOffset[idx + 1], patchX[i], patchY[j], arrayX, arrayY)
-
-    elif len(devices_numbers) == 1:
-        print('1-d patches')
-
+                axes = [Absolute_coordinate(group, axis) for axis in axes_names]
+            reports[group.name] = check_patches(axes, grid_sizes, devices_numbers,
+                                                patch_group['numParticlesOffset'], patch_group['numParticles'],
+                                                chunk_size, max_indices, ranges)
+    return reports
 
-def check_particles_in_patch(idxStartPatch, idxEndPatch, rangeX, rangeY, arrayX, arrayY):
 
-    particle_in_patch = True
-    for i in range(idxStartPatch, idxEndPatch):
-        pointX = float(arrayX[i])
-        pointY = float(arrayY[i])
-      #  print('point ==  ' + str(pointX) +' , ' + str(pointY))
-        if point_in_range(rangeX, pointX) and point_in_range(rangeY, pointY):
-            particle_in_patch = True
-        else:
-            particle_in_patch = False
-            print('ERRROR!!!! point ' + str(pointX) + ', ' + str(pointY) + 'is not in: '+ str(rangeX) + ', '+ str(rangeY))
-        #    break
-    return particle_in_patch
-
-
-def point_in_range(rangePoint, point):
-    startValue = float(rangePoint[0])
-    endValue = float(rangePoint[1])
-    if startValue <= point and point <= endValue:
-        return True
-    else:
-        return False
+def print_patches_report(reports):
+    """ Print patches with particles outside of them """
 
+    for group_name, report in reports.items():
+        bad_patches = report[report['violations'] > 0]
+        print(group_name + ': ' + str(len(report)) + ' patches, ' + str(len(bad_patches)) + ' with violations')
+        for row in bad_patches:
+            first_violations = row['first_violations'][row['first_violations'] >= 0].tolist()
+            print('  patch ' + str(row['patch']) + ': ' + str(row['violations']) + ' of ' + str(row['count'])
+                  + ' particles outside, first ' + str(first_violations))
 
-def count_indexes(links_to_array, final_size, size_indexes, size_array):
-    """ Add offset group to particle group """
 
-    counter_indexes = np.zeros(size_indexes)
-    resultArray = np.zeros(max(size_indexes, size_array))
+def count_indexes(links_to_array):
+    """ Permutation, that sorts particles by patches and keeps their order inside of patch """
 
-    for i in range(0, len(links_to_array)):
-        xy_idx = links_to_array[i]
-        start_size = final_size[xy_idx]
-        adding_counter = counter_indexes[xy_idx]
-        resultArray[int(start_size + adding_counter)] = i
-        counter_indexes[xy_idx] = adding_counter + 1
-    return resultArray
+    return np.argsort(links_to_array, kind='stable')
 
 
 def points_to_patches(patch_data):
     """ Devide points to patches """
 
-    list_number_particles_in_parts = np.zeros(patch_data.get_size_split() + 1, dtype=int)
-    links_to_array = []
-    for i in range(0, patch_data.get_array_lenght()):
-        particle_idx = patch_data. get_position_idx(i)
-        sum_links = list_number_particles_in_parts[particle_idx]
-        list_number_particles_in_parts[particle_idx] = sum_links + 1
-        links_to_array.append(particle_idx)
+    links_to_array = patch_data.get_position_indexes()
+    list_number_particles_in_parts = np.bincount(links_to_array, minlength=patch_data.get_size_split() + 1)
     return list_number_particles_in_parts, links_to_array
 
 
-def divide_points_to_patches(size_array, size_indexes, list_number_particles_in_parts, links_to_array):
+def divide_points_to_patches(list_number_particles_in_parts, links_to_array):
     final_size = np.cumsum(list_number_particles_in_parts, dtype=int)
     final_size = np.insert(final_size, 0, 0)
-    resultArray = count_indexes(links_to_array, final_size, size_indexes, size_array)
+    resultArray = count_indexes(links_to_array)
     return resultArray, final_size
 
 
@@ -423,6 +1014,14 @@ def get_positon(max_coord, min_coord, separator, x_current):
     return max(0, min(int((x_current - min_coord) * separator / lenght), separator - 1))
 
 
+def get_positions(max_coord, min_coord, separator, coordinates):
+    """ Patch number of each coordinate along one axis, same as get_positon for each value """
+
+    lenght = max_coord - min_coord
+    scaled = (np.asarray(coordinates, dtype=np.float64) - min_coord) * separator / lenght
+    return np.clip(np.floor(scaled), 0, separator - 1).astype(np.int64)
+
+
 def get_particles_name(hdf_file):
     """ Get name of particles group """
 
@@ -443,7 +1042,8 @@ def decode_name(attribute_name):
     return decoding_name
 
 
-def add_patches(hdf_file, hdf_file_with_patches, grid_sizes, devices_number):
+def add_patches(hdf_file, hdf_file_with_patches, grid_sizes, devices_number, memory_budget=None, jobs=1,
+                order=None):
     """ Check correct of arguments"""
 
     name_of_file_with_patches = ''
@@ -456,7 +1056,8 @@ def add_patches(hdf_file, hdf_file_with_patches, grid_sizes, devices_number):
                 name_of_file_with_patches = hdf_file_with_patches + hdf_file[idx_of_name + 1: -4] + 'with_patches.h5'
             else:
                 name_of_file_with_patches = hdf_file_with_patches + hdf_file[:-3] + '.h5'
-            OpenPMD_add_patches(hdf_file, name_of_file_with_patches, grid_sizes, devices_number, field_size)
+            OpenPMD_add_patches(hdf_file, name_of_file_with_patches, grid_sizes, devices_number, field_size,
+                                memory_budget, jobs, order)
         else:
             print('The .hdf file does not exist')
 
@@ -472,9 +1073,25 @@ if __name__ == "__main__":
                         help="Size of the simulation grid in cells as x y z")
     parser.add_argument("-devicesNumber", type=int, nargs='*',
                         help="Number of devices in each dimension (x,y,z)")
+    parser.add_argument("-memoryBudget", type=float,
+                        help="Sort particles out of core with this working memory in MB, "
+                             "by default particles are sorted in memory")
+    parser.add_argument("-jobs", type=int, default=1,
+                        help="Number of processes sorting iterations and of threads reordering values in memory; "
+                             "reads and writes of one iteration are serial, h5py handles one call at a time")
+    parser.add_argument("-verify", action='store_true',
+                        help="Check patches of hdf file instead of adding them: grid patches against gridSize and "
+                             "devicesNumber, patches written with -order against their stored boxes")
+    parser.add_argument("-order", type=str, choices=Space_filling_curve.orders,
+                        help="Sort particles along Morton or Hilbert curve and cut product of devicesNumber "
+                             "patches with equal numbers of particles, gridSize is not used")
 
     args = parser.parse_args()
-    add_patches(args.hdf, args.result, args.gridSize, args.devicesNumber)
-
-
 
+    if args.verify:
+        print_patches_report(verify_patches(args.hdf, args.gridSize, args.devicesNumber))
+    else:
+        memory_budget = None
+        if args.memoryBudget != None:
+            memory_budget = args.memoryBudget * 2**20
+        add_patches(args.hdf, args.result, args.gridSize, args.devicesNumber, memory_budget, args.jobs, args.order)
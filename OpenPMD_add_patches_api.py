@@ -0,0 +1,292 @@
+""" Add particle patches to openPMD series through openPMD-api, for all iterations and backends (HDF5, ADIOS2)"""
+
+import argparse
+import re
+import numpy as np
+import openpmd_api
+from OpenPMD_add_patches import get_patch_data, count_indexes, Space_filling_curve, get_curve_keys, \
+    split_balanced, get_patches_boxes
+
+
+class Series_attributes:
+    """ Attributes of series, which are written by openPMD-api itself """
+
+    managed = ['basePath', 'iterationEncoding', 'iterationFormat', 'openPMD', 'openPMDextension']
+    # stored chunks are written to disk at each flush, ADIOS2 would keep them in its buffer by default
+    flush_to_disk = '{"adios2": {"engine": {"preferred_flush_target": "disk"}}}'
+
+
+class Component_copy:
+    """ Component of input series and its copy in result series.
+    Values are copied window by window, only a component reordered by permutation is loaded whole """
+
+    def __init__(self, component, result_component, series, result_series):
+        self.component = component
+        self.result_component = result_component
+        self.series = series
+        self.result_series = result_series
+        self.values = None
+
+    def get_values(self, size):
+        """ Values in units of component, constant component is expanded to size """
+
+        if self.component.constant:
+            return np.full(size, self.component.get_attribute('value'))
+        if self.values is None:
+            self.values = self.component.load_chunk()
+            self.series.flush()
+        return self.values
+
+    def store(self, chunk_size, permutation=None):
+        """ Write values, particles are reordered by permutation, loaded values are released """
+
+        component = self.component
+        self.result_component.reset_dataset(openpmd_api.Dataset(component.dtype, component.shape))
+        copy_attributes(component, self.result_component, ['shape', 'value'])
+        if component.constant:
+            self.result_component.make_constant(component.get_attribute('value'))
+            return
+        if np.prod(component.shape) == 0:
+            return
+        if permutation is None or len(component.shape) == 0 or component.shape[0] != len(permutation):
+            self.copy_windows(chunk_size)
+        else:
+            self.store_permuted(chunk_size, permutation)
+        self.values = None
+
+    def get_windows(self, chunk_size):
+        """ Offsets and extents of windows of about chunk_size values along the first axis """
+
+        shape = list(self.component.shape)
+        if len(shape) == 0:
+            return [([], [])]
+        rows = max(1, chunk_size // int(np.prod(shape[1:])))
+        return [([idx_start] + [0] * (len(shape) - 1), [min(rows, shape[0] - idx_start)] + shape[1:])
+                for idx_start in range(0, shape[0], rows)]
+
+    def store_window(self, chunk, offset, extent):
+        self.result_component.store_chunk(chunk, offset, extent)
+        self.result_series.flush(Series_attributes.flush_to_disk)
+
+    def copy_windows(self, chunk_size):
+        """ Copy values in the same order, one window is in memory """
+
+        for offset, extent in self.get_windows(chunk_size):
+            chunk = self.component.load_chunk(offset, extent)
+            self.series.flush()
+            self.store_window(chunk, offset, extent)
+
+    def store_permuted(self, chunk_size, permutation):
+        """ Write values[permutation], the whole component is loaded for random access of permutation """
+
+        values = self.get_values(len(permutation))
+        for offset, extent in self.get_windows(chunk_size):
+            idx_start = offset[0]
+            idx_end = idx_start + extent[0]
+            self.store_window(np.ascontiguousarray(values[permutation[idx_start:idx_end]]), offset, extent)
+
+
+def copy_attributes(source, target, skip=()):
+    """ Copy attributes with their types """
+
+    attribute_dtypes = source.attribute_dtypes
+    for name in source.attributes:
+        if name in skip:
+            continue
+        target.set_attribute(name, source.get_attribute(name), attribute_dtypes[name])
+
+
+def prepare_record(record, result_record, series, result_series):
+    """ Copy attributes of record, its components are copied by Component_copy.store """
+
+    copy_attributes(record, result_record)
+    components = {}
+    for name, component in record.items():
+        components[name] = Component_copy(component, result_record[name], series, result_series)
+    return components
+
+
+def get_species_size(records):
+    """ Number of particles of species """
+
+    for name, component in records['position'].items():
+        return int(np.prod(component.component.shape))
+    return 0
+
+
+def count_grid_patches(records, grid_sizes, devices_numbers):
+    """ Regular grid patches from position values, same splitting as OpenPMD_add_patches.
+    Offsets and extents are in units of position, unitSI is the one of position, positionOffset is not included
+        Returns:
+         permutation, number of particles in each patch, offsets and extents of patches, their unitSI
+        """
+
+    size = get_species_size(records)
+    axes_names = [axis for axis in ['x', 'y', 'z'] if axis in records['position']][:len(devices_numbers)]
+    coordinates = [records['position'][axis].get_values(size) for axis in axes_names]
+    list_z = coordinates[2] if len(coordinates) > 2 else []
+    patch_data = get_patch_data(coordinates[0], coordinates[1], list_z, grid_sizes, devices_numbers)
+    links_to_array = patch_data.get_position_indexes()
+    number_patches = patch_data.get_size_split()
+    list_number_particles_in_parts = np.bincount(links_to_array, minlength=number_patches)
+
+    splits = devices_numbers[:len(axes_names)]
+    patch_indexes = np.unravel_index(np.arange(number_patches), splits)
+    offsets = {}
+    extents = {}
+    for i, axis in enumerate(axes_names):
+        patch_lenght = (grid_sizes[2 * i + 1] - grid_sizes[2 * i]) / splits[i]
+        offsets[axis] = grid_sizes[2 * i] + patch_indexes[i] * patch_lenght
+        extents[axis] = np.full(number_patches, patch_lenght)
+    unit_si = records['position'][axes_names[0]].component.unit_SI
+    return count_indexes(links_to_array), list_number_particles_in_parts, offsets, extents, unit_si
+
+
+def get_absolute_coordinates(records, size):
+    """ position + positionOffset in SI for each axis """
+
+    coordinates = {}
+    for axis, position in records['position'].items():
+        absolute_coordinate = position.get_values(size) * position.component.unit_SI
+        if 'positionOffset' in records and axis in records['positionOffset']:
+            offset = records['positionOffset'][axis]
+            absolute_coordinate = absolute_coordinate + offset.get_values(size) * offset.component.unit_SI
+        coordinates[axis] = absolute_coordinate
+    return coordinates
+
+
+def count_curve_patches(records, order, number_patches):
+    """ Patches with equal numbers of particles along space-filling curve. Unlike count_grid_patches,
+    offsets and extents are bounding boxes of position + positionOffset in SI, so their unitSI is 1
+        Returns:
+         permutation, number of particles in each patch, offsets and extents of patches, their unitSI
+        """
+
+    size = get_species_size(records)
+    coordinates = get_absolute_coordinates(records, size)
+    axes_names = list(coordinates.keys())
+    permutation = np.argsort(get_curve_keys([coordinates[axis] for axis in axes_names], order), kind='stable')
+    list_number_particles_in_parts = split_balanced(size, number_patches)
+    sorted_coordinates = [coordinates[axis][permutation] for axis in axes_names]
+    offsets, extents = get_patches_boxes(sorted_coordinates, list_number_particles_in_parts)
+    return permutation, list_number_particles_in_parts, dict(zip(axes_names, offsets)), \
+        dict(zip(axes_names, extents)), 1.
+
+
+def store_patch_values(patch_component, dtype, values):
+    """ Write one value for each patch as one chunk """
+
+    patch_component.reset_dataset(openpmd_api.Dataset(dtype, [len(values)]))
+    if len(values) != 0:
+        patch_component.store_chunk(np.ascontiguousarray(values, dtype=dtype), [0], [len(values)])
+
+
+def add_particle_patches(species, list_number_particles_in_parts, offsets, extents, unit_si, order=None):
+    """ Write particlePatches records of species, offset components of curve patches get the order attribute """
+
+    SCALAR = openpmd_api.Patch_Record_Component.SCALAR
+    patches = species.particle_patches
+    numParticlesOffset = np.cumsum(list_number_particles_in_parts) - list_number_particles_in_parts
+    store_patch_values(patches["numParticles"][SCALAR], np.dtype('uint64'), list_number_particles_in_parts)
+    store_patch_values(patches["numParticlesOffset"][SCALAR], np.dtype('uint64'), numParticlesOffset)
+    for axis in offsets:
+        store_patch_values(patches["offset"][axis], np.dtype('float64'), offsets[axis])
+        store_patch_values(patches["extent"][axis], np.dtype('float64'), extents[axis])
+        patches["offset"][axis].set_unit_SI(unit_si)
+        patches["extent"][axis].set_unit_SI(unit_si)
+        if order != None:
+            patches["offset"][axis].set_attribute(Space_filling_curve.order_attribute, order)
+
+
+def get_result_encoding(series, result_series_name):
+    """ Iteration encoding of result series: file-based if result_series_name has a %T pattern,
+    otherwise the one of input series with file-based series written group-based """
+
+    if re.search('%(0[0-9]+)?T', result_series_name) != None:
+        return openpmd_api.Iteration_Encoding.file_based
+    if series.iteration_encoding == openpmd_api.Iteration_Encoding.file_based:
+        return openpmd_api.Iteration_Encoding.group_based
+    return series.iteration_encoding
+
+
+def patch_iteration(series, result_series, iteration, result_iteration, grid_sizes, devices_numbers, order,
+                    chunk_size):
+    """ Copy one iteration with particles of each species sorted by patches.
+    Datasets are copied in windows of chunk_size values with a flush of both series for each window,
+    positions of species are loaded whole to find the patches, other particle records one component at a time """
+
+    copy_attributes(iteration, result_iteration)
+    for name, mesh in iteration.meshes.items():
+        for component in prepare_record(mesh, result_iteration.meshes[name], series, result_series).values():
+            component.store(chunk_size)
+
+    for species_name, species in iteration.particles.items():
+        result_species = result_iteration.particles[species_name]
+        copy_attributes(species, result_species)
+        records = {}
+        for record_name, record in species.items():
+            records[record_name] = prepare_record(record, result_species[record_name], series, result_series)
+        permutation = None
+        if 'position' in records:
+            if order != None:
+                patches = count_curve_patches(records, order, int(np.prod(devices_numbers)))
+            else:
+                patches = count_grid_patches(records, grid_sizes, devices_numbers)
+            permutation = patches[0]
+            add_particle_patches(result_iteration.particles[species_name], *patches[1:], order=order)
+        for components in records.values():
+            for component in components.values():
+                component.store(chunk_size, permutation)
+
+    result_iteration.close()
+    iteration.close()
+
+
+def openPMD_add_patches(input_series_name, result_series_name, grid_sizes, devices_numbers, order=None,
+                        chunk_size=2**20):
+    """ Write copy of series with particle patches in each iteration
+        Args:
+         input_series_name - path to input series, backend is chosen by extension (.h5, .bp)
+         result_series_name - path to result series, may use other backend. Result is file-based
+         if result_series_name has %T, otherwise file-based input is written group-based to one file
+         grid_sizes - ranges of position values as x_min x_max y_min y_max (z_min z_max)
+         devices_numbers - number of patches on each axis
+         order - 'morton' or 'hilbert' to sort particles along space-filling curve and cut
+         prod(devices_numbers) patches with equal numbers of particles, grid_sizes is not used
+         chunk_size - number of values in one loaded and stored window
+        """
+
+    series = openpmd_api.Series(input_series_name, openpmd_api.Access.read_only)
+    result_series = openpmd_api.Series(result_series_name, openpmd_api.Access.create)
+    copy_attributes(series, result_series, Series_attributes.managed)
+    result_series.set_iteration_encoding(get_result_encoding(series, result_series_name))
+
+    for index in series.iterations:
+        patch_iteration(series, result_series, series.iterations[index], result_series.iterations[index],
+                        grid_sizes, devices_numbers, order, chunk_size)
+
+    result_series.close()
+    series.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="add patches to openPMD series through openPMD-api")
+    parser.add_argument("-input", metavar='input_series', type=str,
+                        help="openPMD series without patches, .h5 or .bp")
+    parser.add_argument("-result", metavar='result_series', type=str,
+                        help="openPMD series with patches, .h5 or .bp; file-based with %%T in the name, "
+                             "otherwise file-based input is written group-based to one file")
+    parser.add_argument("-gridSize", type=float, nargs='*',
+                        help="Range of position values as x_min x_max y_min y_max (z_min z_max)")
+    parser.add_argument("-devicesNumber", type=int, nargs='*',
+                        help="Number of devices in each dimension (x,y,z)")
+    parser.add_argument("-order", type=str, choices=Space_filling_curve.orders,
+                        help="Sort particles along Morton or Hilbert curve and cut product of devicesNumber "
+                             "patches with equal numbers of particles, gridSize is not used")
+    parser.add_argument("-chunk", type=int, default=2**20,
+                        help="Number of values in one loaded and stored window")
+
+    args = parser.parse_args()
+
+    openPMD_add_patches(args.input, args.result, args.gridSize, args.devicesNumber, args.order, args.chunk)
@@ -0,0 +1,76 @@
+"""Micro-benchmark of parsing GDF block headers: blocks per second on a file with many small blocks"""
+
+import argparse
+import os
+import struct
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from gdf_to_openPMD import read_gdf_blocks, decode_name, Constants
+
+
+def write_small_blocks_file(file_directory, number_blocks):
+    """ GDF file with time values and one element arrays """
+
+    with open(file_directory, 'wb') as gdf_file:
+        gdf_file.write(struct.pack('ii', Constants.GDFID, 0))
+        gdf_file.write(b'benchmark'.ljust(Constants.GDFNAMELEN, b'\x00'))
+        gdf_file.write(b''.ljust(Constants.GDFNAMELEN, b'\x00'))
+        gdf_file.write(bytes([1, 1, 3, 0, 0, 0, 0, 0]))
+        names = [b'time', b'x', b'y', b'z', b'Bx', b'By', b'Bz', b'G']
+        for i in range(number_blocks):
+            name = names[i % len(names)]
+            primitive_type = 0x403 if name == b'time' else 0x803
+            gdf_file.write(Constants.BLOCKHEADER.pack(name, primitive_type, 8))
+            gdf_file.write(struct.pack('d', float(i)))
+
+
+def read_blocks_unbuffered(gdf_file):
+    """ Previous parsing: separate reads of name, type and size, peek of one byte,
+    decoding of name for each block """
+
+    gdf_file.seek(Constants.GDFHEADERSIZE)
+    number_blocks = 0
+    while True:
+        if gdf_file.read(1) == b'':
+            break
+        gdf_file.seek(-1, 1)
+        name = gdf_file.read(16)
+        decode_name(name.split()[0])
+        primitive_type = struct.unpack('i', gdf_file.read(4))[0]
+        size = struct.unpack('i', gdf_file.read(4))[0]
+        gdf_file.seek(size, 1)
+        number_blocks += 1
+    return number_blocks
+
+
+def read_blocks_buffered(gdf_file):
+    number_blocks = 0
+    for block in read_gdf_blocks(gdf_file):
+        number_blocks += 1
+    return number_blocks
+
+
+def measure(name, function, file_directory):
+    with open(file_directory, 'rb') as gdf_file:
+        start = time.perf_counter()
+        number_blocks = function(gdf_file)
+        duration = time.perf_counter() - start
+    print('{:12s} {:10d} blocks {:8.3f} s {:14.0f} blocks/s'.format(name, number_blocks, duration,
+                                                                    number_blocks / duration))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="benchmark of GDF block header parsing")
+    parser.add_argument("-blocks", metavar='blocks', type=int, default=1000000,
+                        help="number of blocks in synthetic file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_directory = os.path.join(directory, 'small_blocks.gdf')
+        write_small_blocks_file(file_directory, args.blocks)
+        measure('unbuffered', read_blocks_unbuffered, file_directory)
+        measure('buffered', read_blocks_buffered, file_directory)
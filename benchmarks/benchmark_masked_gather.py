@@ -0,0 +1,97 @@
+"""Peak memory and throughput of masked gather of particle columns on a synthetic file"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import tempfile
+import h5py
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hdf-to-txt'))
+from get_fields_and_particles import mask_datasets
+
+
+def write_columns_file(file_directory, number_rows, number_columns, chunk_size=2**22):
+    """ h5 file with number_columns float32 datasets of number_rows rows, written chunk by chunk """
+
+    random = np.random.default_rng(0)
+    with h5py.File(file_directory, 'w') as hdf_file:
+        for column in range(number_columns):
+            dataset = hdf_file.create_dataset('column_{}'.format(column), shape=(number_rows,), dtype=np.float32)
+            for idx_start in range(0, number_rows, chunk_size):
+                idx_end = min(idx_start + chunk_size, number_rows)
+                dataset[idx_start:idx_end] = random.random(idx_end - idx_start, dtype=np.float32)
+
+
+def mask_concatenate(array, mask, stepsize=2**20):
+    """ Previous implementation of get_fields_and_particles.mask: list of masked blocks and concatenate """
+
+    return np.concatenate([array[a:a+stepsize][mask[a:a+stepsize]] for a in range(0, mask.shape[0], stepsize)])
+
+
+def create_mask(size, fraction, chunk_size=2**22):
+    """ Random mask, made block by block so that it does not raise peak memory """
+
+    random = np.random.default_rng(1)
+    mask = np.empty(size, dtype=bool)
+    for idx_start in range(0, size, chunk_size):
+        idx_end = min(idx_start + chunk_size, size)
+        mask[idx_start:idx_end] = random.random(idx_end - idx_start) < fraction
+    return mask
+
+
+def get_peak_rss():
+    """ Peak resident memory of this process in bytes """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
+
+
+def measure(file_directory, method, fraction, result_queue):
+    """ Runs in a fresh process, so peak memory belongs to one method only """
+
+    with h5py.File(file_directory, 'r') as hdf_file:
+        datasets = [hdf_file[name] for name in sorted(hdf_file.keys())]
+        mask = create_mask(datasets[0].shape[0], fraction)
+        baseline = get_peak_rss()
+        start = time.perf_counter()
+        if method == 'concatenate':
+            results = [mask_concatenate(dataset, mask) for dataset in datasets]
+        else:
+            results = mask_datasets(datasets, mask)
+        duration = time.perf_counter() - start
+        result_bytes = sum(result.nbytes for result in results)
+        result_queue.put((duration, get_peak_rss() - baseline, result_bytes))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="benchmark of masked gather of particle columns")
+    parser.add_argument("-rows", metavar='rows', type=int, default=10**8,
+                        help="number of rows in each column")
+    parser.add_argument("-columns", metavar='columns', type=int, default=14,
+                        help="number of float32 columns")
+    parser.add_argument("-fraction", metavar='fraction', type=float, default=0.5,
+                        help="fraction of selected rows")
+    parser.add_argument("-directory", metavar='directory', type=str, default=None,
+                        help="directory for the synthetic file, by default a temporary directory")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        file_directory = os.path.join(directory, 'columns.h5')
+        write_columns_file(file_directory, args.rows, args.columns)
+        input_bytes = args.rows * args.columns * 4
+        context = multiprocessing.get_context('spawn')
+        for method in ['concatenate', 'mask_datasets']:
+            result_queue = context.Queue()
+            process = context.Process(target=measure, args=(file_directory, method, args.fraction, result_queue))
+            process.start()
+            duration, peak_memory, result_bytes = result_queue.get()
+            process.join()
+            print('{:14s} {:8.3f} s {:8.1f} MB/s  peak memory above mask {:8.1f} MB  (result {:8.1f} MB)'.format(
+                method, duration, input_bytes / duration / 2**20, peak_memory / 2**20, result_bytes / 2**20))
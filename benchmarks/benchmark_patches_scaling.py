@@ -0,0 +1,68 @@
+"""Scaling benchmark of OpenPMD_add_patches with the number of jobs on a synthetic multi-iteration file.
+Only counting of patches (one process per iteration) and reordering of values in memory (threads) run
+in parallel, reads and writes through h5py are serial, so the speedup is bounded by the serial part,
+by the number of iterations and by the CPUs available. Parallel efficiency is printed next to speedup"""
+
+import argparse
+import os
+import sys
+import time
+import tempfile
+import h5py
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from OpenPMD_add_patches import OpenPMD_add_patches
+
+
+def write_particles_file(file_directory, number_iterations, number_particles):
+    """ openPMD file with one species in each iteration and the usual PIConGPU records """
+
+    random = np.random.default_rng(0)
+    with h5py.File(file_directory, 'w') as hdf_file:
+        hdf_file.attrs['particlesPath'] = np.bytes_(b'particles/')
+        for iteration in range(number_iterations):
+            species = hdf_file.create_group('/data/{}/particles/e'.format(iteration))
+            for record in ['position', 'positionOffset', 'momentum', 'momentumPrev1']:
+                for axis in ['x', 'y', 'z']:
+                    values = random.random(number_particles)
+                    if record == 'positionOffset':
+                        values = random.integers(0, 256, number_particles).astype(np.int32)
+                    species.create_dataset(record + '/' + axis, data=values).attrs['unitSI'] = 1.
+            species.create_dataset('weighting', data=random.random(number_particles)).attrs['unitSI'] = 1.
+            species.create_dataset('id', data=np.arange(number_particles, dtype=np.uint64)).attrs['unitSI'] = 1.
+
+
+def measure(file_directory, result_directory, jobs):
+    start = time.perf_counter()
+    OpenPMD_add_patches(file_directory, result_directory, [0., 1., 0., 1., 0., 1.], [4, 4, 4], 0.00001,
+                        jobs=jobs)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="scaling benchmark of particle patching")
+    parser.add_argument("-iterations", metavar='iterations', type=int, default=4,
+                        help="number of iterations in synthetic file")
+    parser.add_argument("-particles", metavar='particles', type=int, default=2000000,
+                        help="number of particles in each iteration")
+    parser.add_argument("-jobs", metavar='jobs', type=int, nargs='*', default=[1, 2, 4],
+                        help="numbers of jobs to measure")
+    args = parser.parse_args()
+
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    print('cpus {}, iterations {}, h5py reads and writes are serial'.format(cpus, args.iterations))
+    with tempfile.TemporaryDirectory() as directory:
+        file_directory = os.path.join(directory, 'particles.h5')
+        write_particles_file(file_directory, args.iterations, args.particles)
+        reference = None
+        reference_jobs = args.jobs[0]
+        for jobs in args.jobs:
+            duration = measure(file_directory, os.path.join(directory, 'patches_{}.h5'.format(jobs)), jobs)
+            if reference is None:
+                reference = duration
+            speedup = reference / duration
+            print('jobs {:3d} {:8.3f} s speedup {:5.2f} vs jobs {} efficiency {:5.2f}{}'.format(
+                jobs, duration, speedup, reference_jobs, speedup * reference_jobs / jobs,
+                '' if jobs <= cpus else ' (only {} cpus)'.format(cpus)))
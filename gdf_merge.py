@@ -0,0 +1,75 @@
+"""Join GDF shards written by openPMD_to_gdf.py -shard k/N into one GDF file"""
+
+
+from __future__ import division
+import argparse
+from gdf_to_openPMD import read_gdf_blocks, Constants
+from gdf_subset import Block_copier, copy_file_range
+
+
+def check_shards_blocks(shards_blocks, shards_directories):
+    """ All shards need the same blocks, only sizes of arrays may differ """
+
+    for blocks, directory in zip(shards_blocks[1:], shards_directories[1:]):
+        if len(blocks) != len(shards_blocks[0]):
+            raise ValueError(directory + ' has other blocks than ' + shards_directories[0])
+        for block, first_block in zip(blocks, shards_blocks[0]):
+            if block.name != first_block.name or block.primitive_type != first_block.primitive_type:
+                raise ValueError(directory + ' has block ' + block.name + ' instead of ' + first_block.name)
+            if not block.is_array() and block.size != first_block.size:
+                raise ValueError(directory + ' has other size of block ' + block.name)
+
+
+def write_array_header(block, size, gdf_file):
+    """ Header of array block with size bytes of data """
+
+    name = block.name.encode('ascii')
+    gdf_file.write(Constants.BLOCKHEADER.pack(name, block.primitive_type, size))
+
+
+def gdf_merge(shards_directories, result_directory):
+    """ Write GDF file with arrays of shards joined in order of shards_directories.
+    Header and other blocks are copied from the first shard, data of arrays are copied
+    from each shard with copy_file_range, so the result is the same as the conversion without shards
+        Args:
+         shards_directories - paths to shards 0/N .. N-1/N
+         result_directory - path to result GDF file
+        """
+
+    shards_files = [open(directory, 'rb') for directory in shards_directories]
+    try:
+        shards_blocks = [list(read_gdf_blocks(shard_file)) for shard_file in shards_files]
+        check_shards_blocks(shards_blocks, shards_directories)
+        with open(result_directory, 'wb') as result_file:
+            copier = Block_copier(shards_files[0].fileno(), result_file)
+            copier.add(0, Constants.GDFHEADERSIZE)
+            for blocks in zip(*shards_blocks):
+                block = blocks[0]
+                if not block.is_array():
+                    copier.add(block.data_offset - Constants.GDFBLOCKHEADERSIZE, block.data_offset + block.size)
+                    continue
+                copier.flush()
+                write_array_header(block, sum(shard_block.size for shard_block in blocks), result_file)
+                for shard_file, shard_block in zip(shards_files, blocks):
+                    copy_file_range(shard_file.fileno(), result_file, shard_block.data_offset, shard_block.size)
+            copier.flush()
+    finally:
+        for shard_file in shards_files:
+            shard_file.close()
+
+
+if __name__ == "__main__":
+
+    """ Parse arguments from command line """
+
+    parser = argparse.ArgumentParser(description="join gdf shards into one gdf file")
+
+    parser.add_argument("-shards", metavar='shards', type=str, nargs='*',
+                        help="gdf shards in order 0/N .. N-1/N")
+
+    parser.add_argument("-result", metavar='result_file', type=str,
+                        help="result gdf file")
+
+    args = parser.parse_args()
+
+    gdf_merge(args.shards, args.result)
@@ -0,0 +1,222 @@
+"""Beam statistics of each output step of GDF file, without conversion to openPMD"""
+
+
+from __future__ import division
+import argparse
+import numpy as np
+from gdf_to_openPMD import get_gdf_block_index, open_gdf_buffer, get_gdf_array
+
+
+class Quantities:
+    """ Quantities of particles, which moments are computed
+    GBx, GBy, GBz - normalized momentum, G - Lorentz factor
+        """
+
+    names = ['x', 'y', 'z', 'GBx', 'GBy', 'GBz', 'G']
+    emittance_pairs = {'nemixrms': ('x', 'GBx'), 'nemiyrms': ('y', 'GBy'), 'nemizrms': ('z', 'GBz')}
+
+
+class Weighted_moments:
+    """ Weighted mean and covariance of several quantities, accumulated chunk by chunk.
+    Chunks are merged with the pairwise update of Chan et al., so large offsets
+    (e.g. z of a bunch far from origin) do not cancel out small spreads.
+        """
+
+    def __init__(self, number_quantities):
+        self.weight = 0.
+        self.mean = np.zeros(number_quantities)
+        self.comoment = np.zeros((number_quantities, number_quantities))
+
+    def add(self, values, weights):
+        """ values - array of shape (number quantities, chunk size) """
+
+        chunk_weight = weights.sum()
+        if chunk_weight == 0:
+            return
+        chunk_mean = values.dot(weights) / chunk_weight
+        deviation = values - chunk_mean[:, np.newaxis]
+        chunk_comoment = (deviation * weights).dot(deviation.T)
+
+        delta = chunk_mean - self.mean
+        total_weight = self.weight + chunk_weight
+        self.comoment += chunk_comoment + np.outer(delta, delta) * (self.weight * chunk_weight / total_weight)
+        self.mean += delta * (chunk_weight / total_weight)
+        self.weight = total_weight
+
+    def get_covariance(self):
+        if self.weight == 0:
+            return np.full(self.comoment.shape, np.nan)
+        return self.comoment / self.weight
+
+
+def get_stats_names():
+    """ Names of columns of result table """
+
+    names = ['step', 'time', 'position', 'num', 'nmacro']
+    for quantity in Quantities.names:
+        names.append('avg' + quantity)
+    for quantity in Quantities.names:
+        names.append('std' + quantity)
+    for name_x, name_momentum in Quantities.emittance_pairs.values():
+        names.append('cov' + name_x + name_momentum)
+    names.extend(Quantities.emittance_pairs.keys())
+    names.append('spreadG')
+    return names
+
+
+def get_available_quantities(arrays):
+    """ Quantities, which can be computed from arrays of step """
+
+    available = []
+    has_momentum = all(name in arrays for name in ['Bx', 'By', 'Bz'])
+    for quantity in Quantities.names:
+        if quantity in arrays:
+            available.append(quantity)
+        elif quantity.startswith('GB') and quantity[1:] in arrays and ('G' in arrays or has_momentum):
+            available.append(quantity)
+        elif quantity == 'G' and has_momentum:
+            available.append(quantity)
+    return available
+
+
+def read_chunk_quantities(columns, available, idx_start, idx_end):
+    """ Values of available quantities in rows idx_start:idx_end """
+
+    chunk = {}
+    for name, column in columns.items():
+        chunk[name] = column[idx_start:idx_end]
+
+    if 'G' in chunk:
+        lorentz_factor = chunk['G']
+    elif all(name in chunk for name in ['Bx', 'By', 'Bz']):
+        lorentz_factor = 1. / np.sqrt(1. - chunk['Bx'] ** 2 - chunk['By'] ** 2 - chunk['Bz'] ** 2)
+    else:
+        lorentz_factor = None
+
+    values = np.empty((len(available), idx_end - idx_start))
+    for i, quantity in enumerate(available):
+        if quantity == 'G':
+            values[i] = lorentz_factor
+        elif quantity.startswith('GB'):
+            np.multiply(lorentz_factor, chunk[quantity[1:]], out=values[i])
+        else:
+            values[i] = chunk[quantity]
+    return values
+
+
+def compute_step_stats(gdf_buffer, step, chunk_size):
+    """ Compute weighted moments of one output step in one pass over its arrays """
+
+    available = get_available_quantities(step.arrays)
+    column_names = ['x', 'y', 'z', 'Bx', 'By', 'Bz', 'G']
+    columns = {}
+    for name in column_names:
+        if name in step.arrays:
+            columns[name] = get_gdf_array(gdf_buffer, step.arrays[name])
+    weights_column = None
+    if 'nmacro' in step.arrays:
+        weights_column = get_gdf_array(gdf_buffer, step.arrays['nmacro'])
+
+    size = step.get_size()
+    moments = Weighted_moments(len(available))
+    for idx_start in range(0, size, chunk_size):
+        idx_end = min(idx_start + chunk_size, size)
+        values = read_chunk_quantities(columns, available, idx_start, idx_end)
+        if weights_column is None:
+            weights = np.ones(idx_end - idx_start)
+        else:
+            weights = np.asarray(weights_column[idx_start:idx_end])
+        moments.add(values, weights)
+
+    return get_step_record(step, available, moments, size)
+
+
+def get_step_record(step, available, moments, size):
+    """ Row of result table for one step """
+
+    record = dict.fromkeys(get_stats_names(), np.nan)
+    record['step'] = step.number
+    record['time'] = step.values.get('time', np.nan)
+    record['position'] = step.values.get('position', np.nan)
+    record['num'] = size
+    record['nmacro'] = moments.weight
+
+    covariance = moments.get_covariance()
+    idx = {quantity: i for i, quantity in enumerate(available)}
+    for quantity, i in idx.items():
+        record['avg' + quantity] = moments.mean[i]
+        record['std' + quantity] = np.sqrt(covariance[i, i])
+
+    for name, (name_x, name_momentum) in Quantities.emittance_pairs.items():
+        if name_x in idx and name_momentum in idx:
+            i = idx[name_x]
+            j = idx[name_momentum]
+            record['cov' + name_x + name_momentum] = covariance[i, j]
+            record[name] = np.sqrt(max(covariance[i, i] * covariance[j, j] - covariance[i, j] ** 2, 0.))
+
+    if 'G' in idx:
+        record['spreadG'] = record['stdG'] / record['avgG']
+    return record
+
+
+def is_particles_step(step):
+    return len(get_available_quantities(step.arrays)) != 0
+
+
+def gdf_stats(gdf_file_directory, chunk_size=1000000):
+    """ Compute beam statistics for each particle output step of gdf file
+        Args:
+         gdf_file_directory - path to GDF file
+         chunk_size - number of particles read at once
+        Returns:
+         structured numpy array, one row for each step, columns from get_stats_names()
+        """
+
+    names = get_stats_names()
+    records = []
+    with open(gdf_file_directory, 'rb') as gdf_file:
+        steps = get_gdf_block_index(gdf_file)
+        gdf_buffer = open_gdf_buffer(gdf_file)
+        for step in steps:
+            if is_particles_step(step):
+                records.append(compute_step_stats(gdf_buffer, step, chunk_size))
+        gdf_buffer.close()
+
+    result = np.zeros(len(records), dtype=[(name, np.dtype('f8')) for name in names])
+    for i, record in enumerate(records):
+        result[i] = tuple(record[name] for name in names)
+    return result
+
+
+def save_stats(stats, output_directory):
+    """ Write statistics as .npy file or, for other extensions, as CSV table """
+
+    if output_directory.endswith('.npy'):
+        np.save(output_directory, stats)
+    else:
+        np.savetxt(output_directory, stats, delimiter=',', header=','.join(stats.dtype.names), comments='')
+
+
+if __name__ == "__main__":
+
+    """ Parse arguments from command line """
+
+    parser = argparse.ArgumentParser(description="beam statistics of gdf file")
+
+    parser.add_argument("-gdf", metavar='gdf_file', type=str,
+                        help="input gdf file")
+
+    parser.add_argument("-output", metavar='output', type=str,
+                        help="result file, .npy or .csv, by default gdf_file + .csv")
+
+    parser.add_argument("-chunk", metavar='chunk', type=int, default=1000000,
+                        help="number of particles read at once")
+
+    args = parser.parse_args()
+
+    output = args.output
+    if output == None:
+        output = args.gdf[:-4] + '.csv'
+        print('Destination file not specified. Defaulting to ' + output)
+
+    save_stats(gdf_stats(args.gdf, args.chunk), output)
@@ -0,0 +1,207 @@
+"""Copy chosen output steps, arrays and rows of GDF file into a new GDF file"""
+
+
+from __future__ import division
+import argparse
+import os
+import struct
+from gdf_to_openPMD import read_gdf_blocks, open_gdf_buffer, get_gdf_array, Block_types, Constants
+from gdf_writer import write_dataset_header
+
+
+def is_directory_end(block):
+    return block.primitive_type & Block_types.edir > 0
+
+
+def split_blocks_to_steps(gdf_file):
+    """ Split all blocks of gdf file to output steps.
+    Blocks before a run of arrays (time, position, var, ...) belong to the step of the arrays,
+    the directory end following the arrays closes the same step.
+        Returns:
+           list of blocks for each step
+           trailing_blocks - blocks after the last step, which belong to no step
+        """
+
+    steps_blocks = []
+    pending = []
+    in_arrays = False
+    for block in read_gdf_blocks(gdf_file):
+        if block.is_array():
+            if not in_arrays:
+                steps_blocks.append(pending)
+                pending = []
+                in_arrays = True
+            steps_blocks[-1].append(block)
+            continue
+
+        if len(steps_blocks) != 0 and len(pending) == 0 and is_directory_end(block):
+            steps_blocks[-1].append(block)
+        else:
+            pending.append(block)
+        in_arrays = False
+
+    return steps_blocks, pending
+
+
+def copy_file_range(source_fd, gdf_file, offset, count):
+    """ Copy count bytes from offset of source file to the end of gdf_file,
+    in kernel space if copy_file_range or sendfile is available """
+
+    gdf_file.flush()
+    target_fd = gdf_file.fileno()
+    try:
+        while count > 0:
+            if hasattr(os, 'copy_file_range'):
+                copied = os.copy_file_range(source_fd, target_fd, count, offset)
+            else:
+                copied = os.sendfile(target_fd, source_fd, offset, count)
+            if copied == 0:
+                break
+            offset += copied
+            count -= copied
+    except OSError:
+        pass
+
+    if count > 0:
+        with os.fdopen(os.dup(source_fd), 'rb') as source:
+            source.seek(offset)
+            copy_stream(source, gdf_file, count)
+    gdf_file.seek(0, os.SEEK_END)
+
+
+def copy_stream(source, gdf_file, count):
+    """ Copy count bytes by ordinary reads and writes """
+
+    gdf_file.seek(0, os.SEEK_END)
+    while count > 0:
+        data = source.read(min(count, 1 << 24))
+        if len(data) == 0:
+            break
+        gdf_file.write(data)
+        count -= len(data)
+
+
+class Block_copier:
+    """ Copy untouched blocks, neighbour blocks are joined in one copy call """
+
+    def __init__(self, source_fd, gdf_file):
+        self.source_fd = source_fd
+        self.gdf_file = gdf_file
+        self.start = 0
+        self.end = 0
+
+    def add(self, start, end):
+        if start != self.end:
+            self.flush()
+            self.start = start
+        self.end = end
+
+    def flush(self):
+        if self.end > self.start:
+            copy_file_range(self.source_fd, self.gdf_file, self.start, self.end - self.start)
+        self.start = self.end
+
+
+def write_array_rows(gdf_buffer, block, rows, gdf_file, chunk_size):
+    """ Write array block with chosen rows only, at most chunk_size values are copied at once """
+
+    values = get_gdf_array(gdf_buffer, block)
+    selected_rows = range(len(values))[rows]
+    write_dataset_header(block.name, gdf_file)
+    gdf_file.write(struct.pack('i', int(len(selected_rows) * 8)))
+    for idx_start in range(0, len(selected_rows), chunk_size):
+        chunk_rows = selected_rows[idx_start:idx_start + chunk_size]
+        gdf_file.write(values[chunk_rows.start::chunk_rows.step][:len(chunk_rows)].tobytes())
+
+
+def parse_rows(rows):
+    """ Parse rows argument 'start:stop' or 'start:stop:stride' to slice """
+
+    if rows == None:
+        return None
+    parts = [int(part) if part != '' else None for part in rows.split(':')]
+    return slice(*parts)
+
+
+def gdf_subset(gdf_file_directory, result_directory, steps=None, columns=None, rows=None, chunk_size=1000000):
+    """ Write subset of gdf file, untouched blocks are copied byte by byte
+        Args:
+         gdf_file_directory - path to input GDF file
+         result_directory - path to result GDF file
+         steps - numbers of output steps to keep, by default all
+         columns - names of arrays to keep, by default all
+         rows - slice of rows of each array to keep, by default all
+         chunk_size - number of values written at once for rewritten arrays
+        """
+
+    with open(gdf_file_directory, 'rb') as gdf_file:
+        steps_blocks, trailing_blocks = split_blocks_to_steps(gdf_file)
+        if steps == None:
+            steps = range(len(steps_blocks))
+        check_steps(steps, len(steps_blocks), gdf_file_directory)
+        with open(result_directory, 'wb') as result_file:
+            write_subset(gdf_file, result_file, steps_blocks, trailing_blocks, steps, columns, rows, chunk_size)
+
+
+def check_steps(steps, number_steps, gdf_file_directory):
+    """ Raise ValueError for numbers of steps, which are not in gdf file, before the result is written """
+
+    missing_steps = sorted(number for number in set(steps) if not 0 <= number < number_steps)
+    if len(missing_steps) != 0:
+        raise ValueError('steps ' + ' '.join(str(number) for number in missing_steps) + ' are not in '
+                         + gdf_file_directory + ', it has ' + str(number_steps) + ' output steps (0 .. '
+                         + str(number_steps - 1) + ')')
+
+
+def write_subset(gdf_file, result_file, steps_blocks, trailing_blocks, steps, columns, rows, chunk_size):
+    """ Write header, blocks of chosen steps and blocks after the last step of gdf_file to result_file """
+
+    gdf_buffer = open_gdf_buffer(gdf_file)
+    copier = Block_copier(gdf_file.fileno(), result_file)
+    copier.add(0, Constants.GDFHEADERSIZE)
+
+    for number in sorted(set(steps)):
+        for block in steps_blocks[number]:
+            block_start = block.data_offset - Constants.GDFBLOCKHEADERSIZE
+            block_end = block.data_offset + block.size
+            if not block.is_array():
+                copier.add(block_start, block_end)
+                continue
+            if columns != None and block.name not in columns:
+                continue
+            if rows == None or block.get_data_type() != Block_types.double_type:
+                copier.add(block_start, block_end)
+                continue
+            copier.flush()
+            write_array_rows(gdf_buffer, block, rows, result_file, chunk_size)
+
+    for block in trailing_blocks:
+        copier.add(block.data_offset - Constants.GDFBLOCKHEADERSIZE, block.data_offset + block.size)
+    copier.flush()
+    gdf_buffer.close()
+
+
+if __name__ == "__main__":
+
+    """ Parse arguments from command line """
+
+    parser = argparse.ArgumentParser(description="subset of gdf file")
+
+    parser.add_argument("-gdf", metavar='gdf_file', type=str,
+                        help="input gdf file")
+
+    parser.add_argument("-result", metavar='result_file', type=str,
+                        help="result gdf file")
+
+    parser.add_argument("-steps", metavar='steps', type=int, nargs='*',
+                        help="numbers of output steps to keep, by default all")
+
+    parser.add_argument("-columns", metavar='columns', type=str, nargs='*',
+                        help="names of arrays to keep, by default all")
+
+    parser.add_argument("-rows", metavar='rows', type=str,
+                        help="rows of arrays to keep as start:stop or start:stop:stride, by default all")
+
+    args = parser.parse_args()
+
+    gdf_subset(args.gdf, args.result, args.steps, args.columns, parse_rows(args.rows))
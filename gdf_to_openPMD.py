@@ -8,6 +8,9 @@ import os
 import datetime
 import re
 import argparse
+import json
+import mmap
+import numpy as np
 from openpmd_api import Series, Access, Dataset, Mesh_Record_Component, Iteration_Encoding, \
     Unit_Dimension
 
@@ -100,62 +103,123 @@ def add_root_attributes(series, gdf_file, size_gdf_name):
     series.set_openPMD_extension(0)
 
 
-def find_one_symbol_attribute(name):
+class Attribute_names:
+    """ Names of GDF blocks and corresponding openPMD [record, component].
+    Tables are built once, names are matched by prefix of one, two and three symbols,
+    then by full name. Mapping of user (load_attribute_mapping) extends them:
+    full names are checked first, prefixes (names ending with '*') last.
+        """
+
     SCALAR = Mesh_Record_Component.SCALAR
-    dict_one_symbol = {'x': ['position', 'x'], 'y': ['position', 'y'], 'z': ['position', 'z'],
-                       'G': ['G', 'G'], 'q': ['charge', SCALAR], 'm': ['mass', SCALAR]}
-    return dict_one_symbol.get(name[0])
+    one_symbol = {'x': ['position', 'x'], 'y': ['position', 'y'], 'z': ['position', 'z'],
+                  'G': ['G', 'G'], 'q': ['charge', SCALAR], 'm': ['mass', SCALAR]}
+
+    two_symbols = {'Bx': ['momentum', 'x'], 'By': ['momentum', 'y'], 'Bz': ['momentum', 'z'],
+                   'ID': ['id', 'id']}
+
+    three_symbols = {'fBx': ['B', 'x'], 'fBy': ['B', 'y'], 'fBz': ['B', 'z'],
+                     'fEx': ['E', 'x'], 'fEy': ['E', 'y'], 'fEz': ['E', 'z'],
+                     'rxy': ['rxy', 'rxy']}
+
+    multiple_symbols = {'stdx': ['std', 'x'], 'stdy': ['std', 'y'], 'stdz': ['std', 'z'],
+                        'avgx': ['avg', 'x'], 'avgy': ['avg', 'y'], 'avgz': ['avg', 'z'],
+                        'avgBx': ['avgB', 'x'], 'avgBy': ['avgB', 'y'], 'avgBz': ['avgB', 'z'],
+                        'avgFEx': ['avgFE', 'x'], 'avgFEy': ['avgFE', 'y'], 'avgFEz': ['avgFE', 'z'],
+                        'avgFBx': ['avgFB', 'x'], 'avgFBy': ['avgFB', 'y'], 'avgFBz': ['avgFB', 'z'],
+                        'avgr': ['avgr', 'avgr'], 'avgG': ['avgG', 'avgG'],
+                        'stdt': ['stdt', 'stdt'], 'stdG': ['stdG', 'stdG'],
+                        'stdBx': ['stdB', 'x'], 'stdBy': ['stdB', 'y'], 'stdBz': ['stdB', 'z'],
+                        'rmacro': ['rmacro', 'rmacro'], 'nmacro': ['weighting', SCALAR], 'avgt': ['avgt', 'avgt'],
+                        'nemixrms': ['nemixrms', 'nemixrms'], 'nemiyrms': ['nemiyrms', 'nemiyrms'],
+                        'nemizrms': ['nemizrms', 'nemizrms'], 'avgzrms': ['avgzrms', 'avgzrms'],
+                        'time': ['time', 'time'], 'positionOffset_x': ['positionOffset', 'x'],
+                        'positionOffset_y': ['positionOffset', 'y'], 'positionOffset_z': ['positionOffset', 'z']}
+
+    user_names = {}
+    user_prefixes = []
+    resolved = {}
+
+
+def load_attribute_mapping(mapping_file_directory):
+    """Replace names of GDF blocks of user by names from json file,
+    names of a previous conversion in the same process are removed
+        Args:
+          mapping_file_directory - json file {"name": ["record", "component"]},
+          name ending with '*' matches all names with this prefix,
+          component "SCALAR" is a scalar record; None removes mapping of user
+        """
+
+    mapping = {}
+    if mapping_file_directory != None:
+        with open(mapping_file_directory, 'r') as mapping_file:
+            mapping = json.load(mapping_file)
+
+    user_names = {}
+    user_prefixes = []
+    for name, attribute in mapping.items():
+        record, component = attribute
+        if component == 'SCALAR':
+            component = Attribute_names.SCALAR
+        if name.endswith('*'):
+            user_prefixes.append((name[:-1], [record, component]))
+        else:
+            user_names[name] = [record, component]
+
+    user_prefixes.sort(key=lambda prefix: len(prefix[0]), reverse=True)
+    Attribute_names.user_names = user_names
+    Attribute_names.user_prefixes = user_prefixes
+    Attribute_names.resolved = {}
+
+
+def find_one_symbol_attribute(name):
+    return Attribute_names.one_symbol.get(name[0:1])
 
 
 def find_two_symbols_attribute(name):
-    dict_two_symbols = {'Bx': ['momentum', 'x'], 'By': ['momentum', 'y'], 'Bz': ['momentum', 'z'],
-                        'ID': ['id', 'id']}
     if len(name) < 2:
         return None
-    current_name = name[0:2]
-    return dict_two_symbols.get(current_name)
+    return Attribute_names.two_symbols.get(name[0:2])
 
 
 def find_three_symbols_attribute(name):
-    dict_three_symbols = {'fBx': ['B', 'x'], 'fBy': ['B', 'y'], 'fBz': ['B', 'z'],
-                          'fEx': ['E', 'x'], 'fEy': ['E', 'y'], 'fEz': ['E', 'z'],
-                          'rxy': ['rxy', 'rxy']}
     if len(name) < 3:
         return None
-    current_name = name[0:3]
-    return dict_three_symbols.get(current_name)
+    return Attribute_names.three_symbols.get(name[0:3])
 
 
 def find_multiple_symbols_attribute(name):
-    SCALAR = Mesh_Record_Component.SCALAR
-    dict_multiple_symbols = {'stdx': ['std', 'x'], 'stdy': ['std', 'y'], 'stdz': ['std', 'z'],
-                          'avgx': ['avg', 'x'], 'avgy': ['avg', 'y'], 'avgz': ['avg', 'z'],
-                          'avgBx': ['avgB', 'x'], 'avgBy': ['avgB', 'y'], 'avgBz': ['avgB', 'z'],
-                          'avgFEx': ['avgFE', 'x'], 'avgFEy': ['avgFE', 'y'], 'avgFEz': ['avgFE', 'z'],
-                          'avgFBx': ['avgFB', 'x'], 'avgFBy': ['avgFB', 'y'], 'avgFBz': ['avgFB', 'z'],
-                          'avgr': ['avgr', 'avgr'], 'avgG': ['avgG', 'avgG'],
-                          'stdt': ['stdt', 'stdt'], 'stdG': ['stdG', 'stdG'],
-                          'stdBx': ['stdB', 'x'], 'stdBy': ['stdB', 'y'], 'stdBz': ['stdB', 'z'],
-                          'rmacro': ['rmacro', 'rmacro'], 'nmacro': ['weighting', SCALAR], 'avgt': ['avgt', 'avgt'],
-                          'nemixrms': ['nemixrms', 'nemixrms'], 'nemiyrms': ['nemiyrms', 'nemiyrms'],
-                          'nemizrms': ['nemizrms', 'nemizrms'], 'avgzrms': ['avgzrms', 'avgzrms'],
-                          'time': ['time', 'time'], 'positionOffset_x': ['positionOffset', 'x'],
-                          'positionOffset_y': ['positionOffset', 'y'], 'positionOffset_z': ['positionOffset', 'z']}
-
-    return dict_multiple_symbols.get(name)
+    return Attribute_names.multiple_symbols.get(name)
+
+
+def find_user_attribute(name):
+    for prefix, attribute in Attribute_names.user_prefixes:
+        if name.startswith(prefix):
+            return attribute
+    return None
+
+
+def resolve_attribute(name):
+    attribute = Attribute_names.user_names.get(name)
+    if attribute is None:
+        attribute = find_one_symbol_attribute(name)
+    if attribute is None:
+        attribute = find_two_symbols_attribute(name)
+    if attribute is None:
+        attribute = find_three_symbols_attribute(name)
+    if attribute is None:
+        attribute = find_multiple_symbols_attribute(name)
+    if attribute is None:
+        attribute = find_user_attribute(name)
+    return attribute
 
 
 def find_attribute(name):
-    if find_one_symbol_attribute(name) != None:
-        return find_one_symbol_attribute(name)
-    elif find_two_symbols_attribute(name) != None:
-        return find_two_symbols_attribute(name)
-    elif find_three_symbols_attribute(name) != None:
-        return find_three_symbols_attribute(name)
-    elif find_multiple_symbols_attribute(name) != None:
-        return find_multiple_symbols_attribute(name)
-    else:
-        return None
+    """ Find openPMD [record, component] of GDF block name, None for unknown names.
+    Each distinct name is resolved once """
+
+    if name not in Attribute_names.resolved:
+        Attribute_names.resolved[name] = resolve_attribute(name)
+    return Attribute_names.resolved[name]
 
 
 class Elements:
@@ -239,7 +303,7 @@ def is_particles_value(name):
     return name_array[0] in particles_values
 
 
-def add_spices_values(name, dataset_format, values, current_spicies, series):
+def add_spices_values(name, dataset_format, values, current_spicies, series, offset=0):
 
     name_atribute = find_attribute(name)
     dataset_address = current_spicies[name_atribute[0]][name_atribute[1]]
@@ -250,52 +314,75 @@ def add_spices_values(name, dataset_format, values, current_spicies, series):
     record_component.set_time_offset(0.0)
     dataset_address.reset_dataset(dataset_format)
     dataset_address.set_unit_SI(1.0)
-    dataset_address[()] = values
+    store_values(dataset_address, values, offset)
     series.flush()
 
 
-def add_field_values(name, dataset_format, values, current_fields, series):
+def add_field_values(name, dataset_format, values, current_fields, series, offset=0):
     name_atribute = find_attribute(name)
     record_component = current_fields[name_atribute[0]]
     record_component.set_time_offset(0.0)
     dataset_address = current_fields[name_atribute[0]][name_atribute[1]]
     dataset_address.reset_dataset(dataset_format)
-    dataset_address[()] = values
+    store_values(dataset_address, values, offset)
     series.flush()
 
 
-def add_other_types(name, dataset_format, values, current_spicies, series):
+def add_other_types(name, dataset_format, values, current_spicies, series, offset=0):
 
     name_atribute = find_attribute(name)
     dataset_address = current_spicies[name_atribute[0]][name_atribute[1]]
 
     dataset_address.reset_dataset(dataset_format)
     dataset_address.set_unit_SI(1.0)
-    dataset_address[()] = values
+    store_values(dataset_address, values, offset)
     series.flush()
 
 
-def name_to_group(series, name, size, gdf_file, current_spicies, current_fields):
+class Rank_rows:
+    """ Rows of arrays, which are read and stored by one MPI rank, all rows without MPI """
+
+    def __init__(self, rank=0, ranks_number=1):
+        self.rank = rank
+        self.ranks_number = ranks_number
+
+    def get_rows(self, size):
+        return self.rank * size // self.ranks_number, (self.rank + 1) * size // self.ranks_number
+
+
+def store_values(dataset_address, values, offset):
+    """ Store values from row offset, ranks without rows store nothing """
+
+    if len(values) != 0:
+        dataset_address.store_chunk(values, [offset], [len(values)])
+
+
+def name_to_group(series, name, size, gdf_file, current_spicies, current_fields, rank_rows=None):
     """Add dataset to correct group in particles group
         Args:
             particles - particles group
             name - name of dataset in gdf_file
             size - size of dataset in gdf_file, in bytes
             gdf_file - input file GPT
+            rank_rows - Rank_rows, only these rows of dataset are read and stored
 
            """
-    values = fromfile(gdf_file, dtype=dtype('f8'), count=int(size / 8))
+    if rank_rows is None:
+        rank_rows = Rank_rows()
+    idx_start, idx_end = rank_rows.get_rows(int(size / 8))
+    gdf_file.seek(idx_start * 8, os.SEEK_CUR)
+    values = fromfile(gdf_file, dtype=dtype('f8'), count=idx_end - idx_start)
 
     dataset_format = Dataset(values.dtype, [int(size / 8)])
 
     if is_field_value(name):
-        add_field_values(name, dataset_format, values, current_fields, series)
+        add_field_values(name, dataset_format, values, current_fields, series, idx_start)
 
     elif is_particles_value(name):
-        add_spices_values(name, dataset_format, values, current_spicies, series)
+        add_spices_values(name, dataset_format, values, current_spicies, series, idx_start)
 
     else:
-        add_other_types(name, dataset_format, values, current_spicies, series)
+        add_other_types(name, dataset_format, values, current_spicies, series, idx_start)
 
 
 
@@ -315,6 +402,10 @@ class Block_types:
 class Constants:
     GDFID  = 94325877
     GDFNAMELEN = 16
+    GDFHEADERSIZE = 48
+    GDFBLOCKHEADERSIZE = 24
+    GDFBUFFERSIZE = 1 << 20
+    BLOCKHEADER = struct.Struct('16sii')
 
 
 def check_gdf_file(gdf_file):
@@ -329,22 +420,142 @@ def check_gdf_file(gdf_file):
         raise RuntimeWarning('File directory is not a .gdf file')
 
 
-def read_gdf_block_header(gdf_file):
-    """ Function read block header of gdf file
+class Gdf_block:
+    """ Header of one block of gdf file and position of its data
+        Attributes:
+            name - decoded name of block
+            primitive_type - type of block from GPT file
+            size - size of block data, in bytes
+            data_offset - position of block data from the start of file
+        """
+
+    __slots__ = ('name', 'primitive_type', 'size', 'data_offset')
+
+    def __init__(self, name, primitive_type, size, data_offset):
+        self.name = name
+        self.primitive_type = primitive_type
+        self.size = size
+        self.data_offset = data_offset
+
+    def get_data_type(self):
+        return self.primitive_type & 255
+
+    def is_array(self):
+        return self.primitive_type & Block_types.arr > 0
+
+    def is_single_value(self):
+        return self.primitive_type & Block_types.sval > 0
+
+
+def read_gdf_blocks(gdf_file):
+    """Generator over all blocks of gdf file, data of blocks is skipped.
+    Headers are decoded from a large buffer, the file is read again only
+    when a header is out of the buffer, e.g. after a large array.
         Args:
-           gdf_file - input gpt file
+           gdf_file - input gpt file, opened in binary mode
         """
-    name = gdf_file.read(16)
-    primitive_type = ''
-    namesplit = ''
-    size = ''
-    if len(name) < 15:
-        return namesplit, primitive_type, size
-    namesplit = name.split()[0]
-    primitive_type = struct.unpack('i', gdf_file.read(4))[0]
-    #size in bytes
-    size = struct.unpack('i', gdf_file.read(4))[0]
-    return namesplit, primitive_type, size
+
+    gdf_file.seek(0)
+    check_gdf_file(gdf_file)
+    unpack_header = Constants.BLOCKHEADER.unpack_from
+    header_size = Constants.GDFBLOCKHEADERSIZE
+    names = {}
+
+    position = Constants.GDFHEADERSIZE
+    buffer = b''
+    buffer_start = position
+    while True:
+        buffer_position = position - buffer_start
+        if buffer_position + header_size > len(buffer):
+            gdf_file.seek(position)
+            buffer = gdf_file.read(Constants.GDFBUFFERSIZE)
+            buffer_start = position
+            buffer_position = 0
+            if len(buffer) < header_size:
+                break
+
+        raw_name, primitive_type, size = unpack_header(buffer, buffer_position)
+        name = names.get(raw_name)
+        if name is None:
+            name = decode_name(raw_name.split(b'\x00')[0])
+            names[raw_name] = name
+
+        position += header_size
+        yield Gdf_block(name, primitive_type, size, position)
+        position += size
+
+
+class Gdf_step:
+    """ One output step of gdf file: consecutive array blocks
+        Attributes:
+            number - number of step in gdf file
+            values - single values (time, position, var) set before the arrays
+            arrays - array blocks of step, by name
+        """
+
+    def __init__(self, number, values):
+        self.number = number
+        self.values = values
+        self.arrays = {}
+
+    def get_size(self):
+        """ Number of rows in arrays of step """
+
+        for block in self.arrays.values():
+            return block.size // 8
+        return 0
+
+
+def read_single_value(gdf_file, block):
+    """Read value of single valued block, None for blocks without data """
+
+    gdf_file.seek(block.data_offset)
+    data_type = block.get_data_type()
+    if data_type == Block_types.double_type:
+        return struct.unpack('d', gdf_file.read(8))[0]
+    elif data_type == Block_types.signed_long:
+        return struct.unpack('i', gdf_file.read(4))[0]
+    elif data_type == Block_types.ascii_character:
+        return decode_name(gdf_file.read(block.size))
+    return None
+
+
+def get_gdf_block_index(gdf_file):
+    """Split gdf file to output steps, data of arrays is not read
+        Args:
+           gdf_file - input gpt file, opened in binary mode
+        Returns:
+           list of Gdf_step
+        """
+
+    steps = []
+    values = {}
+    current_step = None
+    for block in read_gdf_blocks(gdf_file):
+        if block.is_array():
+            if current_step is None:
+                current_step = Gdf_step(len(steps), dict(values))
+                steps.append(current_step)
+            current_step.arrays[block.name] = block
+        else:
+            current_step = None
+            if block.is_single_value():
+                value = read_single_value(gdf_file, block)
+                if value is not None:
+                    values[block.name] = value
+    return steps
+
+
+def open_gdf_buffer(gdf_file):
+    """ Read-only memory map of the whole gdf file """
+
+    return mmap.mmap(gdf_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def get_gdf_array(gdf_buffer, block):
+    """ Values of array block as view of gdf_buffer, nothing is copied """
+
+    return np.frombuffer(gdf_buffer, dtype=np.dtype('f8'), count=block.size // 8, offset=block.data_offset)
 
 
 def get_block_type(primitive_type):
@@ -377,7 +588,8 @@ def decode_name(attribute_name):
     return decoding_name
 
 
-def read_array_type(series, gdf_file, dattype, name, primitive_type, size, current_spicies, current_fields):
+def read_array_type(series, gdf_file, dattype, name, primitive_type, size, current_spicies, current_fields,
+                    rank_rows=None):
     """Function read array type from GDF file
         Args:
            gdf_file - input file
@@ -388,8 +600,7 @@ def read_array_type(series, gdf_file, dattype, name, primitive_type, size, curre
         """
 
     if dattype == Block_types.double_type:
-        decoding_name = decode_name(name)
-        name_to_group(series, decoding_name, size, gdf_file, current_spicies, current_fields)
+        name_to_group(series, name, size, gdf_file, current_spicies, current_fields, rank_rows)
     else:
         print_warning_unknown_type(name, primitive_type, size)
 
@@ -493,13 +704,11 @@ def create_new_fields_group(current_iteration):
     return fields
 
 
-def gdf_file_to_hdf_file(gdf_file, series):
+def gdf_file_to_hdf_file(gdf_file, series, rank_rows=None):
 
     check_gdf_file(gdf_file)
     add_root_attributes(series, gdf_file, Constants.GDFNAMELEN)
 
-    gdf_file.seek(2, 1)
-
     iteration_number = -1
 
     last_iteration_time = 0
@@ -512,16 +721,14 @@ def gdf_file_to_hdf_file(gdf_file, series):
 
     particles_name = ''
 
-    while True:
-        if gdf_file.read(1) == '':
-            break
-        gdf_file.seek(-1, 1)
-        name, primitive_type, size = read_gdf_block_header(gdf_file)
+    for block in read_gdf_blocks(gdf_file):
+        gdf_file.seek(block.data_offset)
+        name = block.name
+        primitive_type = block.primitive_type
+        size = block.size
 
-        if size == '':
-            break
         dir, edir, sval, arr = get_block_type(primitive_type)
-        data_type = primitive_type & 255
+        data_type = block.get_data_type()
         time = 0
         last_iteration_time = 0
 
@@ -546,7 +753,8 @@ def gdf_file_to_hdf_file(gdf_file, series):
             if is_fields_group_needed(current_iteration):
                 current_fields = create_new_fields_group(current_iteration)
 
-            read_array_type(series, gdf_file, data_type, name, primitive_type, size, current_spicies, current_fields)
+            read_array_type(series, gdf_file, data_type, name, primitive_type, size, current_spicies, current_fields,
+                            rank_rows)
 
         last_arr = arr
         first_iteration = False
@@ -560,8 +768,7 @@ def read_ascii_character(data_type, gdf_file, size, name):
     if data_type == Block_types.ascii_character:
         value = gdf_file.read(size)
         decoding_value = decode_name(value)
-        decoding_name = decode_name(name)
-        if (decoding_name == 'var'):
+        if (name == 'var'):
             particles_name = decoding_value
             is_name = True
     return is_name, particles_name
@@ -572,30 +779,44 @@ def read_double_value(name, gdf_file, current_iteration, last_iteration_time):
 
     time = 0
     new_iteration_time = struct.unpack('d', gdf_file.read(8))[0]
-    decoding_name = decode_name(name)
-    if decoding_name == 'time':
+    if name == 'time':
         time = 1
     return time, new_iteration_time
 
 
-def gdf_to_hdf(gdf_file_directory, hdf_file_directory):
+def gdf_to_hdf(gdf_file_directory, hdf_file_directory, mapping_file_directory=None, mpi=False):
     """find GDF file in gdf_file_directory,
        and convert to hdf file openPMD,
        write to hdf_file_directory
         Args:
          gdf_file_directory - path to GDF file
          hdf_file_directory - path where the hdf  file is created
+         mapping_file_directory - json file with names of user GDF arrays, optional
+         mpi - run under mpirun: series is opened with MPI.COMM_WORLD (needs mpi4py and openPMD-api with MPI),
+         each rank reads its part of rows of every array and stores it as one chunk of the parallel dataset
         """
 
+    comm = None
+    rank_rows = None
+    if mpi:
+        from mpi4py import MPI
+        comm = MPI.COMM_WORLD
+        rank_rows = Rank_rows(comm.rank, comm.size)
+
     print('Converting .gdf to .hdf file')
-    if os.path.exists(hdf_file_directory):
+    load_attribute_mapping(mapping_file_directory)
+    if os.path.exists(hdf_file_directory) and (comm is None or comm.rank == 0):
         os.remove(hdf_file_directory)
 
-    openPMD_series = Series(hdf_file_directory, Access.create)
+    if comm is None:
+        openPMD_series = Series(hdf_file_directory, Access.create)
+    else:
+        comm.Barrier()
+        openPMD_series = Series(hdf_file_directory, Access.create, comm)
     with open(gdf_file_directory, 'rb') as gdf_file:
-        gdf_file_to_hdf_file(gdf_file, openPMD_series)
+        gdf_file_to_hdf_file(gdf_file, openPMD_series, rank_rows)
 
-    gdf_file.close()
+    openPMD_series.close()
     print('Converting .gdf to .hdf file... Complete.')
 
 
@@ -611,6 +832,12 @@ if __name__ == "__main__":
     parser.add_argument("-gdf", metavar='gdf_file', type=str,
                         help="input gdf file")
 
+    parser.add_argument("-mapping", metavar='mapping_file', type=str,
+                        help="json file with openPMD records of user GDF arrays")
+
+    parser.add_argument("-mpi", action='store_true',
+                        help="parallel conversion under mpirun, each rank stores its part of rows")
+
     args = parser.parse_args()
-    gdf_to_hdf(args.gdf, args.openPMD_output)
+    gdf_to_hdf(args.gdf, args.openPMD_output, args.mapping, args.mpi)
 
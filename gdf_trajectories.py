@@ -0,0 +1,133 @@
+"""Trajectories of chosen particles over all output steps of GDF file"""
+
+
+from __future__ import division
+import argparse
+import numpy as np
+from gdf_to_openPMD import get_gdf_block_index, open_gdf_buffer, get_gdf_array
+
+
+class Id_matcher:
+    """ Find rows with wanted ids in chunks of id column.
+    Wanted ids are sorted once, each chunk is matched by binary search.
+        """
+
+    def __init__(self, ids):
+        self.ids = np.unique(np.asarray(ids, dtype=np.dtype('f8')))
+
+    def __call__(self, id_values):
+        """ Returns rows of chunk with wanted ids and index of each id in self.ids """
+
+        if len(self.ids) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        idx = np.searchsorted(self.ids, id_values)
+        np.minimum(idx, len(self.ids) - 1, out=idx)
+        rows = np.nonzero(self.ids[idx] == id_values)[0]
+        return rows, idx[rows]
+
+
+def find_step_rows(gdf_buffer, step, id_matcher, chunk_size):
+    """ Rows of wanted particles in one step, the id column is read chunk by chunk """
+
+    id_column = get_gdf_array(gdf_buffer, step.arrays['ID'])
+    size = step.get_size()
+    step_rows = []
+    step_particles = []
+    for idx_start in range(0, size, chunk_size):
+        idx_end = min(idx_start + chunk_size, size)
+        rows, particles = id_matcher(id_column[idx_start:idx_end])
+        step_rows.append(rows + idx_start)
+        step_particles.append(particles)
+
+    if len(step_rows) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(step_rows), np.concatenate(step_particles)
+
+
+def gather_step(gdf_buffer, step, id_matcher, quantities, chunk_size, step_trajectories):
+    """ Copy rows of wanted particles of one step to step_trajectories (particle, quantity) """
+
+    rows, particles = find_step_rows(gdf_buffer, step, id_matcher, chunk_size)
+    for j, quantity in enumerate(quantities):
+        if quantity in step.arrays:
+            column = get_gdf_array(gdf_buffer, step.arrays[quantity])
+            step_trajectories[particles, j] = column[rows]
+
+
+def create_trajectories_array(shape, output):
+    """ Result array in memory or, if output is given, as .npy file mapped to memory """
+
+    if output == None:
+        trajectories = np.empty(shape)
+    else:
+        trajectories = np.lib.format.open_memmap(output, mode='w+', dtype=np.dtype('f8'), shape=shape)
+    trajectories[...] = np.nan
+    return trajectories
+
+
+def gdf_trajectories(gdf_file_directory, ids, quantities=None, chunk_size=1000000, output=None):
+    """ Gather values of particles with given ids from each output step with ID column
+        Args:
+         gdf_file_directory - path to GDF file
+         ids - ids of tracked particles
+         quantities - names of GDF arrays to gather, by default x y z Bx By Bz G
+         chunk_size - number of ids read at once
+         output - path to .npy file for result, by default result is kept in memory
+        Returns:
+         trajectories - array (step, particle, quantity), nan if particle is absent in step
+         sorted_ids - ids of particles, in order of particle axis
+         times - time of each step
+        """
+
+    if quantities == None:
+        quantities = ['x', 'y', 'z', 'Bx', 'By', 'Bz', 'G']
+
+    id_matcher = Id_matcher(ids)
+    with open(gdf_file_directory, 'rb') as gdf_file:
+        steps = [step for step in get_gdf_block_index(gdf_file) if 'ID' in step.arrays]
+        gdf_buffer = open_gdf_buffer(gdf_file)
+        shape = (len(steps), len(id_matcher.ids), len(quantities))
+        trajectories = create_trajectories_array(shape, output)
+        times = np.full(len(steps), np.nan)
+
+        for i, step in enumerate(steps):
+            times[i] = step.values.get('time', np.nan)
+            gather_step(gdf_buffer, step, id_matcher, quantities, chunk_size, trajectories[i])
+        gdf_buffer.close()
+
+    return trajectories, id_matcher.ids, times
+
+
+if __name__ == "__main__":
+
+    """ Parse arguments from command line """
+
+    parser = argparse.ArgumentParser(description="trajectories of particles from gdf file")
+
+    parser.add_argument("-gdf", metavar='gdf_file', type=str,
+                        help="input gdf file")
+
+    parser.add_argument("-ids", metavar='ids_file', type=str,
+                        help="text file with ids of tracked particles")
+
+    parser.add_argument("-output", metavar='output', type=str,
+                        help="result .npy file (step, particle, quantity), by default gdf_file + _trajectories.npy")
+
+    parser.add_argument("-quantities", metavar='quantities', type=str, nargs='*',
+                        help="names of GDF arrays to gather, by default x y z Bx By Bz G")
+
+    parser.add_argument("-chunk", metavar='chunk', type=int, default=1000000,
+                        help="number of ids read at once")
+
+    args = parser.parse_args()
+
+    output = args.output
+    if output == None:
+        output = args.gdf[:-4] + '_trajectories.npy'
+        print('Destination file not specified. Defaulting to ' + output)
+
+    ids = np.loadtxt(args.ids, dtype=np.dtype('f8'), ndmin=1)
+    trajectories, sorted_ids, times = gdf_trajectories(args.gdf, ids, args.quantities, args.chunk, output)
+    np.save(output[:-4] + '_ids.npy', sorted_ids)
+    np.save(output[:-4] + '_times.npy', times)
+    trajectories.flush()
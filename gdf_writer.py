@@ -0,0 +1,113 @@
+"""Writers of GDF header and blocks, without dependencies on openPMD-api"""
+
+
+import os
+import struct
+import numpy as np
+
+
+class Constants:
+    GDFID = 94325877
+    GDFNAMELEN = 16
+
+
+def add_gdf_id(gdf_file):
+   """ Add required indefication block of gdf file"""
+
+   gdf_id_byte = struct.pack('i', Constants.GDFID)
+   gdf_file.write(gdf_id_byte)
+
+
+def write_string(name, gdf_file):
+    """Write string value to gdf file"""
+
+    while len(name) < Constants.GDFNAMELEN:
+        name += chr(0)
+
+    chars_name = []
+    for c in name:
+        chars_name.append(c)
+
+    for s in chars_name:
+        s_pack = struct.pack('c', s.encode('ascii'))
+        gdf_file.write(s_pack)
+
+
+def add_versions(name, gdf_file, hdf_file, major = 0, minor = 0):
+    """Write version of file to gdf file"""
+
+    major_bin = struct.pack('B', int(major))
+    minor_bin = struct.pack('B', int(minor))
+    gdf_file.write(major_bin)
+    gdf_file.write(minor_bin)
+
+
+def write_first_block(gdf_file):
+    """ Write required empty first block """
+
+    name = '00'
+    chars_name = []
+    for c in name:
+        chars_name.append(c)
+
+    for s in chars_name:
+        s_pack = struct.pack('c', s.encode('ascii'))
+        gdf_file.write(s_pack)
+
+
+def write_dataset_header(name, gdf_file):
+    write_string(name, gdf_file)
+    type_bin = struct.pack('i', int(2051))
+    gdf_file.write(type_bin)
+
+
+def write_float(name, gdf_file, value):
+    write_string(name, gdf_file)
+    type_bin = struct.pack('i', int(1283))
+    gdf_file.write(type_bin)
+    size_bin = struct.pack('i', 8)
+    gdf_file.write(size_bin)
+    gdf_file.write(struct.pack('d', value))
+
+
+def write_ascii_name(name, size, gdf_file, ascii_name):
+    """ Write ascii name of value """
+
+    write_string(name, gdf_file)
+    type_bin = struct.pack('i', int(1025))
+    gdf_file.write(type_bin)
+    size_bin = struct.pack('i', int(size))
+    gdf_file.write(size_bin)
+    charlist = list(ascii_name)
+    type_size = str(size) + 's'
+    gdf_file.write(struct.pack(type_size, ascii_name.encode('ascii')))
+
+
+class Gdf_arrays_writer:
+    """ Arrays of doubles with known number of rows. Headers of all arrays are written and their data
+    reserved at once, then rows of all arrays are written chunk by chunk at their place,
+    so the values of one row are in hand together and the file is written in one pass.
+    Several processes can write their rows into the same arrays, each one starting at rows_before;
+    a gdf_file with rows_file writes the headers itself and the rows to rows_file """
+
+    def __init__(self, gdf_file, names, size, rows_before=0):
+        self.gdf_file = gdf_file
+        self.rows_file = getattr(gdf_file, 'rows_file', gdf_file)
+        self.position = rows_before
+        self.offsets = []
+        for name in names:
+            write_dataset_header(name, gdf_file)
+            gdf_file.write(struct.pack('i', int(size * 8)))
+            self.offsets.append(gdf_file.tell())
+            gdf_file.seek(size * 8, os.SEEK_CUR)
+        gdf_file.truncate()
+        self.end = gdf_file.tell()
+
+    def write(self, columns):
+        """ Append one chunk, columns in the order of names """
+
+        for offset, values in zip(self.offsets, columns):
+            self.rows_file.seek(offset + self.position * 8)
+            self.rows_file.write(np.ascontiguousarray(values, dtype=np.float64))
+        self.position += len(columns[0])
+        self.gdf_file.seek(self.end)
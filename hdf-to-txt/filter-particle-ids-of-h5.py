@@ -1,22 +1,20 @@
-""" 
+"""
 Input:
 + timestep
 + filename_bunch_idendifiers
++ filename_original_file
 + filename_filtered_file
-""" 
+"""
 ###### init ####
 import numpy as np
-import scipy as sp
-import h5py
-import scipy.constants as const
 from settings import *
+from filter_particle_ids import filter_particle_ids
 import sys
 
 timestep =int(sys.argv[1])
 #timestep                   = 60000
 #filename_bunch_idendifiers = "bunch-identifiers.dat"
-################ WARING ################
-# The filtered file will be overwritten, copy this file instead from the original data
+# the original file is only read, the filtered particles are written to a new file
 filename_filtered_file     = "simData_filtered_{}.h5".format(timestep)
 
 # optional
@@ -24,40 +22,12 @@ filename_filtered_file     = "simData_filtered_{}.h5".format(timestep)
 data_directory = ''
 
 # read particle ids for filtering
-ids = np.loadtxt(filename_bunch_idendifiers, dtype=np.uint64)
-
-##### open h5 files 
-filtered_file = h5py.File(data_directory+filename_filtered_file, "r+")
-#orig_file = h5py.File(data_directory+"/simData_run006_orig_{}.h5".format(timestep), "r")
-
-h = filtered_file["/data/{}/particles/en_all".format(timestep)]
-current_ids = h["particleId"][()]
-m   = np.in1d(current_ids, ids)
-if m.sum() != len(ids):
-    print("ERR: requested IDs are not fully contained in H5 file. Abort.")
-    exit
-
-paths = ["particleId", "weighting",
-             "momentum/x", "momentum/y", "momentum/z",
-             "momentumPrev1/x", "momentumPrev1/y", "momentumPrev1/z",
-             "position/x", "position/y", "position/z",
-             "positionOffset/x", "positionOffset/y", "positionOffset/z"]
-for p in paths:
-    temp = h[p][m]
-    temp_items = h[p].attrs.items()
-    h.__delitem__(p)
-    h[p]  = temp
-    for i in temp_items:
-        h[p].attrs.create(name=i[0], data=i[1])
-for p in ["mass", 'charge']:
-    temp = h[p].attrs['shape']
-    temp[0] = np.sum(m)
-    h[p].attrs['shape'] = temp
-
-#### delete particle patches because reduction script does not process them correctly
-filtered_file["/data/{}/particles/en_all/".format(timestep)].__delitem__('particlePatches')
-
-# important: close them to save them to disk
-filtered_file.close()
-#orig_file.close()
-
+ids = np.loadtxt(filename_bunch_idendifiers, dtype=np.uint64, ndmin=1)
+
+#### selected particles are streamed block by block, particle patches are dropped
+#### because reduction script does not process them correctly
+try:
+    filter_particle_ids(data_directory+filename_original_file.format(timestep),
+                        data_directory+filename_filtered_file, timestep, ids, species=species)
+except ValueError as error:
+    sys.exit(str(error))
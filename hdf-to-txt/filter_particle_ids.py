@@ -0,0 +1,136 @@
+"""
+Filter macro particles of one species by their ids.
+
+The ids are sorted once and every chunk of particleId is matched by binary search,
+so only one chunk of each dataset is in memory at once.
+Selected rows are streamed into a new file, all other groups and datasets are copied unchanged.
+"""
+import numpy as np
+import h5py
+
+
+stepsize = 2**20
+
+
+class Id_filter:
+    """
+    membership test of particle ids against a sorted list of wanted ids
+    """
+    def __init__(self, ids):
+        self.ids = np.unique(np.asarray(ids, dtype=np.uint64))
+
+    def __call__(self, id_values):
+        """
+        returns mask of id_values, which are in wanted ids
+        """
+        if len(self.ids) == 0:
+            return np.zeros(len(id_values), dtype=bool)
+        idx = np.searchsorted(self.ids, id_values)
+        np.minimum(idx, len(self.ids) - 1, out=idx)
+        return self.ids[idx] == id_values
+
+
+def find_particles(id_dataset, ids, stepsize=stepsize):
+    """
+    returns mask of particles with wanted ids, id dataset is read block by block
+    raises ValueError if some of the ids are not in the dataset, repeated ids in the dataset are all selected
+    """
+    id_filter = Id_filter(ids)
+    size = id_dataset.shape[0]
+    particles_mask = np.zeros(size, dtype=bool)
+    found = np.zeros(len(id_filter.ids), dtype=bool)
+    for a in range(0, size, stepsize):
+        id_values = id_dataset[a:a+stepsize]
+        block_mask = id_filter(id_values)
+        particles_mask[a:a+stepsize] = block_mask
+        found[np.searchsorted(id_filter.ids, id_values[block_mask])] = True
+    number_missing = len(found) - int(np.count_nonzero(found))
+    if number_missing != 0:
+        raise ValueError("{} of {} requested IDs are not contained in particleId".format(
+            number_missing, len(id_filter.ids)))
+    return particles_mask
+
+
+def copy_attributes(source, target):
+    """
+    copies all attributes, keeping their types
+    """
+    for name in source.attrs:
+        target.attrs.create(name, source.attrs[name], dtype=source.attrs.get_id(name).dtype)
+
+
+def create_filtered_dataset(dataset, group, name, size):
+    """
+    empty dataset for size selected particles with dtype, compression and attributes of dataset
+    """
+    compression = dataset.compression if size != 0 else None
+    filtered = group.create_dataset(name, shape=(size,) + dataset.shape[1:], dtype=dataset.dtype,
+                                    compression=compression, compression_opts=dataset.compression_opts if compression else None)
+    copy_attributes(dataset, filtered)
+    return filtered
+
+
+def filter_dataset(dataset, filtered, particles_mask, stepsize=stepsize):
+    """
+    streams rows of dataset with particles_mask==True to filtered
+    """
+    position = 0
+    for a in range(0, particles_mask.shape[0], stepsize):
+        block = dataset[a:a+stepsize][particles_mask[a:a+stepsize]]
+        filtered[position:position+len(block)] = block
+        position += len(block)
+
+
+def filter_group(group, result_group, particles_mask, stepsize=stepsize):
+    """
+    copies species group with selected particles only
+    constant records get the new number of particles in their "shape" attribute
+    particle patches are dropped, because they do not match the selected particles
+    """
+    size = particles_mask.shape[0]
+    number_selected = int(np.count_nonzero(particles_mask))
+    copy_attributes(group, result_group)
+    for name, item in group.items():
+        if name == "particlePatches":
+            continue
+        if isinstance(item, h5py.Group):
+            filter_group(item, result_group.create_group(name), particles_mask, stepsize)
+            if "shape" in item.attrs and "value" in item.attrs:
+                shape = item.attrs["shape"].copy()
+                shape[0] = number_selected
+                result_group[name].attrs["shape"] = shape
+        elif len(item.shape) != 0 and item.shape[0] == size:
+            filtered = create_filtered_dataset(item, result_group, name, number_selected)
+            filter_dataset(item, filtered, particles_mask, stepsize)
+        else:
+            group.copy(item, result_group, name=name)
+
+
+def copy_except(group, result_group, skip_name):
+    """
+    copies everything of group except of item with name skip_name, parents of it are created with attributes
+    """
+    copy_attributes(group, result_group)
+    for name, item in group.items():
+        if item.name == skip_name:
+            continue
+        if isinstance(item, h5py.Group) and skip_name.startswith(item.name + "/"):
+            copy_except(item, result_group.require_group(name), skip_name)
+        else:
+            group.copy(item, result_group, name=name)
+
+
+def filter_particle_ids(filename, filename_filtered, timestep, ids, species="en_all", stepsize=stepsize):
+    """
+    writes filename_filtered: copy of filename, where species at timestep has only particles with ids
+    returns number of selected particles
+    raises ValueError if some of the ids are not in the file, nothing is written then
+    """
+    with h5py.File(filename, "r") as f:
+        species_path = "/data/{}/particles/{}".format(timestep, species)
+        h = f[species_path]
+        particles_mask = find_particles(h["particleId"], ids, stepsize)
+        with h5py.File(filename_filtered, "w") as filtered_file:
+            copy_except(f, filtered_file, species_path)
+            filter_group(h, filtered_file.require_group(species_path), particles_mask, stepsize)
+    return int(np.count_nonzero(particles_mask))
@@ -1,4 +1,7 @@
 ## funciton definition
+from collections import OrderedDict
+import hashlib
+import os
 import numpy as np
 import scipy.constants as const
 import h5py
@@ -13,42 +16,205 @@ def mask(array, mask):
     
     returns logically array[mask==True]
     """
-    stepsize = 2**20
-    return np.concatenate([array[a:a+stepsize][mask[a:a+stepsize]] for a in range(0,mask.shape[0],stepsize)])
+    return mask_datasets([array], mask)[0]
+
+
+def mask_datasets(arrays, mask, stepsize=2**20):
+    """
+    masks several one dimensional arrays or h5 datasets in one pass over the mask
+    
+    the number of selected rows is counted first, so every result is allocated once
+    and filled block by block, a block of each array is read into a reused buffer
+    
+    returns list of array[mask==True] for each array
+    """
+    size = mask.shape[0]
+    selected = int(np.count_nonzero(mask))
+    results = [np.empty(selected, dtype=array.dtype) for array in arrays]
+    buffers = [np.empty(min(stepsize, size), dtype=array.dtype) for array in arrays]
+    position = 0
+    for a in range(0, size, stepsize):
+        b = min(a + stepsize, size)
+        block_mask = np.asarray(mask[a:b])
+        block_selected = int(np.count_nonzero(block_mask))
+        if block_selected == 0:
+            continue
+        for array, result, buffer in zip(arrays, results, buffers):
+            if isinstance(array, h5py.Dataset):
+                array.read_direct(buffer, np.s_[a:b], np.s_[0:b-a])
+                block = buffer[:b-a]
+            else:
+                block = array[a:b]
+            np.compress(block_mask, block, out=result[position:position+block_selected])
+        position += block_selected
+    return results
+
+
+class ParticleView:
+    """
+    access to the particles of one species at one timestep
+    
+    dataset handles and unitSI attributes are looked up once,
+    shared columns (e.g. weighting) are kept in a LRU cache of at most cache_bytes bytes,
+    derived quantities are computed block by block into preallocated arrays
+    
+    positions are in µm, momentums are normalized (\gamma \beta_x)
+    """
+    def __init__(self, f, timestep, species="en", cache_bytes=2**30, stepsize=2**20):
+        self.group = f['/data/{}/particles/{}'.format(timestep, species)]
+        self.cache_bytes = cache_bytes
+        self.stepsize = stepsize
+        self.datasets = {}
+        self.units = {}
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+
+    def dataset(self, path):
+        """
+        returns h5 dataset of the species, e.g. "momentum/x"
+        """
+        if path not in self.datasets:
+            self.datasets[path] = self.group[path]
+        return self.datasets[path]
+
+    def unit_si(self, path):
+        if path not in self.units:
+            self.units[path] = self.dataset(path).attrs["unitSI"]
+        return self.units[path]
+
+    def __len__(self):
+        return self.dataset("position/x").shape[0]
+
+    def column(self, path):
+        """
+        returns all values of dataset, from the cache if possible
+        the returned array is read only, because it is shared
+        """
+        if path in self.cache:
+            self.cache.move_to_end(path)
+            return self.cache[path]
+        values = self.dataset(path)[()]
+        values.flags.writeable = False
+        if values.nbytes <= self.cache_bytes:
+            while self.cached_bytes + values.nbytes > self.cache_bytes:
+                evicted_path, evicted = self.cache.popitem(last=False)
+                self.cached_bytes -= evicted.nbytes
+            self.cache[path] = values
+            self.cached_bytes += values.nbytes
+        return values
+
+    def read(self, path, out, a, b, start=0):
+        """
+        reads values a:b of dataset into out[a-start:b-start], from the cache if possible
+        """
+        if path in self.cache:
+            out[a-start:b-start] = self.cache[path][a:b]
+        else:
+            self.dataset(path).read_direct(out, np.s_[a:b], np.s_[a-start:b-start])
+
+    def blocks(self, start=0, stop=None):
+        if stop is None:
+            stop = len(self)
+        for a in range(start, stop, self.stepsize):
+            yield a, min(a + self.stepsize, stop)
+
+    def weighting(self):
+        return self.column("weighting")
+
+    def id(self):
+        return self.column("particleId")
+
+    def position(self, label, out=None, start=0, stop=None):
+        """
+        returns position on axis "label" in µm, of particles start:stop
+        """
+        if stop is None:
+            stop = len(self)
+        if out is None:
+            out = np.empty(stop - start)
+        offset = np.empty(min(self.stepsize, stop - start))
+        offset_path = "positionOffset/{}".format(label)
+        position_path = "position/{}".format(label)
+        offset_unit = self.unit_si(offset_path) * 1e6
+        position_unit = self.unit_si(position_path) * 1e6
+        for a, b in self.blocks(start, stop):
+            self.read(position_path, out, a, b, start)
+            out[a-start:b-start] *= position_unit
+            self.read(offset_path, offset, a, b, a)
+            out[a-start:b-start] += offset_unit * offset[:b-a]
+        return out
+
+    def momentum(self, label, out=None, start=0, stop=None, w=None):
+        """
+        returns normalized momentum on axis "label" (\gamma \beta_x), of particles start:stop
+        momentum of macro particle is divided by its weighting,
+        weighting is taken from w, from the cache for all particles or read block by block for a part of them
+        """
+        if stop is None:
+            stop = len(self)
+        if out is None:
+            out = np.empty(stop - start)
+        path = "momentum/{}".format(label)
+        unit = self.unit_si(path) / (const.m_e*const.c)
+        if w is None and start == 0 and stop == len(self):
+            w = self.weighting()
+        elif w is None:
+            w = np.empty(stop - start)
+            for a, b in self.blocks(start, stop):
+                self.read("weighting", w, a, b, start)
+        for a, b in self.blocks(start, stop):
+            self.read(path, out, a, b, start)
+            out[a-start:b-start] *= unit
+            out[a-start:b-start] /= w[a-start:b-start]
+        return out
+
+    def momentums(self):
+        """
+        returns
+            * length of normalized momentum of particle
+            * normalized momentums for all axis (\gamma \beta_x), array of shape (3, number of particles)
+        """
+        momentums = np.empty((3, len(self)))
+        for i, label in enumerate(["x", "y", "z"]):
+            self.momentum(label, out=momentums[i])
+        absolute = np.empty(len(self))
+        for a, b in self.blocks():
+            absolute[a:b] = np.sqrt(np.sum(momentums[:, a:b]**2.0, axis=0))
+        return absolute, momentums
+
+    def gamma(self, momentums=None):
+        """
+        returns Lorentz factor \gamma = sqrt(1 + u_x^2 + u_y^2 + u_z^2),
+        momentums are computed if they are not given
+        """
+        if momentums is None:
+            absolute, momentums = self.momentums()
+        out = np.empty(momentums.shape[1])
+        for a, b in self.blocks():
+            out[a:b] = np.sqrt(1.0 + np.sum(momentums[:, a:b]**2.0, axis=0))
+        return out
 
 
 def load_position(label, timestep, f, species="en"):
     """
     returns position on axis "label" in µm
-    TODO: use maybe .value
     """
-    x_incell = f['/data/{}/particles/{}/positionOffset/{}'.format(timestep, species, label)]
-    x_incell_unitSI = x_incell.attrs["unitSI"]
-    x_offset= f['/data/{}/particles/{}/position/{}'.format(timestep, species, label)]
-    x_offset_unitSI = x_offset.attrs["unitSI"]
-    
-    #if label=="y":
-    #    properties = f['/data/{}/fields/{}'.format(timestep, "E")]
-    #    offset = properties.attrs["gridGlobalOffset"] 
-    #    unitSI = properties.attrs["gridUnitSI"]
-    #    ## normaly the laser propagates along y axis, there is no global offset for other axis reasonable
-    #    offset = offset[1]
-    #else:
-    #    offset = 0.0
-    ##return (offset*unitSI + x_incell_unitSI*np.array(x_incell) + x_offset_unitSI*np.array(x_offset))*1e6
-    return (x_incell_unitSI*np.array(x_incell) + x_offset_unitSI*np.array(x_offset))*1e6
+    return ParticleView(f, timestep, species).position(label)
 
 def load_position_masked(label, timestep, f, dataset_mask, species="en"):
     """
     returns position on axis "label" in µm
-    TODO: use maybe .value
     """
     x_incell = f['/data/{}/particles/{}/positionOffset/{}'.format(timestep, species, label)]
     x_incell_unitSI = x_incell.attrs["unitSI"]
     x_offset= f['/data/{}/particles/{}/position/{}'.format(timestep, species, label)]
     x_offset_unitSI = x_offset.attrs["unitSI"]
     
-    return (x_incell_unitSI*mask(x_incell,dataset_mask) + x_offset_unitSI*mask(x_offset, dataset_mask))*1e6
+    x_incell, x_offset = mask_datasets([x_incell, x_offset], dataset_mask)
+    position = x_offset.astype(np.float64)
+    position *= x_offset_unitSI*1e6
+    position += x_incell*(x_incell_unitSI*1e6)
+    return position
 
 def load_momentum(label, timestep, f, species="en"):
     """
@@ -56,10 +222,7 @@ def load_momentum(label, timestep, f, species="en"):
     returns normalized momentum on axis "label" (\gamma \beta_x)
     weighting needs to taken into account for correct momentum
     """
-    u = f['/data/{}/particles/{}/momentum/{}'.format(timestep, species, label)]  # ~ gamma m \beta c
-    w = f['/data/{}/particles/{}/weighting'.format(timestep, species)]  # 
-    u_unitSI = u.attrs["unitSI"]
-    return u_unitSI*np.array(u) /np.array(w)  /(const.m_e*const.c) 
+    return ParticleView(f, timestep, species).momentum(label)
                                                                                                  
 def load_momentum_masked(label, timestep, f, dataset_mask, species="en"):
     """
@@ -70,7 +233,11 @@ def load_momentum_masked(label, timestep, f, dataset_mask, species="en"):
     u = f['/data/{}/particles/{}/momentum/{}'.format(timestep, species, label)]  # ~ gamma m \beta c
     w = f['/data/{}/particles/{}/weighting'.format(timestep, species)]  # 
     u_unitSI = u.attrs["unitSI"]
-    return u_unitSI * mask(u, dataset_mask) / (mask(w, dataset_mask))  /(const.m_e*const.c) 
+    u, w = mask_datasets([u, w], dataset_mask)
+    momentum = u.astype(np.float64)
+    momentum *= u_unitSI/(const.m_e*const.c)
+    momentum /= w
+    return momentum
 
 def load_weighting(timestep, f, species="en"):
     """
@@ -87,7 +254,7 @@ def load_weighting_masked(timestep, f, dataset_mask, species="en"):
     weighting needs to taken into account for correct momentum, charge, aso
     """
     w        = f['/data/{}/particles/{}/weighting'.format(timestep, species)]  # 
-    return mask(w[()], dataset_mask)
+    return mask(w, dataset_mask)
 
 
 def load_id(timestep, f, species="en"):
@@ -103,9 +270,121 @@ def load_momentums(timestep, f, species="en"):
         * energy of particle (gamma)
         * normalized momentums for all axis (\gamma \beta_x)
     Important: weighting needs to taken into account for correct momentum
+    weighting is read once for all axis
+    """
+    return ParticleView(f, timestep, species).momentums()
+
+class FieldView:
+    """
+    access to the fields of one snapshot with strides and block averaging
+    
+    only the hyperslabs selected by the slices (with their steps) are read,
+    downsampling averages blocks of "factors" cells and is done slab by slab along the first axis
+    results are stored in cache_directory as .npz files keyed by (file, timestep, field, slices, factors),
+    so repeated plotting of the same snapshot does not read the h5 file again
+    """
+    def __init__(self, f, timestep, cache_directory=None, slab_bytes=2**26):
+        self.f = f
+        self.timestep = timestep
+        self.cache_directory = cache_directory
+        self.slab_bytes = slab_bytes
+
+    def handles(self, fieldtype, label):
+        """
+        returns dataset and mesh group, label None is used for scalar fields (e.g. densities)
+        """
+        mesh = self.f['/data/{}/fields/{}'.format(self.timestep, fieldtype)]
+        if label is None:
+            return mesh, mesh
+        return mesh[label], mesh
+
+    def cache_file(self, fieldtype, label, slices, factors):
+        if self.cache_directory is None:
+            return None
+        filename = os.path.abspath(self.f.filename)
+        stat = os.stat(filename)
+        key = repr((filename, stat.st_size, stat.st_mtime_ns, self.timestep, fieldtype, label,
+                    [(s.start, s.stop, s.step) for s in slices], factors))
+        return os.path.join(self.cache_directory, hashlib.sha1(key.encode()).hexdigest() + ".npz")
+
+    def load(self, fieldtype, label, slices=None, factors=None):
+        """
+        slices  - one slice per axis in order of the dataset (e.g. z, y, x), steps are strides
+        factors - number of selected cells averaged to one value on each axis,
+                  cells of an incomplete last block are dropped
+        returns field in SI and coordinates of values in SI for each axis (centers of averaged blocks)
+        """
+        dataset, mesh = self.handles(fieldtype, label)
+        shape = dataset.shape
+        if slices is None:
+            slices = [slice(None)] * len(shape)
+        slices = [slice(*s.indices(size)) for s, size in zip(slices, shape)]
+        if factors is None:
+            factors = [1] * len(shape)
+        factors = [int(factor) for factor in factors]
+
+        cache_file = self.cache_file(fieldtype, label, slices, factors)
+        if cache_file is not None and os.path.exists(cache_file):
+            with np.load(cache_file) as cached:
+                return tuple(cached["arr_{}".format(i)] for i in range(len(cached.files)))
+
+        # shrink slices to complete blocks
+        counts = [len(range(s.start, s.stop, s.step)) // factor for s, factor in zip(slices, factors)]
+        slices = [slice(s.start, s.start + count * factor * s.step, s.step)
+                  for s, count, factor in zip(slices, counts, factors)]
+        field = self.read_averaged(dataset, slices, factors, counts)
+        field *= dataset.attrs["unitSI"]
+
+        offset  = mesh.attrs["gridGlobalOffset"]
+        spacing = mesh.attrs["gridSpacing"]
+        unitSI  = mesh.attrs["gridUnitSI"]
+        axes = []
+        for i, (s, factor, count) in enumerate(zip(slices, factors, counts)):
+            cells = s.start + s.step * (np.arange(count) * factor + (factor - 1) * 0.5)
+            axes.append((offset[i] + cells * spacing[i]) * unitSI)
+
+        result = (field,) + tuple(axes)
+        if cache_file is not None:
+            os.makedirs(self.cache_directory, exist_ok=True)
+            temporary_file = cache_file + ".{}.tmp.npz".format(os.getpid())
+            np.savez(temporary_file, *result)
+            os.replace(temporary_file, cache_file)
+        return result
+
+    def read_averaged(self, dataset, slices, factors, counts):
+        """
+        reads the strided hyperslab slab by slab along the first axis and averages blocks of each slab
+        """
+        field = np.zeros(counts)
+        if 0 in counts:
+            return field
+        plane_bytes = np.prod([count * factor for count, factor in zip(counts[1:], factors[1:])]) * 8
+        blocks_per_slab = max(1, int(self.slab_bytes // (plane_bytes * factors[0])))
+        first = slices[0]
+        for a in range(0, counts[0], blocks_per_slab):
+            b = min(a + blocks_per_slab, counts[0])
+            slab_slice = slice(first.start + a * factors[0] * first.step, first.start + b * factors[0] * first.step,
+                               first.step)
+            slab = dataset[(slab_slice,) + tuple(slices[1:])].astype(np.float64)
+            blocks_shape = []
+            for count, factor in zip([b - a] + counts[1:], factors):
+                blocks_shape.extend([count, factor])
+            field[a:b] = slab.reshape(blocks_shape).mean(axis=tuple(range(1, 2 * len(factors), 2)))
+        return field
+
+
+def load_field_downsampled(fieldtype, label, timestep, f,
+                           z_slice=None, y_slice=None, x_slice=None,
+                           factors=(1, 1, 1), cache_directory=None):
+    """
+    like get_field, but the slices may have steps and blocks of "factors" cells are averaged,
+    only the needed hyperslabs are read
+    with cache_directory results are stored on disk and reused
+    returns field in SI and z, y, x in SI
     """
-    momentums = np.array([load_momentum(l, timestep, f,species) for l in ["x","y","z"]])
-    return np.sqrt(np.sum(momentums**2.0, axis=0)), momentums
+    slices = [s if s is not None else slice(None) for s in [z_slice, y_slice, x_slice]]
+    return FieldView(f, timestep, cache_directory).load(fieldtype, label, slices, factors)
+
 
 def load_field(fieldtype, label, timestep, f, 
                  xstart=None, xstop=None,
@@ -0,0 +1,41 @@
+"""
+Input:
++ timestep
+settings.py:
++ filename_original_file
++ filename_bunch_idendifiers
++ species
++ ratio_deleted_particles, reduction_seed
++ simulation_box_size
++ filename_gdf_file, N_macro
+
+Output:
++ GDF file for GPT with columns x y z Bx By Bz G nmacro
+
+replaces filter-particle-ids-of-h5.py, particle reduction, hdf-to-txt.py and asci2gdf,
+only the GDF file is written
+"""
+###### init ####
+import numpy as np
+from settings import *
+from hdf_to_gdf_pipeline import hdf_to_gdf_pipeline
+import sys
+
+timestep =int(sys.argv[1])
+
+# optional
+data_directory = ''
+
+# read particle ids for filtering, all particles are used without this file
+ids = None
+if filename_bunch_idendifiers is not None:
+    ids = np.loadtxt(filename_bunch_idendifiers, dtype=np.uint64, ndmin=1)
+
+try:
+    number_particles = hdf_to_gdf_pipeline(data_directory+filename_original_file.format(timestep),
+                                           filename_gdf_file.format(timestep, N_macro), timestep, species,
+                                           simulation_box_size, ids, ratio_deleted_particles,
+                                           reduction_seed, stepsize)
+except ValueError as error:
+    sys.exit(str(error))
+print("{} particles written to {}".format(number_particles, filename_gdf_file.format(timestep, N_macro)))
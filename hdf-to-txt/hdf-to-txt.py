@@ -14,11 +14,13 @@ from get_fields_and_particles import *
 
 from settings import *
 import sys
+#### streaming histograms of the converter package, its directory has to be in PYTHONPATH
+from particle_histograms import Histograms
+#### columns for GPT are the same as in the GDF pipeline
+from hdf_to_gdf_pipeline import gpt_columns, average_position, labels
 
 timestep =int(sys.argv[1])
 
-N_macro = "-N100000"
-
 fs = 15
 plt.rcParams.update({'font.size': fs})
 plt.rcParams['xtick.direction'] = 'in'
@@ -27,50 +29,40 @@ plt.rcParams['axes.facecolor'] = 'white'
 plt.rcParams['figure.facecolor'] = 'white'
 filename = "reduced_data{}ts{}.h5".format(timestep, N_macro)
 #species  = 'en_all'
-simulation_box_size = [1.36089598e-04, 8.93087984e-05, 1.36089598e-04]
+#### N_macro and simulation_box_size are given in settings.py
 outfilename = "reduced-{}ts{}.txt".format(timestep, N_macro)
 
 f = h5py.File(filename, "r")
-ux = load_momentum("x", timestep, f, species=species)
-uy = load_momentum("y", timestep, f, species=species)
-uz = load_momentum("z", timestep, f, species=species)
-x  = load_position("x", timestep, f, species=species) - simulation_box_size[0]*0.5e6
-y  = load_position("y", timestep, f, species=species)
-z  = load_position("z", timestep, f, species=species) - simulation_box_size[2]*0.5e6
-w  = load_weighting(timestep, f, species=species)
+#### dataset handles and units are read once, particles are processed block by block,
+#### so memory does not depend on the number of particles
+particles = ParticleView(f, timestep, species=species, cache_bytes=0)
 
-## compile data for GPT
-G = np.sqrt(1.0 + ux**2.0 + uy**2.0 + uz**2.0)
-Bx = ux/G
-By = uy/G
-Bz = uz/G
-y  -= np.average(y)
+header  = " ".join(labels)
+longitudinal_labels = "z (PIC)[µm]", "Energy [MeV/c²]"
 
-#data_array = np.array([x,y,z, GBx, GBy, G])
-### the data array contains the data in the order for GPT, ie. beam moves in Y[PIC] == Z[GPT]
-### for this reason, y and z are flipped
-data_array = np.array([1e-6*x,1e-6*z,1e-6*y, Bx, Bz, By, G, w])
-#header  = "x y z GBx GBy GBz"
-header  = "x y z Bx By Bz G nmacro"
-labels    = "x", "y", "z", "Bx", "By", "Bz", "G", "nmacro"
+overview = Histograms(labels, bins=50)
+longitudinal = Histograms([], [longitudinal_labels], bins=100)
 
-### ploting data for overview issues
-fig = plt.figure(constrained_layout=False, figsize=(10,10))
-spec = fig.add_gridspec(ncols=3, nrows=3)
-spec.update(wspace=0.2, hspace=0.20) # set the spacing between axes.
+def histogram_columns(data_array):
+    columns = dict(zip(labels, data_array))
+    columns[longitudinal_labels[0]] = 1e6*data_array[2]
+    columns[longitudinal_labels[1]] = data_array[6]*0.511
+    return columns
 
-for i, ii in enumerate(data_array):
-    fig.add_subplot(spec[i//3, i%3])
-    plt.hist(ii, bins=50, alpha=0.8)
-    plt.ylabel("#")
-    plt.text(np.mean(ii),0, "RMS {:.1e}".format(np.std(ii)), horizontalalignment='center')
-    plt.title(labels[i])
-    #plt.show()
-plt.savefig(outfilename+"-overview.png")
-plt.hist2d(y, G*0.511, bins=100)
-plt.xlabel("z (PIC)[µm]")
-plt.ylabel("Energy [MeV/c²]")
-plt.savefig(outfilename+"-longitudinal-ps.png")
+### first pass: average of y, only positions on y are read
+y_average = average_position(particles, "y")
 
-### Saving data as TXT
-np.savetxt(fname=outfilename, X=data_array.T, header=header, comments='')
+### second pass: saving data as TXT and filling histograms for overview issues,
+### ranges of histograms start with the first block and are widened by merging bins
+with open(outfilename, "w") as outfile:
+    outfile.write(header + "\n")
+    for a, b in particles.blocks():
+        data_array = gpt_columns(particles, a, b, y_average, simulation_box_size)
+        np.savetxt(outfile, data_array.T)
+        columns = histogram_columns(data_array)
+        overview.add(columns)
+        longitudinal.add(columns)
+
+### ploting data for overview issues
+overview.save(outfilename+"-overview.png")
+longitudinal.save(outfilename+"-longitudinal-ps.png")
@@ -0,0 +1,164 @@
+"""
+Filter by particle ids, random reduction and conversion to a GDF file for GPT in one pass.
+
+Only masks of the particles are kept for the whole species, the columns for GPT are
+computed chunk by chunk and written at their place in the GDF file,
+so no filtered, reduced or text copy of the particles is written.
+Each stage reports its time.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import struct
+import time
+import numpy as np
+import h5py
+
+from get_fields_and_particles import ParticleView
+from filter_particle_ids import find_particles
+#### GDF writers of the converter, its directory has to be in PYTHONPATH
+from gdf_writer import add_gdf_id, write_string, add_versions, write_first_block, Gdf_arrays_writer
+
+
+#header  = "x y z GBx GBy GBz"
+labels = "x", "y", "z", "Bx", "By", "Bz", "G", "nmacro"
+
+
+class Stage_times:
+    """
+    wall clock time of each stage, summed over all chunks
+    """
+    def __init__(self):
+        self.times = OrderedDict()
+
+    @contextmanager
+    def __call__(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.) + time.perf_counter() - start
+
+    def report(self):
+        for name, seconds in self.times.items():
+            print("{:8s} {:8.3f} s".format(name, seconds))
+
+
+class Gdf_columns_writer(Gdf_arrays_writer):
+    """
+    GDF file with one array of doubles for each column, like the output of asci2gdf
+    the number of rows is known in advance, so chunks of all columns are written at their place in one pass
+    """
+    def __init__(self, gdf_file, names, size, creator="hdf-to-gdf"):
+        add_gdf_id(gdf_file)
+        gdf_file.write(struct.pack('i', int(time.time())))
+        write_string(creator, gdf_file)
+        write_string('empty', gdf_file)
+        add_versions('gdf_version', gdf_file, None, 1, 1)
+        add_versions('softwareVersion', gdf_file, None, 3, 0)
+        add_versions('destination_version', gdf_file, None)
+        write_first_block(gdf_file)
+        Gdf_arrays_writer.__init__(self, gdf_file, names, size)
+
+
+def select_ids(particles, ids, stepsize):
+    """
+    returns mask of particles with ids, all particles if ids is None
+    raises ValueError if some of the ids are not in the species
+    """
+    if ids is None:
+        return np.ones(len(particles), dtype=bool)
+    return find_particles(particles.dataset("particleId"), ids, stepsize)
+
+
+def random_reduction(particles, particles_mask, ratio_deleted_particles, seed=None):
+    """
+    deletes int(ratio_deleted_particles * selected) of the selected particles at random
+    returns new mask and factor for the weighting of kept particles, which conserves the total weighting
+    """
+    selected = np.flatnonzero(particles_mask)
+    number_deleted = int(len(selected) * ratio_deleted_particles)
+    random = np.random.default_rng(seed)
+    reduced_mask = particles_mask.copy()
+    reduced_mask[random.choice(selected, number_deleted, replace=False)] = False
+
+    selected_weighting = 0.
+    kept_weighting = 0.
+    w = np.empty(min(particles.stepsize, len(particles)))
+    for a, b in particles.blocks():
+        particles.read("weighting", w, a, b, a)
+        selected_weighting += np.sum(w[:b-a][particles_mask[a:b]])
+        kept_weighting += np.sum(w[:b-a][reduced_mask[a:b]])
+    if kept_weighting == 0.:
+        return reduced_mask, 1.
+    return reduced_mask, selected_weighting / kept_weighting
+
+
+def average_position(particles, label, particles_mask=None):
+    """
+    returns unweighted average position on axis "label" in µm of particles with particles_mask==True
+    """
+    total = 0.
+    for a, b in particles.blocks():
+        position = particles.position(label, start=a, stop=b)
+        if particles_mask is not None:
+            position = position[particles_mask[a:b]]
+        total += np.sum(position)
+    number = len(particles) if particles_mask is None else np.count_nonzero(particles_mask)
+    if number == 0:
+        return 0.
+    return total / number
+
+
+def gpt_columns(particles, a, b, y_average, simulation_box_size, particles_mask=None, weight_factor=1.):
+    """
+    columns for GPT (see labels) of particles a:b with particles_mask==True
+    the data array contains the data in the order for GPT, ie. beam moves in Y[PIC] == Z[GPT]
+    for this reason, y and z are flipped, y is centered and x, z are relative to the middle of the box
+    """
+    w = np.empty(b - a)
+    particles.read("weighting", w, a, b, a)
+    ux = particles.momentum("x", start=a, stop=b, w=w)
+    uy = particles.momentum("y", start=a, stop=b, w=w)
+    uz = particles.momentum("z", start=a, stop=b, w=w)
+    x  = particles.position("x", start=a, stop=b) - simulation_box_size[0]*0.5e6
+    y  = particles.position("y", start=a, stop=b) - y_average
+    z  = particles.position("z", start=a, stop=b) - simulation_box_size[2]*0.5e6
+    G = np.sqrt(1.0 + ux**2.0 + uy**2.0 + uz**2.0)
+    data_array = np.array([1e-6*x,1e-6*z,1e-6*y, ux/G, uz/G, uy/G, G, w*weight_factor])
+    if particles_mask is None:
+        return data_array
+    return data_array[:, particles_mask[a:b]]
+
+
+def hdf_to_gdf_pipeline(filename, gdf_filename, timestep, species, simulation_box_size,
+                        ids=None, ratio_deleted_particles=0., seed=None, stepsize=2**20):
+    """
+    writes gdf_filename for GPT from species at timestep of filename:
+    particles with ids (all if ids is None), of which ratio_deleted_particles are deleted at random
+    returns number of written particles
+    raises ValueError if some of the ids are not in the file
+    """
+    times = Stage_times()
+    with h5py.File(filename, "r") as f:
+        particles = ParticleView(f, timestep, species=species, cache_bytes=0, stepsize=stepsize)
+        with times("filter"):
+            particles_mask = select_ids(particles, ids, stepsize)
+        with times("reduce"):
+            particles_mask, weight_factor = random_reduction(particles, particles_mask,
+                                                             ratio_deleted_particles, seed)
+        with times("center"):
+            y_average = average_position(particles, "y", particles_mask)
+
+        size = int(np.count_nonzero(particles_mask))
+        with open(gdf_filename, "wb") as gdf_file:
+            writer = Gdf_columns_writer(gdf_file, labels, size)
+            for a, b in particles.blocks():
+                if not particles_mask[a:b].any():
+                    continue
+                with times("columns"):
+                    data_array = gpt_columns(particles, a, b, y_average, simulation_box_size,
+                                             particles_mask, weight_factor)
+                with times("write"):
+                    writer.write(data_array)
+    times.report()
+    return size
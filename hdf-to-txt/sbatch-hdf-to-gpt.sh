@@ -18,6 +18,8 @@
 
 export PYTHONPATH="$HOME/anaconda3/"
 export PATH="$PYTHONPATH/bin:$PATH"
+# gdf_writer.py of the converter, one directory above hdf-to-txt
+export PYTHONPATH="$PYTHONPATH:$(pwd)/.."
 
 iteration=${SLURM_ARRAY_TASK_ID}000
 # copy this file to here from original data
@@ -26,17 +28,21 @@ input_file="simData_filtered_%T.h5"
 #output_file="reduced_data-from-PIC-run006-${iteration}ts.gdf"
 
 echo "iteration $iteration"
-echo "filtering h5 file for selected macro particle IDs"
+#### filtering, reduction and conversion in one pass, see settings.py
+#### only the GDF file is written, the steps below are the previous way with intermediate files
+echo "filtering, reduction and writing gdf file for GPT"
+python hdf-to-gdf.py ${iteration}
+#echo "filtering h5 file for selected macro particle IDs"
 #python filter-particle-ids-of-h5.py ${iteration}
-echo "staring reduction"
+#echo "staring reduction"
 #cp -v simData_filtered_${iteration}.h5  particle_reduction/$input_file
 #### file from run 006, 150000TS has 985862 particles
 # ratio for N=5000: 0.9949282962524166
 # ratio for N=100k: 0.8985659250483333
-python particle_reduction/reduction_main.py -hdf ${input_file} -hdf_re reduced_data%Tts-N100000.h5 -iteration ${iteration} -ratio_deleted_particles 0.8985659250483333 -algorithm random
+#python particle_reduction/reduction_main.py -hdf ${input_file} -hdf_re reduced_data%Tts-N100000.h5 -iteration ${iteration} -ratio_deleted_particles 0.8985659250483333 -algorithm random
 #mv -v particle_reduction/reduced_data${iteration}ts.h5 .
-echo "writing txt file for GPT"
-python hdf-to-txt.py  ${iteration}
+#echo "writing txt file for GPT"
+#python hdf-to-txt.py  ${iteration}
 #asci2gdf -o ${output_file} reduced-${iteration}ts.txt  
 #rm reduced-${iteration}ts.txt 
 echo "DONE"
@@ -1,5 +1,21 @@
 #timestep = 50000
 filename_bunch_idendifiers = "bunch-identifiers.dat"
 species  = 'en_all'
+# original PIConGPU output, it is only read
+filename_original_file = "simData_{}.h5"
 #filename_filtered_file     = "simData_filtered_{}.h5".format(timestep)
 
+#### settings of hdf-to-gdf.py pipeline, simulation box and N_macro are used by hdf-to-txt.py too
+# fraction of the filtered particles, which are deleted at random
+# file from run 006, 150000TS has 985862 particles
+# ratio for N=5000: 0.9949282962524166
+# ratio for N=100k: 0.8985659250483333
+ratio_deleted_particles = 0.8985659250483333
+# seed of random reduction, None gives a new selection at each run
+reduction_seed = None
+N_macro = "-N100000"
+simulation_box_size = [1.36089598e-04, 8.93087984e-05, 1.36089598e-04]
+# result for GPT, formatted with timestep and N_macro
+filename_gdf_file = "reduced_data{}ts{}.gdf"
+# number of particles read at once
+stepsize = 2**20
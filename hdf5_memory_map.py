@@ -0,0 +1,30 @@
+"""Memory maps of HDF5 datasets, shared by openPMD_to_gdf.py and OpenPMD_add_patches.py"""
+
+
+import h5py
+import numpy as np
+
+
+def get_memory_map(dataset):
+    """ Read-only memory map of contiguous, unfiltered dataset of file on disk, values are read
+    straight from the page cache. None if the layout or dtype of dataset does not allow it """
+
+    if dataset.file.driver != 'sec2' or dataset.dtype.kind not in 'biufc' or dataset.size == 0:
+        return None
+    create_plist = dataset.id.get_create_plist()
+    if create_plist.get_layout() != h5py.h5d.CONTIGUOUS or create_plist.get_nfilters() != 0 \
+            or create_plist.get_external_count() != 0:
+        return None
+    offset = dataset.id.get_offset()
+    if offset is None:
+        return None
+    return np.memmap(dataset.file.filename, dtype=dataset.dtype, mode='r', offset=offset, shape=dataset.shape)
+
+
+def get_dataset_view(dataset):
+    """ Memory map of dataset if it is possible, otherwise dataset itself, read by h5py """
+
+    memory_map = get_memory_map(dataset)
+    if memory_map is None:
+        return dataset
+    return memory_map
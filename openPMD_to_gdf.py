@@ -2,16 +2,32 @@
 
 
 from __future__ import division
+import os
 import struct
 from datetime import datetime
 import time
 import re
+import bisect
 import argparse
+import numpy as np
 import openpmd_api
-
-
-def hdf_to_gdf(hdf_file_directory, gdf_file_directory, max_cell_size, species, grid_size):
-    """ Find hdf file in hdf_file_directory, find gdf_file_directory"""
+from gdf_writer import add_gdf_id, write_string, add_versions, write_first_block, write_float, write_ascii_name, \
+    Gdf_arrays_writer
+
+
+def hdf_to_gdf(hdf_file_directory, gdf_file_directory, max_cell_size, species, grid_size, roi=None,
+               overview=None, shard=None, mpi=False, mmap=False):
+    """ Find hdf file in hdf_file_directory, find gdf_file_directory
+    roi - 'xmin:xmax,ymin:ymax,zmin:zmax' in SI, only particles inside this box are converted
+    shard - 'k/N', only part k of N of rows of each species is converted, see gdf_merge.py
+    overview - file for histograms of the last converted species (last GDF step), .npz or image,
+    they are filled from the converted values while writing
+    mpi - run under mpirun: series is opened with MPI.COMM_WORLD (needs mpi4py and openPMD-api with MPI),
+    rank k converts shard k/N and writes its rows at their place in the result file with POSIX seek and write,
+    so the result has to be on a shared filesystem with POSIX write consistency between nodes (not NFS)
+    mmap - contiguous, unfiltered datasets of HDF5 series are memory mapped through h5py instead of
+    read by openPMD-api, other datasets are read by openPMD-api.
+    Files of HDF5 series are opened by h5py in any case, read windows follow chunks of their datasets"""
 
     print('Converting .gdf to .hdf file')
 
@@ -25,18 +41,103 @@ def hdf_to_gdf(hdf_file_directory, gdf_file_directory, max_cell_size, species, g
     if species == None:
         species = ''
 
-    series_hdf = openpmd_api.Series(hdf_file_directory, openpmd_api.Access.read_only)
+    if roi != None:
+        roi = Region_of_interest(roi)
+
+    if shard != None:
+        shard = Shard(shard)
+
+    comm = None
+    if mpi:
+        from mpi4py import MPI
+        comm = MPI.COMM_WORLD
+        shard = Rank_shard(comm)
+
+    if comm is None:
+        series_hdf = openpmd_api.Series(hdf_file_directory, openpmd_api.Access.read_only)
+    else:
+        series_hdf = openpmd_api.Series(hdf_file_directory, openpmd_api.Access.read_only, comm)
     print('Destination .gdf directory not specified. Defaulting to ' + gdf_file_directory)
 
-    with open(gdf_file_directory, 'wb') as gdf_file:
-        hdf_file_to_gdf_file(gdf_file, series_hdf, max_cell_size, species, grid_size)
+    hdf5_files = None
+    if hdf_file_directory.endswith('.h5'):
+        hdf5_files = Hdf5_files(hdf_file_directory, series_hdf, mmap)
 
+    histograms = None
+    if overview != None and comm is None:
+        from particle_histograms import get_overview_histograms
+        histograms = get_overview_histograms()
 
-    gdf_file.close()
+    if comm is None:
+        gdf_file = open(gdf_file_directory, 'wb')
+    else:
+        gdf_file = open_rank_gdf_file(comm, gdf_file_directory)
+    with gdf_file:
+        hdf_file_to_gdf_file(gdf_file, series_hdf, max_cell_size, species, grid_size, roi, shard, hdf5_files,
+                             histograms)
+    if hdf5_files is not None:
+        hdf5_files.close()
+    series_hdf.close()
+
+    if comm is not None:
+        comm.Barrier()
     print('Converting .hdf to .gdf file... Complete.')
 
+    if histograms is not None:
+        histograms.save(overview)
+    elif overview != None and comm.rank == 0:
+        # each rank has only its rows, the histograms are filled from the written file
+        from particle_histograms import gdf_overview
+        gdf_overview(gdf_file_directory, overview)
+
+
+class Rank_gdf_file:
+    """ Result file written by all MPI ranks at once. Blocks are the same on every rank and are written
+    by rank 0 only, the other ranks move past them; rows of arrays are written by every rank to rows_file.
+    Ranks write disjoint byte ranges through their own POSIX file, not through MPI-IO, so the file system
+    has to make writes of all nodes visible in the file after the closing Barrier (e.g. Lustre, GPFS),
+    NFS with client caching is not enough """
+
+    def __init__(self, gdf_file, rank):
+        self.rows_file = gdf_file
+        self.writes_blocks = rank == 0
+
+    def write(self, data):
+        if self.writes_blocks:
+            return self.rows_file.write(data)
+        self.rows_file.seek(len(data), os.SEEK_CUR)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.rows_file.seek(offset, whence)
+
+    def tell(self):
+        return self.rows_file.tell()
+
+    def truncate(self):
+        if self.writes_blocks:
+            self.rows_file.truncate()
+
+    def close(self):
+        self.rows_file.close()
+
+    def __enter__(self):
+        return self
 
-def hdf_file_to_gdf_file(gdf_file, series_hdf, max_cell_size, species, grid_size):
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_rank_gdf_file(comm, gdf_file_directory):
+    """ Rank 0 creates the result file, then every rank opens it """
+
+    if comm.rank == 0:
+        open(gdf_file_directory, 'wb').close()
+    comm.Barrier()
+    return Rank_gdf_file(open(gdf_file_directory, 'r+b'), comm.rank)
+
+
+def hdf_file_to_gdf_file(gdf_file, series_hdf, max_cell_size, species, grid_size, roi=None, shard=None,
+                         hdf5_files=None, histograms=None):
     """ Convert from hdf file to gdf file """
 
     add_gdf_id(gdf_file)
@@ -46,20 +147,7 @@ def hdf_file_to_gdf_file(gdf_file, series_hdf, max_cell_size, species, grid_size
     add_dest_name_root_attribute(gdf_file, series_hdf)
     add_required_version_root_attribute(gdf_file, series_hdf)
     write_first_block(gdf_file)
-    write_file(series_hdf, gdf_file, max_cell_size, species, grid_size)
-
-
-def write_first_block(gdf_file):
-    """ Write required empty first block """
-
-    name = '00'
-    chars_name = []
-    for c in name:
-        chars_name.append(c)
-
-    for s in chars_name:
-        s_pack = struct.pack('c', s.encode('ascii'))
-        gdf_file.write(s_pack)
+    write_file(series_hdf, gdf_file, max_cell_size, species, grid_size, roi, shard, hdf5_files, histograms)
 
 
 def decode_name(attribute_name):
@@ -82,7 +170,6 @@ def get_particles_name(hdf_file):
     return particles_name
 
 
-
 class Name_of_arrays:
     """ Storage of datasets in h5 file """
 
@@ -98,140 +185,543 @@ class Name_of_arrays:
                      'mass': 'm'}
 
 
-class Getting_absolute_coordinates:
+class Component_metadata:
+    """ Shape, dtype, unitSI and value of constant record component.
+    values - memory map of the dataset of component in HDF5 file if memory_map, None if it is read by openPMD-api """
+
+    __slots__ = ('shape', 'dtype', 'unit_si', 'value', 'values')
+
+    def __init__(self, component, dataset=None, memory_map=False):
+        self.shape = component.shape
+        self.dtype = component.dtype
+        self.unit_si = component.unit_SI
+        self.value = None
+        if component.constant:
+            self.value = component.get_attribute("value")
+        self.values = None
+        if memory_map and dataset is not None and not component.constant:
+            self.values = get_component_memory_map(dataset, self.shape)
+
+
+class Species_metadata:
+    """ Records and components of one species, read once for each iteration,
+    all decisions of conversion are made from it without further requests to the series.
+    chunk_starts - first rows of storage chunks (ADIOS2 blocks, HDF5 chunks) of all converted components,
+    if they are chunked differently each chunk of each component starts a chunk here """
+
+    __slots__ = ('records', 'particle_shape', 'chunk_starts')
+
+    converted_records = ("position", "positionOffset", "momentum", "weighting")
+
+    def __init__(self, particle_species, species_group=None, memory_map=False):
+        self.records = {}
+        chunk_starts = set()
+        for record_name, record in particle_species.items():
+            self.records[record_name] = {}
+            for name, component in record.items():
+                dataset = get_component_dataset(species_group, record_name, name)
+                self.records[record_name][name] = Component_metadata(component, dataset, memory_map)
+                if record_name in self.converted_records and not component.constant:
+                    chunk_starts.update(get_chunk_starts(component, dataset))
+        self.particle_shape = None
+        if "particleShape" in particle_species.attributes:
+            self.particle_shape = particle_species.get_attribute("particleShape")
+        self.chunk_starts = sorted(chunk_starts)
+
+    def has_record(self, name_record):
+        return name_record in self.records
+
+    def is_convertible(self):
+        return self.has_record("momentum") and self.has_record("position")
+
+    def get_size(self):
+        """ Number of particles, from position components """
+
+        size = 0
+        for component in self.records["position"].values():
+            size = component.shape[0]
+        return size
+
+
+class Hdf5_files:
+    """ Files of HDF5 series opened by h5py for chunk layout of datasets of particles,
+    with memory_map contiguous datasets are memory mapped too """
+
+    def __init__(self, series_directory, series_hdf, memory_map=False):
+        self.series_directory = series_directory
+        self.base_path = series_hdf.base_path
+        self.particles_path = series_hdf.particles_path
+        self.memory_map = memory_map
+        self.files = {}
+
+    def get_file_name(self, iteration_index):
+        """ File of iteration, %T or %0nT of file-based series is replaced by iteration_index """
+
+        match = re.search('%(0[0-9]+)?T', self.series_directory)
+        if match == None:
+            return self.series_directory
+        padding = 0 if match.group(1) == None else int(match.group(1))
+        return self.series_directory[:match.start()] + str(iteration_index).zfill(padding) + \
+            self.series_directory[match.end():]
+
+    def get_particles_group(self, iteration_index):
+        """ Group of particles of iteration, None if series is not HDF5 or the file or group can not be opened """
+
+        import h5py
+
+        if not self.series_directory.endswith('.h5'):
+            return None
+        file_name = self.get_file_name(iteration_index)
+        if file_name not in self.files:
+            try:
+                self.files[file_name] = h5py.File(file_name, 'r')
+            except OSError:
+                self.files[file_name] = None
+        hdf_file = self.files[file_name]
+        path = self.base_path.replace('%T', str(iteration_index)) + self.particles_path
+        if hdf_file is None or path not in hdf_file:
+            return None
+        return hdf_file[path]
+
+    def close(self):
+        for hdf_file in self.files.values():
+            if hdf_file is not None:
+                hdf_file.close()
+
+
+def get_component_dataset(species_group, record_name, component_name):
+    """ h5py dataset of record component, None if there is no such dataset """
+
+    import h5py
+
+    if species_group is None:
+        return None
+    record = species_group.get(record_name)
+    if component_name == openpmd_api.Mesh_Record_Component.SCALAR:
+        dataset = record
+    elif isinstance(record, h5py.Group):
+        dataset = record.get(component_name)
+    else:
+        return None
+    if isinstance(dataset, h5py.Dataset):
+        return dataset
+    return None
 
-    def __init__(self, particle_spices, axis):
-        self.unit_si_offset = particle_spices["positionOffset"][axis].unit_SI
-        self.unit_si_position = particle_spices["position"][axis].unit_SI
 
-    def __call__(self, value):
-        absolute_coord = value[0] * self.unit_si_position + value[1] * self.unit_si_offset
-        return absolute_coord
+def get_component_memory_map(dataset, shape):
+    """ Memory map of dataset, None if its layout does not allow it or it has other shape than component """
 
+    from hdf5_memory_map import get_memory_map
 
-class Getting_absolute_momentum:
+    memory_map = get_memory_map(dataset)
+    if memory_map is None or list(memory_map.shape) != list(shape):
+        return None
+    return memory_map
 
-    def __init__(self, particle_spices, axis):
-        self.unit_si_momentum = particle_spices["momentum"][axis].unit_SI
 
-    def __call__(self, value):
+def get_chunk_starts(component, dataset=None):
+    """ Sorted first rows of chunks of component, which are available in storage.
+    HDF5 reports a dataset as one chunk, so chunks of its h5py dataset are used if it is given """
 
-        return value * self.unit_si_momentum
+    if dataset is not None:
+        if dataset.chunks is None or len(dataset.shape) == 0:
+            return []
+        return list(range(0, dataset.shape[0], dataset.chunks[0]))
+    try:
+        chunks = component.available_chunks()
+    except Exception:
+        return []
+    return sorted(set(int(chunk.offset[0]) for chunk in chunks if len(chunk.offset) != 0 and chunk.extent[0] > 0))
+
+
+def get_read_windows(chunk_starts, size, max_cell_size):
+    """ Ranges of rows (idx_start, idx_end) read at once. Whole storage chunks are grouped
+    up to max_cell_size rows, only a chunk larger than max_cell_size is split """
+
+    boundaries = [start for start in chunk_starts if 0 < start < size] + [size]
+    windows = []
+    window_start = 0
+    chunk_start = 0
+    for chunk_end in boundaries:
+        if chunk_end - window_start > max_cell_size and chunk_start > window_start:
+            windows.append((window_start, chunk_start))
+            window_start = chunk_start
+        while chunk_end - window_start > max_cell_size:
+            windows.append((window_start, window_start + max_cell_size))
+            window_start += max_cell_size
+        chunk_start = chunk_end
+    if window_start < size:
+        windows.append((window_start, size))
+    return windows
+
+
+def clip_windows(windows, range_start, range_end):
+    """ Parts of read windows inside rows range_start:range_end """
+
+    idx = bisect.bisect_right([window_end for window_start, window_end in windows], range_start)
+    for window_start, window_end in windows[idx:]:
+        if window_start >= range_end:
+            break
+        yield max(window_start, range_start), min(window_end, range_end)
+
+
+def get_species_group(particles_group, species):
+    if particles_group is None:
+        return None
+    return particles_group.get(species)
+
+
+def get_species_metadata(iteration, species='', particles_group=None, memory_map=False):
+    """ Metadata of all species of iteration or of the species with name species,
+    particles_group - h5py group of particles of iteration for chunks of datasets,
+    memory_map - datasets of particles_group are memory mapped if their layout allows it """
+
+    if species != '':
+        if species not in iteration.particles:
+            return {}
+        return {species: Species_metadata(iteration.particles[species], get_species_group(particles_group, species),
+                                          memory_map)}
+    return {name: Species_metadata(particle_species, get_species_group(particles_group, name), memory_map)
+            for name, particle_species in iteration.particles.items()}
+
+
+class Region_of_interest:
+    """ Box in SI, only particles inside it are converted.
+    Parsed from 'xmin:xmax,ymin:ymax,zmin:zmax', empty bound means no limit """
+
+    axes_names = ['x', 'y', 'z']
+
+    def __init__(self, roi):
+        self.bounds = {}
+        for axis, axis_bounds in zip(self.axes_names, roi.split(',')):
+            low, high = axis_bounds.split(':')
+            low = float(low) if low != '' else -np.inf
+            high = float(high) if high != '' else np.inf
+            self.bounds[axis] = (low, high)
+
+    def get_patches_overlap(self, offsets, extents, number_patches):
+        """ For boxes of patches: which overlap with region and which are fully inside it """
+
+        overlap = np.ones(number_patches, dtype=bool)
+        inside = np.ones(number_patches, dtype=bool)
+        for axis, (low, high) in self.bounds.items():
+            if axis not in offsets:
+                inside[:] = False
+                continue
+            start = offsets[axis]
+            end = start + extents[axis]
+            overlap &= (start <= high) & (end > low)
+            inside &= (start >= low) & (end <= high)
+        return overlap, inside
+
+    def get_mask(self, coordinates):
+        """ Mask of particles inside region, coordinates - dict axis -> absolute values in SI """
+
+        mask = None
+        for axis, values in coordinates.items():
+            low, high = self.bounds[axis]
+            axis_mask = (values >= low) & (values <= high)
+            mask = axis_mask if mask is None else mask & axis_mask
+        return mask
+
+
+class Particles_selection:
+    """ Rows of species to convert, as ranges (idx_start, idx_end, mask), mask None means all rows """
+
+    def __init__(self):
+        self.ranges = []
+        self.size = 0
+
+    def add(self, idx_start, idx_end, mask=None):
+        if mask is None:
+            self.size += idx_end - idx_start
+        else:
+            self.size += int(np.count_nonzero(mask))
+        self.ranges.append((idx_start, idx_end, mask))
+
+
+class Shard:
+    """ Part k of N of rows of each species, parsed from 'k/N'.
+    Shards of all k written one after another give the rows of the whole species """
+
+    def __init__(self, shard):
+        number, count = shard.split('/')
+        self.number = int(number)
+        self.count = int(count)
+        if not 0 <= self.number < self.count:
+            raise ValueError('shard ' + shard + ' is not in 0/N .. N-1/N')
+
+    def get_rows(self, size):
+        return self.number * size // self.count, (self.number + 1) * size // self.count
+
+    def get_rows_layout(self, selected_size):
+        """ Number of rows of written arrays and first row of the shard in them,
+        each shard is written to its own file """
+
+        return selected_size, 0
+
+    def get_selection(self, selection, size):
+        """ Part of selection in rows of the shard """
+
+        shard_start, shard_end = self.get_rows(size)
+        shard_selection = Particles_selection()
+        for idx_start, idx_end, mask in selection.ranges:
+            start = max(idx_start, shard_start)
+            end = min(idx_end, shard_end)
+            if start >= end:
+                continue
+            if mask is None:
+                shard_selection.add(start, end)
+            else:
+                shard_selection.add(start, end, mask[start - idx_start:end - idx_start])
+        return shard_selection
+
+
+class Rank_shard(Shard):
+    """ Shard of one MPI rank, the shards of all ranks are written into one file one after another """
+
+    def __init__(self, comm):
+        Shard.__init__(self, str(comm.rank) + '/' + str(comm.size))
+        self.comm = comm
+
+    def get_rows_layout(self, selected_size):
+        rows_before = self.comm.exscan(selected_size)
+        if self.comm.rank == 0:
+            rows_before = 0
+        return self.comm.allreduce(selected_size), rows_before
+
+
+def get_all_selection(windows):
+    """ All rows of species, in read windows """
+
+    selection = Particles_selection()
+    for idx_start, idx_end in windows:
+        selection.add(idx_start, idx_end)
+    return selection
+
+
+def load_patches_boxes(series, particle_species):
+    """ Ranges of rows and boxes in SI of particle patches of species, None if there are no patches """
+
+    patches = particle_species.particle_patches
+    names = [name for name, record in patches.items()]
+    if patches.num_patches == 0 or not all(name in names for name in
+                                           ['numParticles', 'numParticlesOffset', 'offset', 'extent']):
+        return None
+
+    SCALAR = openpmd_api.Patch_Record_Component.SCALAR
+    number_particles = patches["numParticles"][SCALAR].load()
+    particles_offset = patches["numParticlesOffset"][SCALAR].load()
+    offsets = {}
+    extents = {}
+    for axis, component in patches["offset"].items():
+        offsets[axis] = (component.load(), component.unit_SI)
+    for axis, component in patches["extent"].items():
+        extents[axis] = (component.load(), component.unit_SI)
+    series.flush()
 
+    offsets = {axis: values * unit_si for axis, (values, unit_si) in offsets.items()}
+    extents = {axis: values * unit_si for axis, (values, unit_si) in extents.items()}
+    return particles_offset.astype(np.int64), number_particles.astype(np.int64), offsets, extents
 
-class Read_momentum:
-    def __init__(self, series, particle_spices, axis):
-        self.particle_spices = particle_spices
-        self.series = series
-        self.axis = axis
 
-    def __call__(self, idx_start, idx_end):
+def get_patches_ranges(roi, particles_offset, number_particles, offsets, extents):
+    """ Ranges of rows (idx_start, idx_end, need_filter) of patches overlapping with roi,
+    neighbour ranges of the same kind are joined """
 
-        current_values = self.particle_spices["momentum"][self.axis][idx_start:idx_end]
-        self.series.flush()
+    overlap, inside = roi.get_patches_overlap(offsets, extents, len(number_particles))
+    ranges = []
+    for idx in np.nonzero(overlap & (number_particles > 0))[0]:
+        idx_start = int(particles_offset[idx])
+        idx_end = idx_start + int(number_particles[idx])
+        need_filter = not inside[idx]
+        if len(ranges) != 0 and ranges[-1][1] == idx_start and ranges[-1][2] == need_filter:
+            ranges[-1] = (ranges[-1][0], idx_end, need_filter)
+        else:
+            ranges.append((idx_start, idx_end, need_filter))
+    return ranges
 
-        return current_values
 
+def load_values(component, values, idx_start, idx_end):
+    """ Rows idx_start:idx_end from memory map values, or load of component, available after series.flush() """
 
-class Read_coordinate:
-    def __init__(self, series, particle_spices, axis):
-        self.series = series
-        self.axis = axis
-        self.particle_spices = particle_spices
+    if values is not None:
+        return values[idx_start:idx_end]
+    return component[idx_start:idx_end]
 
-    def __call__(self, idx_start, idx_end):
 
-        position = self.particle_spices["position"][self.axis][idx_start:idx_end]
-        offset = self.particle_spices["positionOffset"][self.axis][idx_start:idx_end]
-        self.series.flush()
+def read_absolute_coordinates(series, particle_species, species_metadata, axes_names, idx_start, idx_end):
+    """ position + positionOffset in SI for rows idx_start:idx_end """
 
-        result = list(zip(position, offset))
-        return result
+    loaded = {}
+    for axis in axes_names:
+        position_metadata = species_metadata.records["position"][axis]
+        offset_metadata = species_metadata.records["positionOffset"][axis]
+        position = load_values(particle_species["position"][axis], position_metadata.values, idx_start, idx_end)
+        offset = load_values(particle_species["positionOffset"][axis], offset_metadata.values, idx_start, idx_end)
+        loaded[axis] = (position, position_metadata.unit_si, offset, offset_metadata.unit_si)
+    series.flush()
 
+    coordinates = {}
+    for axis, (position, unit_si_position, offset, unit_si_offset) in loaded.items():
+        coordinates[axis] = position * unit_si_position + offset * unit_si_offset
+    return coordinates
 
-def write_scalar_dataset(gdf_file, particle_species, size_dataset, max_cell_size, name_scalar):
 
-    if not check_item_exist(particle_species, name_scalar):
-        return
+def get_roi_selection(series, particle_species, species_metadata, roi, windows):
+    """ Rows of species inside roi. Only patches overlapping with roi are read,
+    particles of patches on the border of roi are filtered row by row """
 
-    SCALAR = openpmd_api.Mesh_Record_Component.SCALAR
-    mass = particle_species[name_scalar][SCALAR]
-    value = mass.get_attribute("value")
-    mass_unit = mass.get_attribute("unitSI")
-    write_double_dataset_values(gdf_file, Name_of_arrays.dict_datasets.get(name_scalar),
-                                size_dataset, value * mass_unit, max_cell_size)
+    size = species_metadata.get_size()
+    patches_boxes = load_patches_boxes(series, particle_species)
+    if patches_boxes == None:
+        ranges = [(0, size, True)]
+    else:
+        ranges = get_patches_ranges(roi, *patches_boxes)
+
+    axes_names = [axis for axis in roi.bounds if axis in species_metadata.records["position"]]
+    selection = Particles_selection()
+    for range_start, range_end, need_filter in ranges:
+        for idx_start, idx_end in clip_windows(windows, range_start, range_end):
+            if not need_filter:
+                selection.add(idx_start, idx_end)
+                continue
+            coordinates = read_absolute_coordinates(series, particle_species, species_metadata, axes_names,
+                                                    idx_start, idx_end)
+            mask = roi.get_mask(coordinates)
+            if mask is None:
+                selection.add(idx_start, idx_end)
+            elif mask.any():
+                selection.add(idx_start, idx_end, mask)
+    return selection
+
+
+class Read_component_values:
+    def __init__(self, series, component, unit_si=1., values=None):
+        self.series = series
+        self.component = component
+        self.unit_si = unit_si
+        self.values = values
 
+    def __call__(self, idx_start, idx_end):
 
-def write_weight(series, gdf_file, particle_species, max_cell_size):
+        if self.values is not None:
+            return self.values[idx_start:idx_end] * self.unit_si
+        values = self.component[idx_start:idx_end]
+        self.series.flush()
+        return values * self.unit_si
 
-    name = "nmacro"
-    write_dataset_header(name, gdf_file)
 
-    SCALAR = openpmd_api.Mesh_Record_Component.SCALAR
+class Read_absolute_coordinate:
+    def __init__(self, series, particle_species, species_metadata, axis):
+        self.series = series
+        self.particle_species = particle_species
+        self.species_metadata = species_metadata
+        self.axis = axis
 
-    weights = particle_species["weighting"][SCALAR]
-    size = weights.shape[0]
-    size_bin = struct.pack('i', int(size * 8))
-    gdf_file.write(size_bin)
-    number_cells = int(size / max_cell_size)
-    for i in range(1, number_cells + 1):
-        idx_start = (i - 1) * max_cell_size
-        idx_end = i * max_cell_size
-        current_values = weights[idx_start:idx_end]
-        series.flush()
-        type_size = str(max_cell_size) + 'd'
-        gdf_file.write(struct.pack(type_size, *current_values))
-
-    idx_start = number_cells * max_cell_size
-    idx_end = size
-    current_values = weights[idx_start:idx_end]
+    def __call__(self, idx_start, idx_end):
 
-    series.flush()
+        coordinates = read_absolute_coordinates(self.series, self.particle_species, self.species_metadata,
+                                                [self.axis], idx_start, idx_end)
+        return coordinates[self.axis]
 
-    last_cell_size = size - number_cells * max_cell_size
-    type_size = str(last_cell_size) + 'd'
-    gdf_file.write(struct.pack(type_size, *current_values))
 
+class Constant_values:
+    def __init__(self, value):
+        self.value = value
 
-def get_coordinates_size(particle_species):
+    def __call__(self, idx_start, idx_end):
 
-    momentum_values = particle_species["position"]
-    size = 0
-    for value in momentum_values.items():
-        size = value[1].shape[0]
-    return size
+        return np.full(idx_end - idx_start, self.value, dtype=np.float64)
 
 
-def compute_r_macro(particle_species, unit_grid_spacing):
+def get_scalar_value(species_metadata, name_scalar):
+    """ Value of constant scalar record in SI """
 
-    particle_shape = particle_species.get_attribute("particleShape")
-    species_grid_spacing = [i * particle_shape for i in unit_grid_spacing]
-    r_macro = min(species_grid_spacing)/2. #convert_diametr to radius
-    return r_macro
+    SCALAR = openpmd_api.Mesh_Record_Component.SCALAR
+    scalar = species_metadata.records[name_scalar][SCALAR]
+    return scalar.value * scalar.unit_si
 
 
-def write_particles_type(series, particle_species, gdf_file, max_cell_size, unit_grid_spacing):
+def get_species_arrays(series, particle_species, species_metadata, unit_grid_spacing):
+    """ Names of GDF arrays of species in the order of the file and reading of their values,
+    reading_values(idx_start, idx_end) returns values in SI """
 
-    iterate_momentum(series, particle_species, gdf_file, max_cell_size)
+    arrays = []
+    momentum = particle_species["momentum"]
+    for axis, component_metadata in species_metadata.records["momentum"].items():
+        arrays.append((Name_of_arrays.dict_datasets.get('momentum/' + axis),
+                       Read_component_values(series, momentum[axis], component_metadata.unit_si,
+                                             component_metadata.values)))
 
-    iterate_coords(series, particle_species, gdf_file, max_cell_size)
-    size_dataset = get_coordinates_size(particle_species)
-    write_scalar_dataset(gdf_file, particle_species, size_dataset, max_cell_size, "mass")
-    write_scalar_dataset(gdf_file, particle_species, size_dataset, max_cell_size, "charge")
-    write_weight(series, gdf_file, particle_species, max_cell_size)
-    particle_species.get_attribute("particleShape")
-    r_macro = compute_r_macro(particle_species, unit_grid_spacing)
-    write_double_dataset_values(gdf_file, "rmacro", size_dataset, r_macro, max_cell_size)
+    for axis in species_metadata.records["position"]:
+        arrays.append((Name_of_arrays.dict_datasets.get('position/' + axis),
+                       Read_absolute_coordinate(series, particle_species, species_metadata, axis)))
 
+    for name_scalar in ["mass", "charge"]:
+        if species_metadata.has_record(name_scalar):
+            arrays.append((Name_of_arrays.dict_datasets.get(name_scalar),
+                           Constant_values(get_scalar_value(species_metadata, name_scalar))))
+    SCALAR = openpmd_api.Mesh_Record_Component.SCALAR
+    arrays.append(("nmacro", Read_component_values(series, particle_species["weighting"][SCALAR], 1.,
+                                                   species_metadata.records["weighting"][SCALAR].values)))
+    arrays.append(("rmacro", Constant_values(compute_r_macro(species_metadata, unit_grid_spacing))))
+    return arrays
+
+
+def write_particles_selection(series, particle_species, species_metadata, gdf_file, unit_grid_spacing, selection,
+                              histograms=None, rows_layout=None):
+    """ Write selected particles of species, window by window: the rows of a window are written
+    to all arrays at their place, histograms are filled from the same values.
+    rows_layout - number of rows of the arrays and first row of the selection in them,
+    by default the arrays have the selected rows only """
+
+    if rows_layout == None:
+        rows_layout = selection.size, 0
+    size, rows_before = rows_layout
+    arrays = get_species_arrays(series, particle_species, species_metadata, unit_grid_spacing)
+    names = [name for name, reading_values in arrays]
+    writer = Gdf_arrays_writer(gdf_file, names, size, rows_before)
+    if histograms is not None:
+        histograms.reset()
+        histograms.select(names)
+    for idx_start, idx_end, mask in selection.ranges:
+        columns = []
+        for name, reading_values in arrays:
+            values = np.asarray(reading_values(idx_start, idx_end), dtype=np.float64)
+            if mask is not None:
+                values = values[mask]
+            columns.append(values)
+        writer.write(columns)
+        if histograms is not None:
+            histograms.add(dict(zip(names, columns)), columns[names.index("nmacro")])
+
+
+def compute_r_macro(species_metadata, unit_grid_spacing):
+
+    particle_shape = species_metadata.particle_shape
+    species_grid_spacing = [i * particle_shape for i in unit_grid_spacing]
+    r_macro = min(species_grid_spacing)/2. #convert_diametr to radius
+    return r_macro
 
-def check_item_exist(particle_species, name_item):
 
-    item_exist = False
-    for value in particle_species.items():
-        if value[0] == name_item:
-            item_exist = True
+def write_particles_type(series, particle_species, species_metadata, gdf_file, max_cell_size, unit_grid_spacing,
+                         roi=None, shard=None, histograms=None):
 
-    return item_exist
+    """ Write arrays of species, rows are read in windows aligned with storage chunks """
+
+    size = species_metadata.get_size()
+    windows = get_read_windows(species_metadata.chunk_starts, size, max_cell_size)
+    if roi != None:
+        selection = get_roi_selection(series, particle_species, species_metadata, roi, windows)
+    else:
+        selection = get_all_selection(windows)
+    rows_layout = None
+    if shard != None:
+        selection = shard.get_selection(selection, size)
+        rows_layout = shard.get_rows_layout(selection.size)
+    write_particles_selection(series, particle_species, species_metadata, gdf_file, unit_grid_spacing, selection,
+                              histograms, rows_layout)
 
 
 def get_field_sizes(iteration, grid_size):
@@ -254,172 +744,57 @@ def get_field_sizes(iteration, grid_size):
     return unit_grid_spacing
 
 
-def all_species(series, iteration, gdf_file, max_cell_size, grid_size):
+def all_species(series, iteration, gdf_file, max_cell_size, grid_size, roi=None, shard=None, particles_group=None,
+                histograms=None, memory_map=False):
 
     unit_grid_spacing = get_field_sizes(iteration, grid_size)
 
-    for name_group in iteration.particles:
-        if not (check_item_exist(iteration.particles[name_group], "momentum") and
-                check_item_exist(iteration.particles[name_group], "position")):
+    for name_group, species_metadata in get_species_metadata(iteration, '', particles_group, memory_map).items():
+        if not species_metadata.is_convertible():
             continue
 
         write_ascii_name('var', len(name_group), gdf_file, name_group)
-        write_particles_type(series, iteration.particles[name_group], gdf_file, max_cell_size, unit_grid_spacing)
+        write_particles_type(series, iteration.particles[name_group], species_metadata, gdf_file, max_cell_size,
+                             unit_grid_spacing, roi, shard, histograms)
 
 
-def one_type_species(series, iteration, gdf_file, max_cell_size, species, grid_size):
+def one_type_species(series, iteration, gdf_file, max_cell_size, species, grid_size, roi=None, shard=None,
+                     particles_group=None, histograms=None, memory_map=False):
 
-    for name_group in iteration.particles:
-        if name_group == species:
-            if not (check_item_exist(iteration.particles[name_group], "momentum") and
-                    check_item_exist(iteration.particles[name_group], "position")):
-                continue
-            unit_grid_spacing = get_field_sizes(iteration, grid_size)
+    for name_group, species_metadata in get_species_metadata(iteration, species, particles_group, memory_map).items():
+        if not species_metadata.is_convertible():
+            continue
+        unit_grid_spacing = get_field_sizes(iteration, grid_size)
 
-            write_ascii_name('var', len(name_group), gdf_file, name_group)
-            write_particles_type(series, iteration.particles[name_group], gdf_file, max_cell_size, unit_grid_spacing)
+        write_ascii_name('var', len(name_group), gdf_file, name_group)
+        write_particles_type(series, iteration.particles[name_group], species_metadata, gdf_file, max_cell_size,
+                             unit_grid_spacing, roi, shard, histograms)
 
 
-def write_data(series, iteration, gdf_file, max_cell_size, species, grid_size):
+def write_data(series, iteration, gdf_file, max_cell_size, species, grid_size, roi=None, shard=None,
+               particles_group=None, histograms=None, memory_map=False):
 
     time = iteration.time
     write_float('time', gdf_file, float(time))
 
     if species == '':
-        all_species(series, iteration, gdf_file, max_cell_size, grid_size)
+        all_species(series, iteration, gdf_file, max_cell_size, grid_size, roi, shard, particles_group, histograms,
+                    memory_map)
     else:
-        one_type_species(series, iteration, gdf_file, max_cell_size, species, grid_size)
+        one_type_species(series, iteration, gdf_file, max_cell_size, species, grid_size, roi, shard,
+                         particles_group, histograms, memory_map)
 
 
-def write_file(series_hdf, gdf_file, max_cell_size, species, grid_size):
+def write_file(series_hdf, gdf_file, max_cell_size, species, grid_size, roi=None, shard=None, hdf5_files=None,
+               histograms=None):
     for iteration in series_hdf.iterations:
-        write_data(series_hdf, series_hdf.iterations[iteration], gdf_file, max_cell_size, species, grid_size)
-
-
-def write_dataset_values(series, reading_absolute, geting_absolute_values, size, gdf_file, max_cell_size):
-
-    number_cells = int(size / max_cell_size)
-    for i in range(1, number_cells + 1):
-        idx_start = (i - 1) * max_cell_size
-        idx_end = i * max_cell_size
-        current_values = reading_absolute(idx_start, idx_end)
-
-        series.flush()
-        absolute_values = []
-        for value in current_values:
-            absolute_values.append(geting_absolute_values(value))
-
-        type_size = str(max_cell_size) + 'd'
-        gdf_file.write(struct.pack(type_size, *absolute_values))
-
-    idx_start = number_cells * max_cell_size
-    idx_end = size
-    current_values = reading_absolute(idx_start, idx_end)
-
-    series.flush()
-    absolute_values = []
-    for value in current_values:
-        absolute_values.append(geting_absolute_values(value))
-    last_cell_size = size - number_cells * max_cell_size
-    type_size = str(last_cell_size) + 'd'
-    gdf_file.write(struct.pack(type_size, *absolute_values))
-
-
-def write_block_header(value, name_vector, gdf_file):
-    name_value = value[0]
-    size = value[1].shape[0]
-    name_dataset = str(name_vector + name_value)
-    write_dataset_header(Name_of_arrays.dict_datasets.get(name_dataset), gdf_file)
-
-    size_bin = struct.pack('i', int(size * 8))
-    gdf_file.write(size_bin)
-
-
-def iterate_momentum(series, particle_species, gdf_file, max_cell_size):
-
-    name_vector = "momentum/"
-    momentum_values = particle_species["momentum"]
-
-    for value in momentum_values.items():
-        write_block_header(value, name_vector, gdf_file)
-        reading_momentum = Read_momentum(series, particle_species, value[0])
-        getiings_absolute_momentum = Getting_absolute_momentum(particle_species, value[0])
-
-        size = value[1].shape[0]
-        write_dataset_values(series, reading_momentum, getiings_absolute_momentum, size, gdf_file, max_cell_size)
-
-
-def iterate_coords(series, particle_species, gdf_file, max_cell_size):
-
-    name_vector = "position/"
-    momentum_values = particle_species["position"]
-
-    for value in momentum_values.items():
-        write_block_header(value, name_vector, gdf_file)
-        size = value[1].shape[0]
-        name_value = value[0]
-        reading_coordinate = Read_coordinate(series, particle_species, name_value)
-        getiings_absolute_momentum = Getting_absolute_coordinates(particle_species, name_value)
-        write_dataset_values(series, reading_coordinate, getiings_absolute_momentum, size, gdf_file, max_cell_size)
-
-
-
-def write_dataset(gdf_file, absolute_values):
-    """" Write dataset of double values """
-
-    size = len(absolute_values)
-    size_bin = struct.pack('i', int(size * 8))
-    gdf_file.write(size_bin)
-    type_size = str(size) + 'd'
-    gdf_file.write(struct.pack(type_size, *absolute_values))
-
-
-def write_double_dataset_values(gdf_file, name, size_dataset, value, max_cell_size):
-    """" Write dataset of double values """
-
-    write_dataset_header(name, gdf_file)
-    size_bin = struct.pack('i', int(size_dataset * 8))
-    gdf_file.write(size_bin)
-
-    number_cells = int(size_dataset / max_cell_size)
-    for i in range(1, number_cells + 1):
-        array_dataset = [value] * max_cell_size
-        type_size = str(max_cell_size) + 'd'
-        gdf_file.write(struct.pack(type_size, *array_dataset))
-
-    last_cell_size = size_dataset - number_cells * max_cell_size
-    array_dataset = [value] * last_cell_size
-    type_size = str(last_cell_size) + 'd'
-    gdf_file.write(struct.pack(type_size, *array_dataset))
-
-
-
-def write_ascii_name(name, size, gdf_file, ascii_name):
-    """ Write ascii name of value """
-
-    write_string(name, gdf_file)
-    type_bin = struct.pack('i', int(1025))
-    gdf_file.write(type_bin)
-    size_bin = struct.pack('i', int(size))
-    gdf_file.write(size_bin)
-    charlist = list(ascii_name)
-    type_size = str(size) + 's'
-    gdf_file.write(struct.pack(type_size, ascii_name.encode('ascii')))
-
-
-def write_float(name, gdf_file, value):
-    write_string(name, gdf_file)
-    type_bin = struct.pack('i', int(1283))
-    gdf_file.write(type_bin)
-    size_bin = struct.pack('i', 8)
-    gdf_file.write(size_bin)
-    gdf_file.write(struct.pack('d', value))
-
-
-def write_dataset_header(name, gdf_file):
-    write_string(name, gdf_file)
-    type_bin = struct.pack('i', int(2051))
-    gdf_file.write(type_bin)
+        particles_group = None
+        memory_map = False
+        if hdf5_files is not None:
+            particles_group = hdf5_files.get_particles_group(iteration)
+            memory_map = hdf5_files.memory_map
+        write_data(series_hdf, series_hdf.iterations[iteration], gdf_file, max_cell_size, species, grid_size, roi,
+                   shard, particles_group, histograms, memory_map)
 
 
 class Block_types:
@@ -435,13 +810,6 @@ class Block_types:
     no_data = int('0010', 16)  # No data
 
 
-def add_gdf_id(gdf_file):
-   """ Add required indefication block of gdf file"""
-
-   gdf_id_byte = struct.pack('i', Constants.GDFID)
-   gdf_file.write(gdf_id_byte)
-
-
 def add_time_root_attribute(gdf_file, series_hdf):
     """ Add time of creation to root"""
 
@@ -474,15 +842,6 @@ def add_required_version_root_attribute(gdf_file, series_hdf):
     add_versions('destination_version', gdf_file, series_hdf)
 
 
-def add_versions(name, gdf_file, hdf_file, major = 0, minor = 0):
-    """Write version of file to gdf file"""
-
-    major_bin = struct.pack('B', int(major))
-    minor_bin = struct.pack('B', int(minor))
-    gdf_file.write(major_bin)
-    gdf_file.write(minor_bin)
-
-
 def RepresentsInt(s):
     """Check that argument is int value"""
 
@@ -493,26 +852,6 @@ def RepresentsInt(s):
         return False
 
 
-def write_string(name, gdf_file):
-    """Write string value to gdf file"""
-
-    while len(name) < Constants.GDFNAMELEN:
-        name += chr(0)
-
-    chars_name = []
-    for c in name:
-        chars_name.append(c)
-
-    for s in chars_name:
-        s_pack = struct.pack('c', s.encode('ascii'))
-        gdf_file.write(s_pack)
-
-
-class Constants:
-    GDFID = 94325877
-    GDFNAMELEN = 16
-
-
 if __name__ == "__main__":
     """ Parse arguments from command line """
 
@@ -524,8 +863,8 @@ if __name__ == "__main__":
     parser.add_argument("-gdf", metavar='gdf_file', type=str,
                         help="result gdf file")
 
-    parser.add_argument("-max_cell", metavar='max_cell', type=str,
-                        help="result gdf file")
+    parser.add_argument("-max_cell", metavar='max_cell', type=int,
+                        help="maximal number of particles read at once, whole storage chunks are grouped up to it")
 
     parser.add_argument("-species", metavar='species', type=str,
                         help="one species to convert")
@@ -533,7 +872,26 @@ if __name__ == "__main__":
     parser.add_argument("-grid_size", metavar='grid_size', type=str,
                         help="size of grid cell in SI")
 
+    parser.add_argument("-roi", metavar='roi', type=str,
+                        help="box xmin:xmax,ymin:ymax,zmin:zmax in SI, only particles inside it are converted; "
+                             "with particlePatches only overlapping patches are read")
+
+    parser.add_argument("-overview", metavar='overview', type=str,
+                        help="histograms of the last converted species, .npz or image (.png), "
+                             "filled while converting")
+
+    parser.add_argument("-shard", metavar='shard', type=str,
+                        help="k/N, convert only part k of N of rows of each species, join parts with gdf_merge.py")
+
+    parser.add_argument("-mpi", action='store_true',
+                        help="parallel conversion under mpirun, each rank converts its part of rows")
+
+    parser.add_argument("-mmap", action='store_true',
+                        help="memory map contiguous, unfiltered datasets of HDF5 series instead of reading them "
+                             "with openPMD-api, other datasets are read as usual")
+
     args = parser.parse_args()
 
-    hdf_to_gdf(args.openPMD_input, args.gdf, args.max_cell, args.species, args.grid_size)
+    hdf_to_gdf(args.openPMD_input, args.gdf, args.max_cell, args.species, args.grid_size, args.roi, args.overview,
+               args.shard, args.mpi, args.mmap)
 
@@ -0,0 +1,332 @@
+"""Weighted 1D and 2D histograms of particle quantities, accumulated chunk by chunk"""
+
+
+from __future__ import division
+import argparse
+import numpy as np
+
+
+class Histogram:
+    """ Histogram of one quantity or of a pair of quantities (phase space).
+    Memory depends on number of bins only. With a given range values out of range are not counted,
+    a quantity without range starts with the range of its first chunk and half a bin more, which is widened
+    by merging neighbouring bins whenever a later chunk is outside of it.
+    Weighted sums of values and of their squares are kept for mean and rms.
+        """
+
+    def __init__(self, names, bins, ranges):
+        self.names = list(names)
+        self.bins = [bins] * len(self.names)
+        self.ranges = [tuple(ranges[name]) if ranges.get(name) != None else None for name in self.names]
+        self.adaptive = [value_range is None for value_range in self.ranges]
+        self.counts = np.zeros(self.bins)
+        self.weight = 0.
+        self.sums = np.zeros(len(self.names))
+        self.squares = np.zeros(len(self.names))
+
+    def extend_range(self, axis, values):
+        """ Widen range of axis to values, the width is multiplied by a power of two,
+        so each new bin is a sum of whole old bins """
+
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        low, high = values.min(), values.max()
+        if self.ranges[axis] is None:
+            bins = self.bins[axis]
+            # values of the first chunk are not on edges, which become inner edges later
+            if low == high:
+                bin_width = (abs(low) if low != 0 else 1.) / bins
+                low = low - (bins // 2 + 0.5) * bin_width
+                self.ranges[axis] = (low, low + bins * bin_width)
+            else:
+                half = 0.5 * (high - low) / bins
+                self.ranges[axis] = (low - half, high + half)
+            return
+
+        range_low, range_high = self.ranges[axis]
+        if low >= range_low and high <= range_high:
+            return
+        width = range_high - range_low
+        factor = 1
+        while True:
+            factor *= 2
+            shift = min(max(0, int(np.ceil((range_low - low) / width))), factor - 1)
+            if range_low - shift * width <= low and range_low + (factor - shift) * width >= high:
+                break
+
+        bins = self.bins[axis]
+        index = [slice(None)] * self.counts.ndim
+        index[axis] = (shift * bins + np.arange(bins)) // factor
+        counts = np.zeros_like(self.counts)
+        np.add.at(counts, tuple(index), self.counts)
+        self.counts = counts
+        self.ranges[axis] = (range_low - shift * width, range_low + (factor - shift) * width)
+
+    def get_bin_indexes(self, values, bins, value_range):
+        """ Bin of each value, -1 for values out of range, maximum belongs to the last bin """
+
+        low, high = value_range
+        indexes = np.floor((values - low) * (bins / (high - low))).clip(0, bins - 1)
+        indexes[~((values >= low) & (values <= high))] = -1
+        return indexes.astype(np.int64)
+
+    def add(self, columns, weights):
+        """ columns - dict name -> values of chunk, weights - weights of chunk """
+
+        values = [np.asarray(columns[name], dtype=np.float64) for name in self.names]
+        for axis, column in enumerate(values):
+            if self.adaptive[axis]:
+                self.extend_range(axis, column)
+        inside = np.ones(len(weights), dtype=bool)
+        indexes = []
+        for column, bins, value_range in zip(values, self.bins, self.ranges):
+            column_indexes = self.get_bin_indexes(column, bins, value_range)
+            inside &= column_indexes >= 0
+            indexes.append(column_indexes)
+
+        flat_indexes = np.ravel_multi_index([column_indexes[inside] for column_indexes in indexes], self.bins)
+        self.counts += np.bincount(flat_indexes, weights[inside], minlength=self.counts.size).reshape(self.bins)
+        self.weight += weights[inside].sum()
+        for i, column in enumerate(values):
+            self.sums[i] += np.dot(column[inside], weights[inside])
+            self.squares[i] += np.dot(column[inside] ** 2, weights[inside])
+
+    def get_edges(self):
+        ranges = [value_range if value_range != None else (0., 1.) for value_range in self.ranges]
+        return [np.linspace(low, high, bins + 1) for (low, high), bins in zip(ranges, self.bins)]
+
+    def get_mean(self):
+        return self.sums / self.weight
+
+    def get_rms(self):
+        return np.sqrt(np.maximum(self.squares / self.weight - self.get_mean() ** 2, 0.))
+
+
+class Histograms:
+    """ Set of 1D histograms of quantities and 2D histograms of pairs of quantities.
+    Ranges, which are not given, are found by a pre-pass over the same chunks with update_ranges,
+    without pre-pass they are widened while chunks are added.
+        """
+
+    def __init__(self, names, pairs=(), bins=100, ranges=None):
+        self.names = list(names)
+        self.pairs = [tuple(pair) for pair in pairs]
+        self.bins = bins
+        self.ranges = dict(ranges) if ranges != None else {}
+        self.found_ranges = {}
+        self.histograms = None
+
+    def get_quantities(self):
+        quantities = list(self.names)
+        for pair in self.pairs:
+            quantities.extend(name for name in pair if name not in quantities)
+        return quantities
+
+    def get_missing_ranges(self):
+        return [name for name in self.get_quantities() if name not in self.ranges]
+
+    def select(self, available_names):
+        """ Keep only histograms of quantities in available_names """
+
+        self.names = [name for name in self.names if name in available_names]
+        self.pairs = [pair for pair in self.pairs if all(name in available_names for name in pair)]
+
+    def reset(self):
+        """ Remove counts and found ranges, e.g. for the next output step """
+
+        self.found_ranges = {}
+        self.histograms = None
+
+    def update_ranges(self, columns):
+        """ Pre-pass: minimum and maximum of quantities without given range """
+
+        for name in self.get_missing_ranges():
+            values = np.asarray(columns[name])
+            values = values[np.isfinite(values)]
+            if len(values) == 0:
+                continue
+            low, high = values.min(), values.max()
+            if name in self.found_ranges:
+                low = min(low, self.found_ranges[name][0])
+                high = max(high, self.found_ranges[name][1])
+            self.found_ranges[name] = (low, high)
+
+    def create_histograms(self):
+        """ Histograms with given ranges or ranges of the pre-pass, other ranges are widened while adding """
+
+        ranges = dict(self.ranges)
+        for name in self.get_missing_ranges():
+            if name not in self.found_ranges:
+                continue
+            low, high = self.found_ranges[name]
+            if low == high:
+                low, high = low - 0.5, high + 0.5
+            ranges[name] = (low, high)
+        self.histograms = [Histogram([name], self.bins, ranges) for name in self.names]
+        self.histograms.extend(Histogram(pair, self.bins, ranges) for pair in self.pairs)
+
+    def add(self, columns, weights=None):
+        """ Add chunk, columns - dict name -> values, by default each particle has weight 1 """
+
+        if self.histograms is None:
+            self.create_histograms()
+        if weights is None:
+            weights = np.ones(len(columns[self.get_quantities()[0]]))
+        weights = np.asarray(weights, dtype=np.float64)
+        for histogram in self.histograms:
+            histogram.add(columns, weights)
+
+    def save(self, output_directory):
+        """ Write histograms as .npz file or draw them to an image file (.png, .pdf, ...) """
+
+        if self.histograms is None:
+            self.create_histograms()
+        if output_directory.endswith('.npz'):
+            save_histograms_npz(self, output_directory)
+        else:
+            plot_histograms(self, output_directory)
+
+
+def get_histogram_key(histogram):
+    return '_'.join(histogram.names)
+
+
+def save_histograms_npz(histograms, output_directory):
+    """ counts and edges of each histogram, e.g. z_counts, z_edges, z_G_counts, z_G_edges_0, z_G_edges_1 """
+
+    arrays = {}
+    for histogram in histograms.histograms:
+        key = get_histogram_key(histogram)
+        arrays[key + '_counts'] = histogram.counts
+        edges = histogram.get_edges()
+        if len(edges) == 1:
+            arrays[key + '_edges'] = edges[0]
+        else:
+            for i, axis_edges in enumerate(edges):
+                arrays[key + '_edges_' + str(i)] = axis_edges
+    np.savez(output_directory, **arrays)
+
+
+def plot_histograms(histograms, output_directory, columns_number=3):
+    """ Overview figure, one panel for each histogram """
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    number = len(histograms.histograms)
+    rows_number = (number + columns_number - 1) // columns_number
+    figure = plt.figure(figsize=(10, 10 * rows_number / columns_number))
+    for i, histogram in enumerate(histograms.histograms):
+        axes = figure.add_subplot(rows_number, columns_number, i + 1)
+        edges = histogram.get_edges()
+        if len(edges) == 1:
+            centers = 0.5 * (edges[0][1:] + edges[0][:-1])
+            axes.hist(centers, bins=edges[0], weights=histogram.counts, alpha=0.8)
+            axes.set_ylabel('#')
+            axes.text(histogram.get_mean()[0], 0, 'RMS {:.1e}'.format(histogram.get_rms()[0]),
+                      horizontalalignment='center')
+            axes.set_title(histogram.names[0])
+        else:
+            axes.pcolormesh(edges[0], edges[1], histogram.counts.T)
+            axes.set_xlabel(histogram.names[0])
+            axes.set_ylabel(histogram.names[1])
+    figure.savefig(output_directory)
+    plt.close(figure)
+
+
+def fill_step_histograms(gdf_buffer, step, histograms, chunk_size):
+    """ Pre-pass for missing ranges and filling of histograms over arrays of one step """
+
+    from gdf_to_openPMD import get_gdf_array
+
+    histograms.select(step.arrays)
+    columns = {name: get_gdf_array(gdf_buffer, step.arrays[name]) for name in histograms.get_quantities()}
+    weights = None
+    if 'nmacro' in step.arrays:
+        weights = get_gdf_array(gdf_buffer, step.arrays['nmacro'])
+
+    size = step.get_size()
+    if len(histograms.get_missing_ranges()) != 0:
+        for idx_start in range(0, size, chunk_size):
+            histograms.update_ranges({name: values[idx_start:idx_start + chunk_size]
+                                      for name, values in columns.items()})
+    for idx_start in range(0, size, chunk_size):
+        chunk_weights = None if weights is None else weights[idx_start:idx_start + chunk_size]
+        histograms.add({name: values[idx_start:idx_start + chunk_size] for name, values in columns.items()},
+                       chunk_weights)
+
+
+def gdf_histograms(gdf_file_directory, histograms, step_number=None, chunk_size=1000000):
+    """ Fill histograms from one output step of gdf file, weighted by nmacro if it is present
+        Args:
+         gdf_file_directory - path to GDF file
+         histograms - Histograms, only quantities present in the step are used
+         step_number - number of output step, by default the last step with particles
+         chunk_size - number of particles read at once
+        """
+
+    from gdf_to_openPMD import get_gdf_block_index, open_gdf_buffer
+
+    with open(gdf_file_directory, 'rb') as gdf_file:
+        steps = [step for step in get_gdf_block_index(gdf_file) if len(step.arrays) != 0]
+        gdf_buffer = open_gdf_buffer(gdf_file)
+        step = steps[-1] if step_number == None else steps[step_number]
+        fill_step_histograms(gdf_buffer, step, histograms, chunk_size)
+        gdf_buffer.close()
+    return histograms
+
+
+def parse_pairs(pairs):
+    """ Parse pairs 'z:Bz' to tuples """
+
+    if pairs == None:
+        return []
+    return [tuple(pair.split(':')) for pair in pairs]
+
+
+def get_overview_histograms(bins=100):
+    """ Histograms of coordinates and momentums and their phase spaces """
+
+    return Histograms(['x', 'y', 'z', 'Bx', 'By', 'Bz', 'G'], [('x', 'Bx'), ('y', 'By'), ('z', 'Bz')], bins)
+
+
+def gdf_overview(gdf_file_directory, output_directory, step_number=None, bins=100):
+    """ Histograms of coordinates and momentums and their phase spaces of a GDF file """
+
+    histograms = get_overview_histograms(bins)
+    gdf_histograms(gdf_file_directory, histograms, step_number)
+    histograms.save(output_directory)
+
+
+if __name__ == "__main__":
+
+    """ Parse arguments from command line """
+
+    parser = argparse.ArgumentParser(description="histograms of particles of gdf file")
+
+    parser.add_argument("-gdf", metavar='gdf_file', type=str,
+                        help="input gdf file")
+
+    parser.add_argument("-output", metavar='output', type=str,
+                        help="result file, .npz or image (.png)")
+
+    parser.add_argument("-quantities", metavar='quantities', type=str, nargs='*',
+                        default=['x', 'y', 'z', 'Bx', 'By', 'Bz', 'G'],
+                        help="names of GDF arrays for 1D histograms")
+
+    parser.add_argument("-pairs", metavar='pairs', type=str, nargs='*',
+                        help="pairs of GDF arrays for 2D histograms as x:Bx")
+
+    parser.add_argument("-bins", metavar='bins', type=int, default=100,
+                        help="number of bins on each axis")
+
+    parser.add_argument("-step", metavar='step', type=int,
+                        help="number of output step, by default the last one")
+
+    args = parser.parse_args()
+
+    histograms = Histograms(args.quantities, parse_pairs(args.pairs), args.bins)
+    gdf_histograms(args.gdf, histograms, args.step)
+    histograms.save(args.output)
@@ -0,0 +1,205 @@
+"""Small synthetic inputs shared by the tests"""
+
+import os
+import struct
+import sys
+import h5py
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hdf-to-txt'))
+
+from gdf_writer import add_gdf_id, write_string, add_versions, write_first_block, write_float, Gdf_arrays_writer
+
+
+def write_gdf_file(file_directory, steps):
+    """ GDF file with a time block and arrays of doubles for each step,
+    steps - list of (time, {name: values}) """
+
+    with open(file_directory, 'wb') as gdf_file:
+        add_gdf_id(gdf_file)
+        gdf_file.write(struct.pack('i', 0))
+        write_string('test', gdf_file)
+        write_string('empty', gdf_file)
+        add_versions('gdf_version', gdf_file, None, 1, 1)
+        add_versions('softwareVersion', gdf_file, None, 3, 0)
+        add_versions('destination_version', gdf_file, None)
+        write_first_block(gdf_file)
+        for time, arrays in steps:
+            write_float('time', gdf_file, time)
+            writer = Gdf_arrays_writer(gdf_file, list(arrays), len(next(iter(arrays.values()))))
+            writer.write(list(arrays.values()))
+
+
+def write_particles_h5(file_directory, size=1500, iterations=(100,), species=('e',), chunks=None, seed=1):
+    """ PIConGPU-like openPMD file written by h5py: position in cells in [0, 1), positionOffset in cells,
+    momentum, weighting, particleId and constant charge and mass """
+
+    random = np.random.default_rng(seed)
+    with h5py.File(file_directory, 'w') as hdf_file:
+        for name, value in [('openPMD', '1.1.0'), ('basePath', '/data/%T/'), ('particlesPath', 'particles/'),
+                            ('meshesPath', 'fields/'), ('iterationEncoding', 'groupBased'),
+                            ('iterationFormat', '/data/%T/'), ('software', 'test'),
+                            ('date', '2018-02-06 09:36:49 -0800')]:
+            hdf_file.attrs[name] = np.bytes_(value)
+        hdf_file.attrs['openPMDextension'] = np.uint32(0)
+        for iteration in iterations:
+            iteration_group = hdf_file.create_group('data/{}'.format(iteration))
+            for name in ['time', 'dt', 'timeUnitSI']:
+                iteration_group.attrs[name] = 1.
+            for species_name in species:
+                species_group = iteration_group.create_group('particles/' + species_name)
+                species_group.attrs['particleShape'] = np.float32(2.)
+                for record_name in ['position', 'positionOffset', 'momentum']:
+                    record = species_group.create_group(record_name)
+                    record.attrs['unitDimension'] = np.zeros(7)
+                    record.attrs['timeOffset'] = np.float32(0.)
+                    for axis in 'xyz':
+                        if record_name == 'position':
+                            values = random.uniform(0., 1., size)
+                        elif record_name == 'positionOffset':
+                            values = random.integers(0, 64, size).astype(np.int32)
+                        else:
+                            values = random.normal(0., 1., size).astype(np.float32)
+                        dataset = record.create_dataset(axis, data=values, chunks=chunks)
+                        dataset.attrs['unitSI'] = 2.5 if record_name == 'momentum' else 1e-6
+                for name, values in [('weighting', random.uniform(1., 2., size).astype(np.float32)),
+                                     ('particleId', random.permutation(size).astype(np.uint64))]:
+                    dataset = species_group.create_dataset(name, data=values, chunks=chunks)
+                    dataset.attrs['unitSI'] = 1.
+                    dataset.attrs['unitDimension'] = np.zeros(7)
+                    dataset.attrs['timeOffset'] = np.float32(0.)
+                for name in ['charge', 'mass']:
+                    record = species_group.create_group(name)
+                    record.attrs['value'] = 1.6e-19
+                    record.attrs['shape'] = np.array([size], dtype=np.uint64)
+                    record.attrs['unitSI'] = 1.
+                    record.attrs['unitDimension'] = np.zeros(7)
+                    record.attrs['timeOffset'] = np.float32(0.)
+
+
+def read_last_step(file_directory):
+    """ Arrays of the last step of gdf file """
+
+    from gdf_to_openPMD import get_gdf_block_index, open_gdf_buffer, get_gdf_array
+
+    with open(file_directory, 'rb') as gdf_file:
+        step = get_gdf_block_index(gdf_file)[-1]
+        gdf_buffer = open_gdf_buffer(gdf_file)
+        arrays = {name: np.array(get_gdf_array(gdf_buffer, block)) for name, block in step.arrays.items()}
+        gdf_buffer.close()
+    return arrays
+
+
+def read_without_time(file_directory):
+    """ Bytes of gdf file without the creation time of the header """
+
+    with open(file_directory, 'rb') as gdf_file:
+        content = gdf_file.read()
+    return content[:4] + content[8:]
+
+
+def read_datasets(file_directory):
+    """ Values, dtypes and attributes of all datasets of file """
+
+    datasets = {}
+
+    def read(name, node):
+        if isinstance(node, h5py.Dataset):
+            datasets[name] = (node[()], node.dtype, dict(node.attrs))
+
+    with h5py.File(file_directory, 'r') as hdf_file:
+        hdf_file.visititems(read)
+    return datasets
+
+
+def assert_same_datasets(file_directory, other_file_directory):
+    datasets = read_datasets(file_directory)
+    other_datasets = read_datasets(other_file_directory)
+    assert sorted(datasets) == sorted(other_datasets)
+    for name, (values, dtype, attributes) in datasets.items():
+        other_values, other_dtype, other_attributes = other_datasets[name]
+        np.testing.assert_array_equal(values, other_values, err_msg=name)
+        assert dtype == other_dtype
+        assert str(attributes) == str(other_attributes)
+
+
+def write_patched_series(file_directory, size=4000, patches_numbers=(4, 1, 2), seed=2):
+    """ openPMD series written by openPMD-api, particles are sorted by patches of a grid of
+    64 x 32 x 16 cells of 1 um and particlePatches are given """
+
+    import openpmd_api
+
+    random = np.random.default_rng(seed)
+    series = openpmd_api.Series(file_directory, openpmd_api.Access.create)
+    iteration = series.iterations[100]
+    iteration.set_time(1.)
+    cell_size = 1e-6
+    grid = np.array([64, 32, 16])
+    patch_size = grid // np.array(patches_numbers)
+    particle_species = iteration.particles['e']
+    particle_species.set_attribute('particleShape', 2.)
+
+    position = [random.uniform(0., 1., size) for axis in range(3)]
+    offset = [random.integers(0, grid[axis], size).astype(np.int32) for axis in range(3)]
+    patch_ids = np.ravel_multi_index([offset[axis] // patch_size[axis] for axis in range(3)], patches_numbers)
+    order = np.argsort(patch_ids, kind='stable')
+    position = [values[order] for values in position]
+    offset = [values[order] for values in offset]
+    patch_ids = patch_ids[order]
+    momentum = [random.normal(0., 1., size) for axis in range(3)]
+    weighting = random.uniform(1., 2., size)
+
+    SCALAR = openpmd_api.Record_Component.SCALAR
+    for axis, axis_name in enumerate('xyz'):
+        for record_name, values, unit_si in [('position', position[axis], cell_size),
+                                             ('positionOffset', offset[axis], cell_size),
+                                             ('momentum', momentum[axis], 2.5)]:
+            component = particle_species[record_name][axis_name]
+            component.reset_dataset(openpmd_api.Dataset(values.dtype, values.shape))
+            component.set_unit_SI(unit_si)
+            component.store_chunk(values)
+    component = particle_species['weighting'][SCALAR]
+    component.reset_dataset(openpmd_api.Dataset(weighting.dtype, weighting.shape))
+    component.store_chunk(weighting)
+    for name in ['charge', 'mass']:
+        component = particle_species[name][SCALAR]
+        component.reset_dataset(openpmd_api.Dataset(np.dtype('f8'), [size]))
+        component.make_constant(1.6e-19)
+
+    number_patches = int(np.prod(patches_numbers))
+    numbers = np.bincount(patch_ids, minlength=number_patches).astype(np.uint64)
+    offsets = (np.cumsum(numbers) - numbers).astype(np.uint64)
+    patches = particle_species.particle_patches
+    PATCH_SCALAR = openpmd_api.Patch_Record_Component.SCALAR
+    for name, values in [('numParticles', numbers), ('numParticlesOffset', offsets)]:
+        component = patches[name][PATCH_SCALAR]
+        component.reset_dataset(openpmd_api.Dataset(values.dtype, values.shape))
+        for idx, value in enumerate(values):
+            component.store(idx, value)
+    cells = np.array(np.unravel_index(np.arange(number_patches), patches_numbers)) * patch_size[:, np.newaxis]
+    for axis, axis_name in enumerate('xyz'):
+        for name, values in [('offset', cells[axis].astype(np.uint64)),
+                             ('extent', np.full(number_patches, patch_size[axis], dtype=np.uint64))]:
+            component = patches[name][axis_name]
+            component.reset_dataset(openpmd_api.Dataset(values.dtype, values.shape))
+            component.set_unit_SI(cell_size)
+            for idx, value in enumerate(values):
+                component.store(idx, value)
+    series.flush()
+    series.close()
+
+
+@pytest.fixture
+def particles_h5(tmp_path):
+    file_directory = str(tmp_path / 'particles.h5')
+    write_particles_h5(file_directory)
+    return file_directory
+
+
+@pytest.fixture
+def patched_series(tmp_path):
+    file_directory = str(tmp_path / 'patched.h5')
+    write_patched_series(file_directory)
+    return file_directory
@@ -0,0 +1,49 @@
+import json
+import pytest
+
+from gdf_to_openPMD import load_attribute_mapping, find_attribute, Attribute_names
+
+
+def write_mapping(file_directory, mapping):
+    with open(file_directory, 'w') as mapping_file:
+        json.dump(mapping, mapping_file)
+    return file_directory
+
+
+@pytest.fixture(autouse=True)
+def remove_mapping():
+    yield
+    load_attribute_mapping(None)
+
+
+def test_names_and_prefixes_of_user(tmp_path):
+    load_attribute_mapping(write_mapping(str(tmp_path / 'mapping.json'), {
+        'Ex1': ['E', 'x'], 'x': ['laser', 'x'], 'wq*': ['charge', 'SCALAR'],
+        'w*': ['weight', 'w'], 'fB*': ['user_B', 'b']}))
+
+    assert find_attribute('Ex1') == ['E', 'x']
+    assert find_attribute('x') == ['laser', 'x']
+    assert find_attribute('wq1') == ['charge', Attribute_names.SCALAR]
+    assert find_attribute('wq') == ['charge', Attribute_names.SCALAR]
+    assert find_attribute('w2') == ['weight', 'w']
+    assert find_attribute('Bx') == ['momentum', 'x']
+    # names known without mapping are matched before prefixes of user
+    assert find_attribute('fBx') == ['B', 'x']
+    assert find_attribute('fBr') == ['user_B', 'b']
+    assert find_attribute('unknown') is None
+
+
+def test_mapping_of_previous_call_is_removed(tmp_path):
+    load_attribute_mapping(write_mapping(str(tmp_path / 'first.json'), {'u*': ['first', 'u'], 'x': ['laser', 'x']}))
+    assert find_attribute('u1') == ['first', 'u']
+    assert find_attribute('x') == ['laser', 'x']
+
+    load_attribute_mapping(write_mapping(str(tmp_path / 'second.json'), {'uv*': ['second', 'u']}))
+    assert find_attribute('uv1') == ['second', 'u']
+    assert find_attribute('u1') is None
+    assert find_attribute('x') == ['position', 'x']
+    assert len(Attribute_names.user_prefixes) == 1
+
+    load_attribute_mapping(None)
+    assert find_attribute('uv1') is None
+    assert Attribute_names.user_names == {} and Attribute_names.user_prefixes == []
@@ -0,0 +1,107 @@
+import os
+import h5py
+import numpy as np
+import pytest
+
+from get_fields_and_particles import FieldView, load_field_downsampled
+
+
+def write_fields(file_directory, seed=0):
+    """ Field E with components of shape (12, 10, 9) and scalar density n """
+
+    random = np.random.default_rng(seed)
+    with h5py.File(file_directory, 'w') as hdf_file:
+        fields = hdf_file.create_group('data/100/fields')
+        mesh = fields.create_group('E')
+        for label in 'xyz':
+            mesh.create_dataset(label, data=random.normal(size=(12, 10, 9)).astype(np.float32))
+            mesh[label].attrs['unitSI'] = 2.
+        density = fields.create_dataset('n', data=random.uniform(size=(12, 10, 9)))
+        density.attrs['unitSI'] = 3.
+        for group in [mesh, density]:
+            group.attrs['gridGlobalOffset'] = np.array([1., 2., 3.])
+            group.attrs['gridSpacing'] = np.array([0.5, 0.25, 1.])
+            group.attrs['gridUnitSI'] = 1e-6
+
+
+def get_expected(values, slices, factors, unit_si):
+    """ Averages of complete blocks of selected cells and centers of blocks in SI """
+
+    selected = values[tuple(slices)].astype(np.float64)
+    counts = [size // factor for size, factor in zip(selected.shape, factors)]
+    selected = selected[tuple(slice(0, count * factor) for count, factor in zip(counts, factors))]
+    shape = []
+    for count, factor in zip(counts, factors):
+        shape.extend([count, factor])
+    field = selected.reshape(shape).mean(axis=(1, 3, 5)) * unit_si
+    axes = []
+    for s, size, count, factor, offset, spacing in zip(slices, values.shape, counts, factors,
+                                                        [1., 2., 3.], [0.5, 0.25, 1.]):
+        cells = np.arange(size)[s][:count * factor].reshape(count, factor).mean(axis=1)
+        axes.append((offset + cells * spacing) * 1e-6)
+    return field, axes
+
+
+@pytest.mark.parametrize('slices, factors', [
+    ([slice(None)] * 3, [1, 1, 1]),
+    ([slice(1, 12, 2), slice(None), slice(0, 9, 3)], [2, 3, 1]),
+    ([slice(None), slice(2, 9), slice(None, None, 2)], [5, 2, 2]),
+    ([slice(3, 4), slice(None), slice(None)], [2, 1, 1])])
+@pytest.mark.parametrize('slab_bytes', [1, 2**26])
+def test_averaged_field_equals_numpy(tmp_path, slices, factors, slab_bytes):
+    file_directory = str(tmp_path / 'fields.h5')
+    write_fields(file_directory)
+    with h5py.File(file_directory, 'r') as hdf_file:
+        values = hdf_file['data/100/fields/E/y'][()]
+        result = FieldView(hdf_file, 100, slab_bytes=slab_bytes).load('E', 'y', slices, factors)
+
+    field, axes = get_expected(values, slices, factors, 2.)
+    assert result[0].shape == field.shape
+    np.testing.assert_allclose(result[0], field, rtol=1e-12)
+    for result_axis, axis in zip(result[1:], axes):
+        np.testing.assert_allclose(result_axis, axis, rtol=1e-12)
+
+
+def test_scalar_field_and_function(tmp_path):
+    file_directory = str(tmp_path / 'fields.h5')
+    write_fields(file_directory)
+    with h5py.File(file_directory, 'r') as hdf_file:
+        values = hdf_file['data/100/fields/n'][()]
+        result = load_field_downsampled('n', None, 100, hdf_file, x_slice=slice(None, None, 2), factors=(3, 2, 1))
+
+    field, axes = get_expected(values, [slice(None), slice(None), slice(None, None, 2)], [3, 2, 1], 3.)
+    np.testing.assert_allclose(result[0], field, rtol=1e-12)
+    np.testing.assert_allclose(result[3], axes[2], rtol=1e-12)
+
+
+def test_cache_is_reused_and_invalidated(tmp_path):
+    file_directory = str(tmp_path / 'fields.h5')
+    cache_directory = str(tmp_path / 'cache')
+    slices = [slice(None), slice(0, 10, 2), slice(None)]
+    write_fields(file_directory)
+    with h5py.File(file_directory, 'r') as hdf_file:
+        first = FieldView(hdf_file, 100, cache_directory).load('E', 'x', slices, [2, 1, 3])
+        assert len(os.listdir(cache_directory)) == 1
+
+        view = FieldView(hdf_file, 100, cache_directory)
+        view.read_averaged = None
+        cached = view.load('E', 'x', slices, [2, 1, 3])
+        for values, cached_values in zip(first, cached):
+            np.testing.assert_array_equal(cached_values, values)
+        FieldView(hdf_file, 100, cache_directory).load('E', 'x', slices, [2, 1, 1])
+        FieldView(hdf_file, 100, cache_directory).load('E', 'z', slices, [2, 1, 3])
+        assert len(os.listdir(cache_directory)) == 3
+
+    # same size and a new modification time: the file changed, the cached result is not used
+    modification_time = os.stat(file_directory).st_mtime_ns
+    write_fields(file_directory, seed=1)
+    os.utime(file_directory, ns=(modification_time + 10**9, modification_time + 10**9))
+    with h5py.File(file_directory, 'r') as hdf_file:
+        values = hdf_file['data/100/fields/E/x'][()]
+        changed = FieldView(hdf_file, 100, cache_directory).load('E', 'x', slices, [2, 1, 3])
+
+    field, axes = get_expected(values, slices, [2, 1, 3], 2.)
+    np.testing.assert_allclose(changed[0], field, rtol=1e-12)
+    assert not np.allclose(changed[0], first[0])
+    assert len(os.listdir(cache_directory)) == 4
+    assert all(name.endswith('.npz') and '.tmp.' not in name for name in os.listdir(cache_directory))
@@ -0,0 +1,91 @@
+import os
+import subprocess
+import sys
+import h5py
+import numpy as np
+import pytest
+
+from conftest import write_particles_h5, read_datasets
+from filter_particle_ids import filter_particle_ids, find_particles, Id_filter
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hdf-to-txt', 'filter-particle-ids-of-h5.py')
+
+
+def write_species(file_directory, species='e'):
+    """ Particles in two iterations, the first with compressed particleId and particlePatches """
+
+    write_particles_h5(file_directory, size=300, iterations=(100, 200), species=(species,))
+    with h5py.File(file_directory, 'r+') as hdf_file:
+        group = hdf_file['data/100/particles/{}'.format(species)]
+        ids = group['particleId'][()]
+        del group['particleId']
+        group.create_dataset('particleId', data=ids, chunks=(64,), compression='gzip')
+        group['particleId'].attrs['unitSI'] = 1.
+        group.create_group('particlePatches').create_dataset('numParticles', data=np.array([300], dtype=np.uint64))
+
+
+@pytest.mark.parametrize('stepsize', [7, 64, 2**20])
+def test_selected_rows_are_streamed(tmp_path, stepsize):
+    file_directory = str(tmp_path / 'particles.h5')
+    filtered_directory = str(tmp_path / 'filtered.h5')
+    write_species(file_directory)
+    with h5py.File(file_directory, 'r') as hdf_file:
+        all_ids = hdf_file['data/100/particles/e/particleId'][()]
+    ids = [all_ids[250], all_ids[3], all_ids[3], all_ids[100]]
+
+    assert filter_particle_ids(file_directory, filtered_directory, 100, ids, species='e', stepsize=stepsize) == 3
+
+    datasets = read_datasets(file_directory)
+    filtered = read_datasets(filtered_directory)
+    assert sorted(filtered) == sorted(name for name in datasets if 'particlePatches' not in name)
+    for name, (values, dtype, attributes) in filtered.items():
+        original_values, original_dtype, original_attributes = datasets[name]
+        assert dtype == original_dtype and str(attributes) == str(original_attributes)
+        if name.startswith('data/100/particles/e/'):
+            np.testing.assert_array_equal(values, original_values[[3, 100, 250]], err_msg=name)
+        else:
+            np.testing.assert_array_equal(values, original_values, err_msg=name)
+    with h5py.File(filtered_directory, 'r') as hdf_file:
+        species = hdf_file['data/100/particles/e']
+        assert species['particleId'].compression == 'gzip'
+        assert list(species['charge'].attrs['shape']) == [3]
+        assert list(hdf_file['data/200/particles/e/charge'].attrs['shape']) == [300]
+        assert species.attrs['particleShape'] == 2.
+        assert hdf_file.attrs['openPMD'] == b'1.1.0'
+
+
+def test_missing_ids_raise_and_write_nothing(tmp_path):
+    file_directory = str(tmp_path / 'particles.h5')
+    filtered_directory = str(tmp_path / 'filtered.h5')
+    write_species(file_directory)
+
+    with pytest.raises(ValueError, match='2 of 3 requested IDs'):
+        filter_particle_ids(file_directory, filtered_directory, 100, [0, 1000, 1001], species='e')
+    assert not os.path.exists(filtered_directory)
+
+
+def test_find_particles_in_blocks():
+    id_dataset = np.array([5, 9, 2, 7, 2], dtype=np.uint64)
+
+    assert list(find_particles(id_dataset, [2, 7], stepsize=2)) == [False, False, True, True, True]
+    assert list(Id_filter([])(id_dataset)) == [False] * 5
+    with pytest.raises(ValueError):
+        find_particles(id_dataset, [10], stepsize=2)
+
+
+def test_script_exits_with_message_for_missing_ids(tmp_path):
+    write_species(str(tmp_path / 'simData_100.h5'), species='en_all')
+    np.savetxt(str(tmp_path / 'bunch-identifiers.dat'), [0, 100000], fmt='%d')
+
+    result = subprocess.run([sys.executable, SCRIPT, '100'], cwd=str(tmp_path), capture_output=True, text=True)
+
+    assert result.returncode == 1
+    assert '1 of 2 requested IDs are not contained in particleId' in result.stderr
+    assert not os.path.exists(str(tmp_path / 'simData_filtered_100.h5'))
+
+    np.savetxt(str(tmp_path / 'bunch-identifiers.dat'), [0, 1], fmt='%d')
+    result = subprocess.run([sys.executable, SCRIPT, '100'], cwd=str(tmp_path), capture_output=True, text=True)
+
+    assert result.returncode == 0
+    with h5py.File(str(tmp_path / 'simData_filtered_100.h5'), 'r') as hdf_file:
+        assert sorted(hdf_file['data/100/particles/en_all/particleId'][()]) == [0, 1]
@@ -0,0 +1,68 @@
+import os
+import struct
+import numpy as np
+import pytest
+
+import gdf_to_openPMD
+from conftest import write_gdf_file
+from gdf_to_openPMD import read_gdf_blocks, get_gdf_block_index, find_attribute, Constants
+
+
+def read_blocks_one_by_one(file_directory):
+    """ Names, types, sizes and data offsets of blocks, each header is read from the file """
+
+    blocks = []
+    with open(file_directory, 'rb') as gdf_file:
+        gdf_file.seek(Constants.GDFHEADERSIZE)
+        while True:
+            header = gdf_file.read(Constants.GDFBLOCKHEADERSIZE)
+            if len(header) < Constants.GDFBLOCKHEADERSIZE:
+                break
+            raw_name, primitive_type, size = Constants.BLOCKHEADER.unpack(header)
+            name = raw_name.split(b'\x00')[0].decode('ascii')
+            blocks.append((name, primitive_type, size, gdf_file.tell()))
+            gdf_file.seek(size, 1)
+    return blocks
+
+
+def test_names_end_at_first_nul(tmp_path):
+    file_directory = str(tmp_path / 'names.gdf')
+    write_gdf_file(file_directory, [(0., {'x': np.arange(3.)})])
+    with open(file_directory, 'ab') as gdf_file:
+        for raw_name in [b'Bx\x00\xff\x01garbage', b'nmacro\x00\x00x\x00yz']:
+            gdf_file.write(struct.pack('16sii', raw_name, 2051, 16))
+            gdf_file.write(np.arange(2.).tobytes())
+
+    with open(file_directory, 'rb') as gdf_file:
+        names = [block.name for block in read_gdf_blocks(gdf_file)]
+    assert names[-3:] == ['x', 'Bx', 'nmacro']
+
+
+def test_name_of_example_2_is_cut_at_nul():
+    """ example_2.gdf stores b'avgz\\x00rms', which was read as avgzrms before names were cut at NUL """
+
+    example_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', 'example_2.gdf')
+    with open(example_directory, 'rb') as gdf_file:
+        blocks = [block for block in read_gdf_blocks(gdf_file) if block.name.startswith('avgz')]
+
+    assert [(block.name, block.data_offset) for block in blocks] == [('avgz', 424)]
+    assert find_attribute('avgz') == ['avg', 'z']
+
+
+@pytest.mark.parametrize('buffer_size', [30, 100, 1 << 20])
+def test_headers_across_buffer_refills(tmp_path, monkeypatch, buffer_size):
+    monkeypatch.setattr(gdf_to_openPMD.Constants, 'GDFBUFFERSIZE', buffer_size)
+    random = np.random.default_rng(0)
+    sizes = random.integers(0, 20, 20)
+    steps = [(float(time), {name: random.random(size) for name in ['x', 'y', 'G']})
+             for time, size in enumerate(sizes)]
+    file_directory = str(tmp_path / 'steps.gdf')
+    write_gdf_file(file_directory, steps)
+
+    with open(file_directory, 'rb') as gdf_file:
+        blocks = [(block.name, block.primitive_type, block.size, block.data_offset)
+                  for block in read_gdf_blocks(gdf_file)]
+        index = get_gdf_block_index(gdf_file)
+    assert blocks == read_blocks_one_by_one(file_directory)
+    assert [step.values['time'] for step in index] == [time for time, arrays in steps]
+    assert [step.get_size() for step in index] == [len(arrays['x']) for time, arrays in steps]
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from conftest import write_gdf_file
+from gdf_stats import gdf_stats, save_stats, Weighted_moments, get_stats_names
+
+
+def get_beam(random, size):
+    """ Bunch far from origin with small spreads, velocities below speed of light """
+
+    arrays = {'x': random.normal(0., 1e-4, size), 'y': random.normal(0., 2e-4, size),
+              'z': random.normal(1e3, 1e-5, size)}
+    for axis in 'xyz':
+        arrays['B' + axis] = random.uniform(-0.5, 0.5, size)
+    arrays['z'] += 1e-5 * arrays['Bz']
+    return arrays
+
+
+def get_numpy_moments(arrays, weights):
+    gamma = 1. / np.sqrt(1. - arrays['Bx'] ** 2 - arrays['By'] ** 2 - arrays['Bz'] ** 2)
+    values = {'x': arrays['x'], 'y': arrays['y'], 'z': arrays['z'], 'G': gamma}
+    for axis in 'xyz':
+        values['GB' + axis] = gamma * arrays['B' + axis]
+    means = {name: np.average(column, weights=weights) for name, column in values.items()}
+    covariance = {}
+    for name, momentum in [('x', 'GBx'), ('y', 'GBy'), ('z', 'GBz'), ('G', 'G')]:
+        covariance[name, momentum] = np.cov(values[name], values[momentum], aweights=weights, bias=True)
+    return means, covariance
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 100, 1000000])
+def test_weighted_moments_equal_numpy(tmp_path, chunk_size):
+    random = np.random.default_rng(0)
+    weighted = get_beam(random, 300)
+    weighted['nmacro'] = random.uniform(1., 3., 300)
+    unweighted = get_beam(random, 50)
+    file_directory = str(tmp_path / 'beam.gdf')
+    write_gdf_file(file_directory, [(1e-9, weighted), (2e-9, unweighted)])
+
+    stats = gdf_stats(file_directory, chunk_size)
+
+    assert list(stats.dtype.names) == get_stats_names()
+    assert list(stats['time']) == [1e-9, 2e-9]
+    assert list(stats['num']) == [300, 50]
+    assert stats['nmacro'] == pytest.approx([weighted['nmacro'].sum(), 50.])
+    for row, (arrays, weights) in enumerate([(weighted, weighted['nmacro']), (unweighted, np.ones(50))]):
+        means, covariance = get_numpy_moments(arrays, weights)
+        for name, mean in means.items():
+            assert stats['avg' + name][row] == pytest.approx(mean, rel=1e-12, abs=1e-15), name
+        for (name, momentum), matrix in covariance.items():
+            assert stats['std' + name][row] == pytest.approx(np.sqrt(matrix[0, 0]), rel=1e-9), name
+            if name != 'G':
+                assert stats['cov' + name + momentum][row] == pytest.approx(matrix[0, 1], rel=1e-9)
+                emittance = np.sqrt(np.linalg.det(matrix))
+                assert stats['nemi' + name + 'rms'][row] == pytest.approx(emittance, rel=1e-6)
+        assert stats['spreadG'][row] == pytest.approx(stats['stdG'][row] / stats['avgG'][row])
+
+
+def test_chan_merge_keeps_small_spread_at_large_offset():
+    random = np.random.default_rng(1)
+    values = 1e8 + random.normal(0., 1e-3, (1, 10000))
+    weights = random.uniform(1., 2., 10000)
+    moments = Weighted_moments(1)
+    for idx_start in range(0, 10000, 333):
+        moments.add(values[:, idx_start:idx_start + 333], weights[idx_start:idx_start + 333])
+
+    deviation = values[0] - np.average(values[0], weights=weights)
+    assert moments.weight == pytest.approx(weights.sum())
+    assert moments.get_covariance()[0, 0] == pytest.approx(np.average(deviation ** 2, weights=weights), rel=1e-6)
+
+
+def test_steps_without_particles_and_empty_moments(tmp_path):
+    file_directory = str(tmp_path / 'steps.gdf')
+    write_gdf_file(file_directory, [(0., {'ID': np.arange(5.)}), (1., {'z': np.arange(4.)})])
+    stats = gdf_stats(file_directory)
+
+    assert len(stats) == 1
+    assert stats['avgz'][0] == pytest.approx(1.5)
+    assert np.isnan(stats['avgx'][0]) and np.isnan(stats['nemizrms'][0])
+    assert np.all(np.isnan(Weighted_moments(2).get_covariance()))
+
+
+def test_save_stats(tmp_path):
+    file_directory = str(tmp_path / 'beam.gdf')
+    write_gdf_file(file_directory, [(0., get_beam(np.random.default_rng(2), 20))])
+    stats = gdf_stats(file_directory)
+    save_stats(stats, str(tmp_path / 'stats.npy'))
+    save_stats(stats, str(tmp_path / 'stats.csv'))
+
+    assert np.load(str(tmp_path / 'stats.npy')).tobytes() == stats.tobytes()
+    table = np.genfromtxt(str(tmp_path / 'stats.csv'), delimiter=',', names=True)
+    assert table.dtype.names == stats.dtype.names
+    np.testing.assert_allclose(table['avgz'], stats['avgz'])
@@ -0,0 +1,88 @@
+import os
+import numpy as np
+import pytest
+
+from conftest import write_gdf_file
+from gdf_writer import write_float
+from gdf_subset import gdf_subset
+from gdf_to_openPMD import get_gdf_block_index, open_gdf_buffer, get_gdf_array
+
+
+def read_steps(file_directory):
+    """ Times and arrays of all steps of gdf file """
+
+    with open(file_directory, 'rb') as gdf_file:
+        steps = get_gdf_block_index(gdf_file)
+        gdf_buffer = open_gdf_buffer(gdf_file)
+        result = [(step.values['time'], {name: np.array(get_gdf_array(gdf_buffer, block))
+                                         for name, block in step.arrays.items()}) for step in steps]
+        gdf_buffer.close()
+    return result
+
+
+@pytest.fixture
+def gdf_steps(tmp_path):
+    random = np.random.default_rng(0)
+    steps = [(float(time), {name: random.random(50) for name in ['x', 'y', 'z', 'G']}) for time in range(3)]
+    file_directory = str(tmp_path / 'steps.gdf')
+    write_gdf_file(file_directory, steps)
+    return file_directory, steps
+
+
+def test_steps_columns_and_rows(tmp_path, gdf_steps):
+    file_directory, steps = gdf_steps
+    result_directory = str(tmp_path / 'subset.gdf')
+    gdf_subset(file_directory, result_directory, [2, 0], ['x', 'G'], slice(5, 40, 3))
+
+    result = read_steps(result_directory)
+    assert [time for time, arrays in result] == [0., 2.]
+    for (time, arrays), number in zip(result, [0, 2]):
+        assert list(arrays) == ['x', 'G']
+        for name, values in arrays.items():
+            np.testing.assert_array_equal(values, steps[number][1][name][5:40:3])
+
+
+@pytest.mark.parametrize('rows', [slice(None, None, -1), slice(45, 2, -4), slice(-10, None), slice(3, 3),
+                                  slice(0, 1000, 7)])
+@pytest.mark.parametrize('chunk_size', [1, 4, 1000])
+def test_rows_are_written_in_chunks(tmp_path, gdf_steps, rows, chunk_size):
+    file_directory, steps = gdf_steps
+    result_directory = str(tmp_path / 'subset.gdf')
+    gdf_subset(file_directory, result_directory, [1], rows=rows, chunk_size=chunk_size)
+
+    time, arrays = read_steps(result_directory)[0]
+    for name, values in arrays.items():
+        np.testing.assert_array_equal(values, steps[1][1][name][rows])
+
+
+def test_blocks_after_last_step_are_kept(tmp_path, gdf_steps):
+    file_directory, steps = gdf_steps
+    with open(file_directory, 'ab') as gdf_file:
+        trailing_start = gdf_file.tell()
+        write_float('end_time', gdf_file, 7.)
+    with open(file_directory, 'rb') as gdf_file:
+        trailing_blocks = gdf_file.read()[trailing_start:]
+    result_directory = str(tmp_path / 'subset.gdf')
+    gdf_subset(file_directory, result_directory, [0], ['x'])
+
+    with open(result_directory, 'rb') as result_file:
+        assert result_file.read().endswith(trailing_blocks)
+    assert [time for time, arrays in read_steps(result_directory)[:1]] == [0.]
+
+
+def test_whole_file_is_copied_unchanged(tmp_path, gdf_steps):
+    file_directory, steps = gdf_steps
+    result_directory = str(tmp_path / 'copy.gdf')
+    gdf_subset(file_directory, result_directory)
+
+    with open(file_directory, 'rb') as gdf_file, open(result_directory, 'rb') as result_file:
+        assert gdf_file.read() == result_file.read()
+
+
+@pytest.mark.parametrize('steps', [[3], [0, -1]])
+def test_missing_steps_raise_before_writing(tmp_path, gdf_steps, steps):
+    file_directory, gdf_file_steps = gdf_steps
+    result_directory = str(tmp_path / 'missing.gdf')
+    with pytest.raises(ValueError, match='3 output steps'):
+        gdf_subset(file_directory, result_directory, steps)
+    assert not os.path.exists(result_directory)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from conftest import write_gdf_file
+from gdf_trajectories import gdf_trajectories, Id_matcher
+
+
+def write_steps(file_directory):
+    """ Three steps with ID: particles are lost and reordered, the last step has no Bx,
+    the step without ID is skipped """
+
+    write_gdf_file(file_directory, [
+        (0., {'ID': np.array([1., 2., 3., 4., 5.]), 'x': np.array([10., 20., 30., 40., 50.]),
+              'Bx': np.array([.1, .2, .3, .4, .5])}),
+        (1., {'z': np.arange(3.)}),
+        (2., {'ID': np.array([5., 3., 1.]), 'x': np.array([51., 31., 11.]), 'Bx': np.array([.6, .7, .8])}),
+        (3., {'ID': np.array([2., 4., 2.]), 'x': np.array([21., 41., 22.])})])
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 1000])
+def test_trajectories_of_ids(tmp_path, chunk_size):
+    file_directory = str(tmp_path / 'steps.gdf')
+    write_steps(file_directory)
+    trajectories, ids, times = gdf_trajectories(file_directory, [4., 1., 9., 1.], ['x', 'Bx'], chunk_size)
+
+    assert list(ids) == [1., 4., 9.]
+    assert list(times) == [0., 2., 3.]
+    assert trajectories.shape == (3, 3, 2)
+    np.testing.assert_array_equal(trajectories[:, 0], [[10., .1], [11., .8], [np.nan, np.nan]])
+    np.testing.assert_array_equal(trajectories[:, 1], [[40., .4], [np.nan, np.nan], [41., np.nan]])
+    assert np.all(np.isnan(trajectories[:, 2]))
+
+
+def test_repeated_id_in_step_takes_one_of_its_rows(tmp_path):
+    file_directory = str(tmp_path / 'steps.gdf')
+    write_steps(file_directory)
+    trajectories, ids, times = gdf_trajectories(file_directory, [2.], ['x'])
+
+    assert trajectories[0, 0, 0] == 20.
+    assert np.isnan(trajectories[1, 0, 0])
+    assert trajectories[2, 0, 0] in [21., 22.]
+
+
+def test_trajectories_to_npy_file(tmp_path):
+    file_directory = str(tmp_path / 'steps.gdf')
+    output_directory = str(tmp_path / 'trajectories.npy')
+    write_steps(file_directory)
+    trajectories, ids, times = gdf_trajectories(file_directory, [3., 5.], output=output_directory)
+    trajectories.flush()
+
+    saved = np.load(output_directory)
+    assert saved.shape == (3, 2, 7)
+    np.testing.assert_array_equal(saved[:, :, 0], [[30., 50.], [31., 51.], [np.nan, np.nan]])
+    assert np.all(np.isnan(saved[:, :, 2]))
+
+
+def test_id_matcher_without_ids():
+    rows, particles = Id_matcher([])(np.array([1., 2.]))
+
+    assert len(rows) == 0 and len(particles) == 0
@@ -0,0 +1,142 @@
+import os
+import subprocess
+import sys
+import h5py
+import numpy as np
+import pytest
+import scipy.constants as const
+
+import hdf_to_gdf_pipeline
+from conftest import write_particles_h5, read_last_step
+from get_fields_and_particles import ParticleView
+from hdf_to_gdf_pipeline import hdf_to_gdf_pipeline as run_pipeline, random_reduction, Stage_times, labels
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hdf-to-txt', 'hdf-to-gdf.py')
+# the pipeline needs the directory of the converter in PYTHONPATH
+ENVIRONMENT = dict(os.environ, PYTHONPATH=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+BOX = [40e-6, 30e-6, 20e-6]
+
+
+@pytest.fixture
+def particles_file(tmp_path):
+    file_directory = str(tmp_path / 'particles.h5')
+    write_particles_h5(file_directory, size=1000, species=('en_all',))
+    return file_directory
+
+
+def get_expected_columns(file_directory, rows, weight_factor):
+    """ Columns for GPT of rows computed from whole datasets """
+
+    with h5py.File(file_directory, 'r') as hdf_file:
+        group = hdf_file['data/100/particles/en_all']
+        weighting = group['weighting'][()][rows].astype(np.float64)
+        position = {axis: (group['position/' + axis][()] + group['positionOffset/' + axis][()])[rows] * 1e-6
+                    for axis in 'xyz'}
+        momentum = {axis: group['momentum/' + axis][()][rows] * 2.5 / (const.m_e * const.c) / weighting
+                    for axis in 'xyz'}
+    gamma = np.sqrt(1. + momentum['x'] ** 2 + momentum['y'] ** 2 + momentum['z'] ** 2)
+    return {'x': position['x'] - BOX[0] * 0.5, 'y': position['z'] - BOX[2] * 0.5,
+            'z': position['y'] - position['y'].mean(),
+            'Bx': momentum['x'] / gamma, 'By': momentum['z'] / gamma, 'Bz': momentum['y'] / gamma,
+            'G': gamma, 'nmacro': weighting * weight_factor}
+
+
+@pytest.mark.parametrize('ratio', [0., 0.3, 0.999, 1.])
+@pytest.mark.parametrize('stepsize', [7, 2**20])
+def test_reduction_keeps_total_weighting(particles_file, ratio, stepsize):
+    particles_mask = np.random.default_rng(6).uniform(size=1000) < 0.6
+    selected = int(np.count_nonzero(particles_mask))
+    with h5py.File(particles_file, 'r') as hdf_file:
+        weighting = hdf_file['data/100/particles/en_all/weighting'][()].astype(np.float64)
+        particles = ParticleView(hdf_file, 100, species='en_all', cache_bytes=0, stepsize=stepsize)
+        reduced_mask, weight_factor = random_reduction(particles, particles_mask, ratio, seed=1)
+        same_mask, same_factor = random_reduction(particles, particles_mask, ratio, seed=1)
+
+    assert np.count_nonzero(reduced_mask) == selected - int(selected * ratio)
+    assert not np.any(reduced_mask & ~particles_mask)
+    np.testing.assert_array_equal(reduced_mask, same_mask)
+    assert weight_factor == same_factor
+    if reduced_mask.any():
+        # charge is weighting times the constant charge of the species
+        assert np.sum(weighting[reduced_mask]) * weight_factor == pytest.approx(np.sum(weighting[particles_mask]))
+    else:
+        assert weight_factor == 1.
+
+
+def test_stage_times_are_summed(monkeypatch, capsys):
+    clock = iter([0., 1.5, 2., 2.25, 10., 10.5, 20., 21.])
+    monkeypatch.setattr(hdf_to_gdf_pipeline.time, 'perf_counter', lambda: next(clock))
+    times = Stage_times()
+    with times('filter'):
+        pass
+    with times('write'):
+        pass
+    with times('filter'):
+        pass
+    with pytest.raises(ValueError):
+        with times('write'):
+            raise ValueError()
+
+    assert list(times.times.items()) == [('filter', 2.), ('write', 1.25)]
+    times.report()
+    assert capsys.readouterr().out == 'filter      2.000 s\nwrite       1.250 s\n'
+
+
+@pytest.mark.parametrize('stepsize', [64, 2**20])
+def test_pipeline_writes_columns_of_reduced_particles(tmp_path, particles_file, stepsize, capsys):
+    gdf_directory = str(tmp_path / 'reduced.gdf')
+    with h5py.File(particles_file, 'r') as hdf_file:
+        all_ids = hdf_file['data/100/particles/en_all/particleId'][()]
+    ids = all_ids[::2]
+
+    number = run_pipeline(particles_file, gdf_directory, 100, 'en_all', BOX, ids, 0.25, seed=3, stepsize=stepsize)
+
+    with h5py.File(particles_file, 'r') as hdf_file:
+        particles = ParticleView(hdf_file, 100, species='en_all', stepsize=stepsize)
+        particles_mask = np.zeros(1000, dtype=bool)
+        particles_mask[::2] = True
+        reduced_mask, weight_factor = random_reduction(particles, particles_mask, 0.25, seed=3)
+    assert number == 500 - 125 == np.count_nonzero(reduced_mask)
+    arrays = read_last_step(gdf_directory)
+    assert sorted(arrays) == sorted(labels)
+    expected = get_expected_columns(particles_file, np.flatnonzero(reduced_mask), weight_factor)
+    for name in labels:
+        np.testing.assert_allclose(arrays[name], expected[name], rtol=1e-6, atol=1e-18, err_msg=name)
+    with h5py.File(particles_file, 'r') as hdf_file:
+        weighting = hdf_file['data/100/particles/en_all/weighting'][()][::2]
+    assert arrays['nmacro'].sum() == pytest.approx(weighting.sum())
+    report = capsys.readouterr().out
+    assert [line.split()[0] for line in report.splitlines()] == ['filter', 'reduce', 'center', 'columns', 'write']
+
+
+def test_pipeline_without_ids_and_reduction(tmp_path, particles_file):
+    gdf_directory = str(tmp_path / 'all.gdf')
+
+    assert run_pipeline(particles_file, gdf_directory, 100, 'en_all', BOX) == 1000
+    arrays = read_last_step(gdf_directory)
+    expected = get_expected_columns(particles_file, np.arange(1000), 1.)
+    for name in labels:
+        np.testing.assert_allclose(arrays[name], expected[name], rtol=1e-6, atol=1e-18, err_msg=name)
+    with pytest.raises(ValueError):
+        run_pipeline(particles_file, gdf_directory, 100, 'en_all', BOX, [5000])
+
+
+def test_script_writes_gdf_file(tmp_path):
+    write_particles_h5(str(tmp_path / 'simData_100.h5'), size=1000, species=('en_all',))
+    np.savetxt(str(tmp_path / 'bunch-identifiers.dat'), np.arange(200), fmt='%d')
+
+    result = subprocess.run([sys.executable, SCRIPT, '100'], cwd=str(tmp_path), capture_output=True, text=True,
+                            env=ENVIRONMENT)
+
+    assert result.returncode == 0, result.stderr
+    arrays = read_last_step(str(tmp_path / 'reduced_data100ts-N100000.gdf'))
+    assert len(arrays['x']) == 200 - int(200 * 0.8985659250483333)
+    assert result.stdout.splitlines()[-1] == '{} particles written to reduced_data100ts-N100000.gdf'.format(
+        len(arrays['x']))
+
+    np.savetxt(str(tmp_path / 'bunch-identifiers.dat'), [5000], fmt='%d')
+    result = subprocess.run([sys.executable, SCRIPT, '100'], cwd=str(tmp_path), capture_output=True, text=True,
+                            env=ENVIRONMENT)
+
+    assert result.returncode == 1
+    assert 'requested IDs are not contained in particleId' in result.stderr
@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+
+from conftest import write_gdf_file, write_particles_h5, read_last_step
+from openPMD_to_gdf import hdf_to_gdf
+from particle_histograms import Histogram, Histograms, gdf_histograms, gdf_overview
+
+
+def add_chunks(histograms, columns, weights, chunk_size):
+    size = len(weights)
+    for idx_start in range(0, size, chunk_size):
+        histograms.add({name: values[idx_start:idx_start + chunk_size] for name, values in columns.items()},
+                       weights[idx_start:idx_start + chunk_size])
+
+
+@pytest.mark.parametrize('chunk_size', [1, 37, 1000])
+def test_given_ranges_equal_numpy_histograms(chunk_size):
+    random = np.random.default_rng(0)
+    columns = {'z': random.normal(0., 1., 1000), 'Bz': random.uniform(-2., 2., 1000)}
+    weights = random.uniform(1., 2., 1000)
+    ranges = {'z': (-1.5, 2.), 'Bz': (-1., 1.)}
+    histograms = Histograms(['z'], [('z', 'Bz')], 20, ranges)
+    add_chunks(histograms, columns, weights, chunk_size)
+
+    z_histogram, phase_space = histograms.histograms
+    counts, edges = np.histogram(columns['z'], 20, ranges['z'], weights=weights)
+    np.testing.assert_allclose(z_histogram.counts, counts)
+    np.testing.assert_allclose(z_histogram.get_edges()[0], edges)
+    counts, z_edges, Bz_edges = np.histogram2d(columns['z'], columns['Bz'], 20, [ranges['z'], ranges['Bz']],
+                                               weights=weights)
+    np.testing.assert_allclose(phase_space.counts, counts)
+    inside = (columns['z'] >= -1.5) & (columns['z'] <= 2.)
+    assert z_histogram.get_mean()[0] == pytest.approx(np.average(columns['z'][inside], weights=weights[inside]))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 100, 5000])
+def test_adaptive_ranges_equal_numpy_histograms_on_final_edges(chunk_size):
+    random = np.random.default_rng(1)
+    # later chunks are far outside the range of the first chunk on both sides
+    values = np.concatenate([random.normal(0., 1., 1000), random.normal(30., 5., 1000),
+                             random.normal(-100., 1., 1000)])
+    weights = random.uniform(1., 2., len(values))
+    histograms = Histograms(['x'], bins=64)
+    add_chunks(histograms, {'x': values}, weights, chunk_size)
+
+    histogram = histograms.histograms[0]
+    low, high = histogram.ranges[0]
+    assert low <= values.min() and high >= values.max()
+    counts, edges = np.histogram(values, histogram.get_edges()[0], weights=weights)
+    np.testing.assert_allclose(histogram.counts, counts)
+    assert histogram.weight == pytest.approx(weights.sum())
+    assert histogram.get_mean()[0] == pytest.approx(np.average(values, weights=weights))
+    assert histogram.get_rms()[0] == pytest.approx(np.sqrt(np.cov(values, aweights=weights, bias=True)))
+
+
+def test_single_value_is_in_middle_bin():
+    histogram = Histogram(['x'], 10, {})
+    histogram.add({'x': np.full(5, 3.)}, np.ones(5))
+
+    assert list(np.nonzero(histogram.counts)[0]) == [5]
+    low, high = histogram.ranges[0]
+    assert low < 3. < high
+
+
+def test_pre_pass_ranges_of_gdf_step(tmp_path):
+    random = np.random.default_rng(2)
+    file_directory = str(tmp_path / 'steps.gdf')
+    x = random.normal(0., 1., 500)
+    nmacro = random.uniform(1., 2., 500)
+    write_gdf_file(file_directory, [(0., {'x': random.normal(size=10), 'nmacro': np.ones(10)}),
+                                    (1., {'x': x, 'nmacro': nmacro})])
+    histograms = gdf_histograms(file_directory, Histograms(['x', 'z'], bins=25), chunk_size=64)
+
+    assert histograms.names == ['x']
+    counts, edges = np.histogram(x, 25, (x.min(), x.max()), weights=nmacro)
+    np.testing.assert_allclose(histograms.histograms[0].counts, counts)
+    np.testing.assert_allclose(histograms.histograms[0].get_edges()[0], edges)
+
+
+def test_overview_during_conversion_equals_histograms_of_written_file(tmp_path):
+    file_directory = str(tmp_path / 'particles.h5')
+    write_particles_h5(file_directory, size=3000, species=('e', 'i'))
+    gdf_directory = str(tmp_path / 'particles.gdf')
+    overview_directory = str(tmp_path / 'overview.npz')
+    hdf_to_gdf(file_directory, gdf_directory, 100, None, None, overview=overview_directory)
+
+    arrays = read_last_step(gdf_directory)
+    overview = np.load(overview_directory)
+    for name in ['x', 'y', 'z', 'Bx', 'By', 'Bz']:
+        counts, edges = np.histogram(arrays[name], overview[name + '_edges'], weights=arrays['nmacro'])
+        np.testing.assert_allclose(overview[name + '_counts'], counts, err_msg=name)
+        assert overview[name + '_counts'].sum() == pytest.approx(arrays['nmacro'].sum())
+    for name, momentum in [('x', 'Bx'), ('y', 'By'), ('z', 'Bz')]:
+        key = name + '_' + momentum
+        counts = np.histogram2d(arrays[name], arrays[momentum], [overview[key + '_edges_0'],
+                                overview[key + '_edges_1']], weights=arrays['nmacro'])[0]
+        np.testing.assert_allclose(overview[key + '_counts'], counts, err_msg=key)
+
+
+def write_overview_steps(file_directory):
+    random = np.random.default_rng(3)
+    steps = []
+    for time, size in [(0., 200), (1., 700)]:
+        arrays = {name: random.normal(0., 1e-3, size) for name in ['x', 'y', 'z']}
+        for name in ['Bx', 'By', 'Bz']:
+            arrays[name] = random.uniform(-0.5, 0.5, size)
+        arrays['G'] = 1. / np.sqrt(1. - arrays['Bx'] ** 2 - arrays['By'] ** 2 - arrays['Bz'] ** 2)
+        arrays['nmacro'] = random.uniform(1., 2., size)
+        steps.append((time, arrays))
+    write_gdf_file(file_directory, steps)
+    return steps
+
+
+@pytest.mark.parametrize('step_number', [None, 0])
+def test_gdf_overview_npz(tmp_path, step_number):
+    file_directory = str(tmp_path / 'steps.gdf')
+    output_directory = str(tmp_path / 'overview.npz')
+    steps = write_overview_steps(file_directory)
+    gdf_overview(file_directory, output_directory, step_number, bins=30)
+
+    arrays = steps[-1 if step_number == None else step_number][1]
+    overview = np.load(output_directory)
+    assert sorted(overview.files) == sorted(
+        [name + suffix for name in ['x', 'y', 'z', 'Bx', 'By', 'Bz', 'G'] for suffix in ['_counts', '_edges']] +
+        [pair + suffix for pair in ['x_Bx', 'y_By', 'z_Bz'] for suffix in ['_counts', '_edges_0', '_edges_1']])
+    for name in ['x', 'y', 'z', 'Bx', 'By', 'Bz', 'G']:
+        edges = overview[name + '_edges']
+        assert overview[name + '_counts'].shape == (30,) and len(edges) == 31
+        assert edges[0] == arrays[name].min() and edges[-1] == arrays[name].max()
+        counts = np.histogram(arrays[name], edges, weights=arrays['nmacro'])[0]
+        np.testing.assert_allclose(overview[name + '_counts'], counts, err_msg=name)
+    for name, momentum in [('x', 'Bx'), ('y', 'By'), ('z', 'Bz')]:
+        key = name + '_' + momentum
+        assert overview[key + '_counts'].shape == (30, 30)
+        counts = np.histogram2d(arrays[name], arrays[momentum], [overview[key + '_edges_0'],
+                                overview[key + '_edges_1']], weights=arrays['nmacro'])[0]
+        np.testing.assert_allclose(overview[key + '_counts'], counts, err_msg=key)
+        assert overview[key + '_counts'].sum() == pytest.approx(arrays['nmacro'].sum())
+
+
+def test_gdf_overview_image(tmp_path):
+    file_directory = str(tmp_path / 'steps.gdf')
+    output_directory = str(tmp_path / 'overview.png')
+    write_overview_steps(file_directory)
+    gdf_overview(file_directory, output_directory, bins=10)
+
+    with open(output_directory, 'rb') as image_file:
+        assert image_file.read(8) == b'\x89PNG\r\n\x1a\n'
@@ -0,0 +1,48 @@
+import h5py
+import numpy as np
+import pytest
+
+from conftest import write_particles_h5
+from get_fields_and_particles import mask, mask_datasets, ParticleView, load_position_masked, \
+    load_momentum_masked, load_weighting_masked
+
+
+@pytest.mark.parametrize('stepsize', [1, 5, 64, 2**20])
+def test_masked_datasets_and_arrays(tmp_path, stepsize):
+    random = np.random.default_rng(4)
+    values = random.normal(size=300)
+    ids = np.arange(300, dtype=np.uint64)
+    particles_mask = random.uniform(size=300) < 0.3
+    particles_mask[:70] = False
+    with h5py.File(str(tmp_path / 'values.h5'), 'w') as hdf_file:
+        dataset = hdf_file.create_dataset('values', data=values, chunks=(32,))
+        masked_values, masked_ids, masked_dataset = mask_datasets([values, ids, dataset], particles_mask, stepsize)
+
+    for result, array in [(masked_values, values), (masked_ids, ids), (masked_dataset, values)]:
+        np.testing.assert_array_equal(result, array[particles_mask])
+        assert result.dtype == array.dtype
+
+
+def test_empty_mask_and_mask_dataset(tmp_path):
+    values = np.arange(10.)
+    with h5py.File(str(tmp_path / 'values.h5'), 'w') as hdf_file:
+        hdf_file['mask'] = values > 6.5
+        hdf_file['values'] = values
+        assert list(mask(hdf_file['values'], hdf_file['mask'])) == [7., 8., 9.]
+        result, = mask_datasets([hdf_file['values']], np.zeros(10, dtype=bool), stepsize=3)
+    assert result.shape == (0,) and result.dtype == np.float64
+
+
+def test_masked_loads_equal_view(tmp_path):
+    file_directory = str(tmp_path / 'particles.h5')
+    write_particles_h5(file_directory, size=500, species=('en',))
+    particles_mask = np.random.default_rng(5).uniform(size=500) < 0.5
+    with h5py.File(file_directory, 'r') as hdf_file:
+        view = ParticleView(hdf_file, 100)
+        for axis in 'xyz':
+            np.testing.assert_allclose(load_position_masked(axis, 100, hdf_file, particles_mask),
+                                       view.position(axis)[particles_mask], rtol=1e-14)
+            np.testing.assert_allclose(load_momentum_masked(axis, 100, hdf_file, particles_mask),
+                                       view.momentum(axis)[particles_mask], rtol=1e-6)
+        np.testing.assert_array_equal(load_weighting_masked(100, hdf_file, particles_mask),
+                                      view.weighting()[particles_mask])
@@ -0,0 +1,95 @@
+import h5py
+import numpy as np
+import openpmd_api
+import pytest
+
+from conftest import write_particles_h5, read_without_time
+from openPMD_to_gdf import hdf_to_gdf, get_species_metadata
+from hdf5_memory_map import get_memory_map, get_dataset_view
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32, np.int32, np.uint64, np.int8])
+def test_memory_map_of_contiguous_dataset(tmp_path, dtype):
+    file_directory = str(tmp_path / 'values.h5')
+    values = (np.arange(1000) * 3 % 101).astype(dtype)
+    with h5py.File(file_directory, 'w') as hdf_file:
+        hdf_file.create_dataset('values', data=values)
+
+    with h5py.File(file_directory, 'r') as hdf_file:
+        memory_map = get_memory_map(hdf_file['values'])
+        assert memory_map.dtype == dtype
+        np.testing.assert_array_equal(memory_map, values)
+
+
+def test_no_memory_map_of_other_layouts(tmp_path):
+    file_directory = str(tmp_path / 'values.h5')
+    values = np.arange(1000.)
+    with h5py.File(file_directory, 'w') as hdf_file:
+        hdf_file.create_dataset('chunked', data=values, chunks=(100,))
+        hdf_file.create_dataset('compressed', data=values, compression='gzip')
+        hdf_file.create_dataset('empty', shape=(0,), dtype=np.float64)
+        hdf_file.create_dataset('strings', data=np.array([b'a', b'b']))
+        hdf_file.create_dataset('not_written', shape=(10,), dtype=np.float64)
+
+    with h5py.File(file_directory, 'r') as hdf_file:
+        for name in ['chunked', 'compressed', 'empty', 'strings', 'not_written']:
+            assert get_memory_map(hdf_file[name]) is None, name
+    with h5py.File(file_directory, 'r', driver='core') as hdf_file:
+        assert get_memory_map(hdf_file['compressed']) is None
+
+
+def test_dataset_view(tmp_path):
+    file_directory = str(tmp_path / 'values.h5')
+    with h5py.File(file_directory, 'w') as hdf_file:
+        hdf_file.create_dataset('contiguous', data=np.arange(10.))
+        hdf_file.create_dataset('chunked', data=np.arange(10.), chunks=(5,))
+
+    with h5py.File(file_directory, 'r') as hdf_file:
+        assert isinstance(get_dataset_view(hdf_file['contiguous']), np.memmap)
+        chunked = hdf_file['chunked']
+        assert get_dataset_view(chunked) is chunked
+        np.testing.assert_array_equal(get_dataset_view(hdf_file['contiguous'])[()], np.arange(10.))
+
+
+def test_components_of_contiguous_datasets_are_memory_mapped(tmp_path):
+    file_directory = str(tmp_path / 'particles.h5')
+    write_particles_h5(file_directory, size=100)
+    with h5py.File(file_directory, 'r+') as hdf_file:
+        del hdf_file['data/100/particles/e/weighting']
+        hdf_file.create_dataset('data/100/particles/e/weighting', data=np.ones(100, dtype=np.float32),
+                                chunks=(10,))
+        for name, value in [('unitSI', 1.), ('unitDimension', np.zeros(7)), ('timeOffset', np.float32(0.))]:
+            hdf_file['data/100/particles/e/weighting'].attrs[name] = value
+
+    with h5py.File(file_directory, 'r') as hdf_file:
+        series = openpmd_api.Series(file_directory, openpmd_api.Access.read_only)
+        particles_group = hdf_file['data/100/particles']
+        records = get_species_metadata(series.iterations[100], 'e', particles_group, True)['e'].records
+        np.testing.assert_array_equal(records['position']['x'].values, hdf_file['data/100/particles/e/position/x'])
+        assert get_species_metadata(series.iterations[100], 'e', particles_group)['e'].records['position']['x'] \
+            .values is None
+        assert records['weighting'][openpmd_api.Mesh_Record_Component.SCALAR].values is None
+        assert records['charge'][openpmd_api.Mesh_Record_Component.SCALAR].values is None
+        series.close()
+
+
+@pytest.mark.parametrize('max_cell_size', [64, 1000000])
+def test_memory_mapped_conversion_equals_openPMD_api(tmp_path, max_cell_size):
+    file_directory = str(tmp_path / 'particles.h5')
+    write_particles_h5(file_directory, size=1000, iterations=(100, 200), species=('e', 'i'))
+    reference_directory = str(tmp_path / 'reference.gdf')
+    result_directory = str(tmp_path / 'result.gdf')
+    hdf_to_gdf(file_directory, reference_directory, max_cell_size, None, None)
+    hdf_to_gdf(file_directory, result_directory, max_cell_size, None, None, mmap=True)
+
+    assert read_without_time(result_directory) == read_without_time(reference_directory)
+
+
+@pytest.mark.parametrize('roi, shard', [('1e-5:3.3e-5,:,3e-6:', None), (None, '1/3'), ('1e-5:,:,:', '0/2')])
+def test_memory_mapped_conversion_with_roi_and_shard(tmp_path, particles_h5, roi, shard):
+    reference_directory = str(tmp_path / 'reference.gdf')
+    result_directory = str(tmp_path / 'result.gdf')
+    hdf_to_gdf(particles_h5, reference_directory, 100, None, None, roi=roi, shard=shard)
+    hdf_to_gdf(particles_h5, result_directory, 100, None, None, roi=roi, shard=shard, mmap=True)
+
+    assert read_without_time(result_directory) == read_without_time(reference_directory)
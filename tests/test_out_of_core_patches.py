@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from conftest import write_particles_h5, assert_same_datasets
+from OpenPMD_add_patches import OpenPMD_add_patches, Out_of_core, count_window_segments, spill_sorted_windows, \
+    write_patches_sequentially
+
+
+@pytest.mark.parametrize('memory_budget', [64, 64 * 97, 2**20])
+@pytest.mark.parametrize('chunks', [None, (100,)])
+def test_out_of_core_equals_in_memory(tmp_path, memory_budget, chunks):
+    file_directory = str(tmp_path / 'particles.h5')
+    write_particles_h5(file_directory, size=1000, iterations=(100, 200), species=('e', 'i'), chunks=chunks)
+    in_memory = str(tmp_path / 'in_memory.h5')
+    out_of_core = str(tmp_path / 'out_of_core.h5')
+
+    OpenPMD_add_patches(file_directory, in_memory, [0., 1., 0., 1., 0., 1.], [2, 3, 2], 1e-5)
+    OpenPMD_add_patches(file_directory, out_of_core, [0., 1., 0., 1., 0., 1.], [2, 3, 2], 1e-5,
+                        memory_budget=memory_budget)
+
+    assert_same_datasets(in_memory, out_of_core)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_sorted_windows_are_written_patch_by_patch(tmp_path, seed):
+    random = np.random.default_rng(seed)
+    size = int(random.integers(0, 300))
+    number_patches = int(random.integers(1, 30))
+    patch_ids = random.integers(0, number_patches, size)
+    values = random.normal(size=(size, 2))
+    out_of_core = Out_of_core(Out_of_core.bytes_per_particle * int(random.integers(1, 50)), str(tmp_path))
+
+    window_orders = out_of_core.create_buffer('window_orders', np.int64, (size,))
+    window_counts = count_window_segments(patch_ids, number_patches, window_orders, out_of_core)
+    spilled_values = out_of_core.create_buffer('values', values.dtype, values.shape)
+    spill_sorted_windows(values, spilled_values, window_orders, out_of_core)
+    moved_values = np.zeros_like(values)
+    write_patches_sequentially(spilled_values, moved_values, window_counts, int(random.integers(1, 40)))
+
+    np.testing.assert_array_equal(moved_values, values[np.argsort(patch_ids, kind='stable')])
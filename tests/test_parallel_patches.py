@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+
+from conftest import write_particles_h5, assert_same_datasets
+from OpenPMD_add_patches import OpenPMD_add_patches, gather_values
+
+
+@pytest.mark.parametrize('jobs', [2, 3])
+@pytest.mark.parametrize('chunk_size', [1, 7, 1000])
+def test_gather_with_threads_equals_serial(jobs, chunk_size):
+    random = np.random.default_rng(jobs)
+    values = random.random(500)
+    permutation = random.permutation(500)
+    moved_values = np.zeros(500)
+    with ThreadPoolExecutor(jobs) as executor:
+        gather_values(values, permutation, moved_values, chunk_size, executor, jobs)
+
+    np.testing.assert_array_equal(moved_values, values[permutation])
+
+
+def test_jobs_give_the_same_file(tmp_path):
+    file_directory = str(tmp_path / 'particles.h5')
+    write_particles_h5(file_directory, size=1000, iterations=(100, 200, 300))
+    serial = str(tmp_path / 'serial.h5')
+    parallel = str(tmp_path / 'parallel.h5')
+
+    OpenPMD_add_patches(file_directory, serial, [0., 1., 0., 1., 0., 1.], [2, 2, 2], 1e-5)
+    OpenPMD_add_patches(file_directory, parallel, [0., 1., 0., 1., 0., 1.], [2, 2, 2], 1e-5, jobs=2)
+
+    assert_same_datasets(serial, parallel)
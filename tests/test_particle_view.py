@@ -0,0 +1,93 @@
+import h5py
+import numpy as np
+import pytest
+import scipy.constants as const
+
+from conftest import write_particles_h5
+from get_fields_and_particles import ParticleView, load_position, load_momentum, load_momentums
+
+
+@pytest.fixture
+def particles_file(tmp_path):
+    file_directory = str(tmp_path / 'particles.h5')
+    write_particles_h5(file_directory, size=1000, species=('en',))
+    with h5py.File(file_directory, 'r') as hdf_file:
+        yield hdf_file
+
+
+def get_expected(hdf_file):
+    """ Positions in um and normalized momentums computed from whole datasets """
+
+    group = hdf_file['data/100/particles/en']
+    weighting = group['weighting'][()]
+    position = [group['position/' + axis][()] * 1e-6 * 1e6 + group['positionOffset/' + axis][()] * 1e-6 * 1e6
+                for axis in 'xyz']
+    momentum = [group['momentum/' + axis][()].astype(np.float64) * 2.5 / (const.m_e * const.c) / weighting for axis in 'xyz']
+    return np.array(position), np.array(momentum)
+
+
+@pytest.mark.parametrize('stepsize', [1, 77, 2**20])
+def test_columns_equal_whole_datasets(particles_file, stepsize):
+    view = ParticleView(particles_file, 100, stepsize=stepsize)
+    position, momentum = get_expected(particles_file)
+
+    assert len(view) == 1000
+    for i, axis in enumerate('xyz'):
+        np.testing.assert_allclose(view.position(axis), position[i], rtol=1e-14)
+        np.testing.assert_allclose(view.momentum(axis), momentum[i], rtol=1e-6)
+    absolute, momentums = view.momentums()
+    np.testing.assert_allclose(momentums, momentum, rtol=1e-6)
+    np.testing.assert_allclose(absolute, np.sqrt(np.sum(momentum ** 2, axis=0)), rtol=1e-6)
+    np.testing.assert_allclose(view.gamma(momentums), np.sqrt(1. + absolute ** 2), rtol=1e-12)
+    np.testing.assert_allclose(view.gamma(), np.sqrt(1. + absolute ** 2), rtol=1e-12)
+    np.testing.assert_array_equal(view.id(), particles_file['data/100/particles/en/particleId'][()])
+
+
+@pytest.mark.parametrize('stepsize', [3, 2**20])
+def test_part_of_particles(particles_file, stepsize):
+    view = ParticleView(particles_file, 100, stepsize=stepsize)
+    position, momentum = get_expected(particles_file)
+    out = np.full(500, -1.)
+
+    view.position('y', out=out[100:300], start=250, stop=450)
+    np.testing.assert_allclose(out[100:300], position[1, 250:450], rtol=1e-14)
+    assert np.all(out[:100] == -1.) and np.all(out[300:] == -1.)
+    np.testing.assert_allclose(view.momentum('z', start=990), momentum[2, 990:], rtol=1e-6)
+    assert 'weighting' not in view.cache
+    np.testing.assert_allclose(view.momentum('x', start=10, stop=20, w=np.ones(10)),
+                               momentum[0, 10:20] * particles_file['data/100/particles/en/weighting'][10:20],
+                               rtol=1e-6)
+
+
+def test_cache_keeps_recent_columns_within_bytes(particles_file):
+    view = ParticleView(particles_file, 100, cache_bytes=12000)
+
+    weighting = view.weighting()
+    assert not weighting.flags.writeable
+    assert view.column('weighting') is weighting
+    ids = view.id()
+    assert list(view.cache) == ['weighting', 'particleId'] and view.cached_bytes == 12000
+    view.column('weighting')
+    view.column('momentum/x')
+    assert list(view.cache) == ['weighting', 'momentum/x'] and view.cached_bytes == 8000
+    view.column('position/x')
+    assert list(view.cache) == ['momentum/x', 'position/x'] and view.cached_bytes == 12000
+    assert view.id() is not ids
+    np.testing.assert_array_equal(view.id(), ids)
+
+
+def test_columns_larger_than_cache_are_not_kept(particles_file):
+    view = ParticleView(particles_file, 100, cache_bytes=1000)
+
+    view.weighting()
+    assert len(view.cache) == 0 and view.cached_bytes == 0
+    np.testing.assert_array_equal(view.momentum('x', start=5, stop=9),
+                                  ParticleView(particles_file, 100).momentum('x')[5:9])
+
+def test_load_functions_use_view(particles_file):
+    position, momentum = get_expected(particles_file)
+
+    np.testing.assert_allclose(load_position('z', 100, particles_file), position[2], rtol=1e-14)
+    np.testing.assert_allclose(load_momentum('y', 100, particles_file), momentum[1], rtol=1e-6)
+    absolute, momentums = load_momentums(100, particles_file)
+    np.testing.assert_allclose(momentums, momentum, rtol=1e-6)
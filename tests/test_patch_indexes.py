@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from OpenPMD_add_patches import get_patch_data, count_points_idx, List_coorditates
+
+
+def get_coordinates(size, axes, seed=0):
+    """ Coordinates in [0, 1) with values on patch borders and out of the grid """
+
+    random = np.random.default_rng(seed)
+    coordinates = [random.uniform(-0.1, 1.1, size) for axis in range(axes)]
+    for values in coordinates:
+        values[:8] = [0., 0.25, 0.5, 0.75, 1., -0.5, 1.5, 1. / 3.]
+    return coordinates
+
+
+@pytest.mark.parametrize('devices_numbers', [[2, 3], [1, 1], [4, 1, 3], [3, 2, 5]])
+def test_position_indexes_match_one_by_one(devices_numbers):
+    coordinates = get_coordinates(500, len(devices_numbers))
+    list_z = coordinates[2] if len(coordinates) == 3 else []
+    patch_data = get_patch_data(coordinates[0], coordinates[1], list_z, [0., 1.] * len(devices_numbers),
+                                devices_numbers)
+
+    indexes = patch_data.get_position_indexes()
+    assert list(indexes) == [patch_data.get_position_idx(i) for i in range(500)]
+    assert indexes.min() >= 0 and indexes.max() < np.prod(devices_numbers)
+
+
+def test_grid_ranges_are_used():
+    patch_data = get_patch_data(np.array([10., 14.9, 15., 19.9]), np.array([-1., 0.9, 1., 3.]), [],
+                                [10., 20., -1., 3.], [2, 4])
+
+    np.testing.assert_array_equal(patch_data.get_position_indexes(), [0, 1, 6, 7])
+
+
+@pytest.mark.parametrize('devices_numbers', [[2, 3], [4, 1, 3]])
+def test_count_points_idx_sorts_by_patches(devices_numbers):
+    coordinates = get_coordinates(1000, len(devices_numbers), seed=1)
+    coordinate_lists = List_coorditates()
+    coordinate_lists.list_x, coordinate_lists.list_y = coordinates[:2]
+    coordinate_lists.list_z = coordinates[2] if len(coordinates) == 3 else []
+    list_z = coordinate_lists.list_z
+    patch_ids = get_patch_data(coordinates[0], coordinates[1], list_z, [0., 1.] * len(devices_numbers),
+                               devices_numbers).get_position_indexes()
+
+    permutation, final_size, numbers = count_points_idx(coordinate_lists, [0., 1.] * len(devices_numbers),
+                                                        devices_numbers)
+
+    assert sorted(permutation) == list(range(1000))
+    np.testing.assert_array_equal(numbers[:-1], np.bincount(patch_ids, minlength=np.prod(devices_numbers)))
+    for patch in range(int(np.prod(devices_numbers))):
+        rows = permutation[final_size[patch]:final_size[patch + 1]]
+        assert np.all(patch_ids[rows] == patch)
+        assert np.all(np.diff(rows) > 0)
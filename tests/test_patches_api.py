@@ -0,0 +1,181 @@
+import numpy as np
+import openpmd_api
+import pytest
+
+from OpenPMD_add_patches_api import openPMD_add_patches, get_result_encoding
+
+SCALAR = openpmd_api.Record_Component.SCALAR
+PATCH_SCALAR = openpmd_api.Patch_Record_Component.SCALAR
+
+
+def write_series(series_directory, iterations=(100, 200), size=500, seed=3):
+    """ Series with species e (position in [0, 1), positionOffset, momentum, weighting, particleId,
+    constant charge) and a mesh E in each iteration """
+
+    random = np.random.default_rng(seed)
+    series = openpmd_api.Series(series_directory, openpmd_api.Access.create)
+    for index in iterations:
+        iteration = series.iterations[index]
+        species = iteration.particles['e']
+        for record_name, unit_si in [('position', 1e-6), ('positionOffset', 1e-6), ('momentum', 2.5)]:
+            for axis in 'xyz':
+                if record_name == 'position':
+                    values = random.uniform(0., 1., size)
+                elif record_name == 'positionOffset':
+                    values = random.integers(0, 4, size).astype(np.int32)
+                else:
+                    values = random.normal(0., 1., size).astype(np.float32)
+                component = species[record_name][axis]
+                component.reset_dataset(openpmd_api.Dataset(values.dtype, values.shape))
+                component.set_unit_SI(unit_si)
+                component.store_chunk(values)
+        for record_name, values in [('weighting', random.uniform(1., 2., size)),
+                                    ('particleId', random.permutation(size).astype(np.uint64))]:
+            component = species[record_name][SCALAR]
+            component.reset_dataset(openpmd_api.Dataset(values.dtype, values.shape))
+            component.store_chunk(values)
+        charge = species['charge'][SCALAR]
+        charge.reset_dataset(openpmd_api.Dataset(np.dtype('f8'), [size]))
+        charge.make_constant(-1.6e-19)
+        field = iteration.meshes['E']['x']
+        values = random.normal(size=(6, 5))
+        field.reset_dataset(openpmd_api.Dataset(values.dtype, values.shape))
+        field.store_chunk(values)
+        series.flush()
+    series.close()
+
+
+def read_series(series_directory):
+    """ Values of all components of all iterations, patch records and encoding of series """
+
+    series = openpmd_api.Series(series_directory, openpmd_api.Access.read_only)
+    result = {}
+    for index, iteration in series.iterations.items():
+        values = {}
+        species = iteration.particles['e']
+        for record_name, record in species.items():
+            for name, component in record.items():
+                if component.constant:
+                    values[record_name, name] = component.get_attribute('value')
+                else:
+                    values[record_name, name] = component.load_chunk()
+        values['E', 'x'] = iteration.meshes['E']['x'].load_chunk()
+        patches = {}
+        if species.particle_patches.num_patches != 0:
+            for record_name, record in species.particle_patches.items():
+                for name, component in record.items():
+                    patches[record_name, name] = (component.load(), component.unit_SI,
+                                                  dict((attribute, component.get_attribute(attribute))
+                                                       for attribute in component.attributes))
+        series.flush()
+        result[index] = (values, patches)
+    encoding = series.iteration_encoding
+    series.close()
+    return result, encoding
+
+
+def get_grid_permutation(position, devices_numbers):
+    """ Stable sort of particles by their cell of grid 0 .. 1 on each axis """
+
+    cells = [np.clip(np.floor(position[axis] * number).astype(np.int64), 0, number - 1)
+             for axis, number in zip('xyz', devices_numbers)]
+    patch_ids = np.ravel_multi_index(cells, devices_numbers)
+    return np.argsort(patch_ids, kind='stable'), np.bincount(patch_ids, minlength=int(np.prod(devices_numbers)))
+
+
+@pytest.mark.parametrize('chunk_size', [64, 2**20])
+def test_hdf5_to_adios2_grid_patches(tmp_path, chunk_size):
+    input_directory = str(tmp_path / 'input_%T.h5')
+    result_directory = str(tmp_path / 'result.bp')
+    write_series(input_directory)
+    openPMD_add_patches(input_directory, result_directory, [0., 1., 0., 1., 0., 1.], [2, 3, 2],
+                        chunk_size=chunk_size)
+
+    inputs, input_encoding = read_series(input_directory)
+    results, result_encoding = read_series(result_directory)
+    assert input_encoding == openpmd_api.Iteration_Encoding.file_based
+    assert result_encoding == openpmd_api.Iteration_Encoding.group_based
+    assert sorted(results) == [100, 200]
+    for index, (values, patches) in results.items():
+        input_values = inputs[index][0]
+        position = {axis: input_values['position', axis] for axis in 'xyz'}
+        permutation, numbers = get_grid_permutation(position, [2, 3, 2])
+        assert sorted(values) == sorted(input_values)
+        for key, value in values.items():
+            if key == ('charge', SCALAR) or key == ('E', 'x'):
+                np.testing.assert_array_equal(value, input_values[key])
+            else:
+                np.testing.assert_array_equal(value, input_values[key][permutation], err_msg=str(key))
+                assert value.dtype == input_values[key].dtype
+
+        assert list(patches['numParticles', PATCH_SCALAR][0]) == list(numbers)
+        assert list(patches['numParticlesOffset', PATCH_SCALAR][0]) == list(np.cumsum(numbers) - numbers)
+        cells = np.unravel_index(np.arange(12), [2, 3, 2])
+        for axis, number, cell in zip('xyz', [2, 3, 2], cells):
+            offset, unit_si, attributes = patches['offset', axis]
+            np.testing.assert_allclose(offset, cell / number)
+            np.testing.assert_allclose(patches['extent', axis][0], np.full(12, 1. / number))
+            assert unit_si == 1e-6
+            assert 'patchOrder' not in attributes
+
+
+@pytest.mark.parametrize('order', ['morton', 'hilbert'])
+def test_curve_patches_are_boxes_in_si(tmp_path, order):
+    input_directory = str(tmp_path / 'input.h5')
+    result_directory = str(tmp_path / 'result.bp')
+    write_series(input_directory, iterations=(100,))
+    openPMD_add_patches(input_directory, result_directory, None, [2, 2, 2], order=order, chunk_size=100)
+
+    inputs, input_encoding = read_series(input_directory)
+    results, result_encoding = read_series(result_directory)
+    assert result_encoding == openpmd_api.Iteration_Encoding.group_based
+    values, patches = results[100]
+    numbers = patches['numParticles', PATCH_SCALAR][0]
+    offsets = patches['numParticlesOffset', PATCH_SCALAR][0]
+    assert list(numbers) == [62, 63] * 4
+    ids = values['particleId', SCALAR]
+    np.testing.assert_array_equal(np.sort(ids), np.arange(500))
+    input_rows = np.argsort(inputs[100][0]['particleId', SCALAR])[ids]
+    for axis in 'xyz':
+        np.testing.assert_array_equal(values['position', axis], inputs[100][0]['position', axis][input_rows])
+        coordinate = values['position', axis] * 1e-6 + values['positionOffset', axis] * 1e-6
+        offset, unit_si, attributes = patches['offset', axis]
+        extent = patches['extent', axis][0]
+        assert unit_si == 1. and attributes['patchOrder'] == order
+        for patch in range(8):
+            patch_values = coordinate[offsets[patch]:offsets[patch] + numbers[patch]]
+            assert patch_values.min() == pytest.approx(offset[patch])
+            assert patch_values.max() == pytest.approx(offset[patch] + extent[patch])
+
+
+@pytest.mark.parametrize('input_name', ['input_%T.h5', 'input.h5'])
+def test_file_based_result_with_pattern(tmp_path, input_name):
+    input_directory = str(tmp_path / input_name)
+    result_directory = str(tmp_path / 'result_%T.bp')
+    write_series(input_directory, size=50)
+    openPMD_add_patches(input_directory, result_directory, [0., 1., 0., 1.], [2, 2])
+
+    results, result_encoding = read_series(result_directory)
+    assert result_encoding == openpmd_api.Iteration_Encoding.file_based
+    assert (tmp_path / 'result_100.bp').exists() and (tmp_path / 'result_200.bp').exists()
+    assert sorted(results) == [100, 200]
+    for values, patches in results.values():
+        assert patches['numParticles', PATCH_SCALAR][0].sum() == 50
+
+
+class Encoded_series:
+    def __init__(self, iteration_encoding):
+        self.iteration_encoding = iteration_encoding
+
+
+@pytest.mark.parametrize('encoding, result_name, result_encoding', [
+    ('file_based', 'result.h5', 'group_based'),
+    ('file_based', 'result_%T.bp', 'file_based'),
+    ('file_based', 'result_%06T.h5', 'file_based'),
+    ('group_based', 'result.bp', 'group_based'),
+    ('group_based', 'result_%T.h5', 'file_based'),
+    ('variable_based', 'result.bp', 'variable_based')])
+def test_result_encoding(encoding, result_name, result_encoding):
+    series = Encoded_series(getattr(openpmd_api.Iteration_Encoding, encoding))
+
+    assert get_result_encoding(series, result_name) == getattr(openpmd_api.Iteration_Encoding, result_encoding)
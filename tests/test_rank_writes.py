@@ -0,0 +1,99 @@
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import openpmd_api
+import pytest
+
+from conftest import write_particles_h5, read_without_time
+from openPMD_to_gdf import hdf_to_gdf, hdf_file_to_gdf_file, open_rank_gdf_file, Rank_shard, Region_of_interest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'openPMD_to_gdf.py')
+
+
+class Process_comm:
+    """ Part of MPI communicator used by the conversion, ranks are forked processes.
+    HDF5 is not thread-safe, so threads can not be used as ranks """
+
+    def __init__(self, rank, size, barrier, values):
+        self.rank = rank
+        self.size = size
+        self.barrier = barrier
+        self.values = values
+
+    def Barrier(self):
+        self.barrier.wait()
+
+    def gather(self, value):
+        self.values[self.rank] = value
+        self.Barrier()
+        values = list(self.values)
+        self.Barrier()
+        return values
+
+    def allreduce(self, value):
+        return sum(self.gather(value))
+
+    def exscan(self, value):
+        values = self.gather(value)
+        return None if self.rank == 0 else sum(values[:self.rank])
+
+
+def convert_rank(comm, input_directory, result_directory, max_cell_size, roi):
+    try:
+        series = openpmd_api.Series(input_directory, openpmd_api.Access.read_only)
+        with open_rank_gdf_file(comm, result_directory) as gdf_file:
+            hdf_file_to_gdf_file(gdf_file, series, max_cell_size, '', None, roi, Rank_shard(comm))
+        series.close()
+        comm.Barrier()
+    except Exception:
+        comm.barrier.abort()
+        raise
+
+
+def convert_ranks(input_directory, result_directory, size, max_cell_size, roi):
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(size)
+    values = context.Array('q', size)
+    if roi != None:
+        roi = Region_of_interest(roi)
+    processes = [context.Process(target=convert_rank, args=(Process_comm(rank, size, barrier, values),
+                                                            input_directory, result_directory, max_cell_size, roi))
+                 for rank in range(size)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return [process.exitcode for process in processes]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3])
+@pytest.mark.parametrize('max_cell_size, roi', [(1000000, None), (77, None), (100, '1e-5:3.3e-5,:,3e-6:')])
+def test_rank_writes_equal_single_process(tmp_path, size, max_cell_size, roi):
+    input_directory = str(tmp_path / 'particles.h5')
+    write_particles_h5(input_directory, size=500, iterations=(100, 200), species=('e', 'i'))
+    reference_directory = str(tmp_path / 'reference.gdf')
+    result_directory = str(tmp_path / 'result.gdf')
+    hdf_to_gdf(input_directory, reference_directory, max_cell_size, None, None, roi=roi)
+
+    assert convert_ranks(input_directory, result_directory, size, max_cell_size, roi) == [0] * size
+    assert read_without_time(result_directory) == read_without_time(reference_directory)
+
+
+def test_mpiexec_conversion_equals_single_process(tmp_path):
+    pytest.importorskip('mpi4py')
+    if not openpmd_api.variants['mpi']:
+        pytest.skip('openPMD-api is built without MPI')
+    mpiexec = shutil.which('mpiexec')
+    if mpiexec == None:
+        pytest.skip('mpiexec is not found')
+    input_directory = str(tmp_path / 'particles.h5')
+    write_particles_h5(input_directory, size=500, iterations=(100, 200), species=('e', 'i'))
+    reference_directory = str(tmp_path / 'reference.gdf')
+    result_directory = str(tmp_path / 'result.gdf')
+    hdf_to_gdf(input_directory, reference_directory, 77, None, None)
+
+    subprocess.run([mpiexec, '-n', '3', sys.executable, SCRIPT, '-openPMD_input', input_directory,
+                    '-gdf', result_directory, '-max_cell', '77', '-mpi'], check=True, timeout=300)
+    assert read_without_time(result_directory) == read_without_time(reference_directory)
@@ -0,0 +1,99 @@
+import h5py
+import numpy as np
+import openpmd_api
+import pytest
+
+import openPMD_to_gdf
+from conftest import write_particles_h5, read_without_time
+from openPMD_to_gdf import hdf_to_gdf, get_read_windows, get_chunk_starts, get_species_metadata
+
+
+@pytest.mark.parametrize('chunk_starts, size, max_cell_size, windows', [
+    ([], 10, 100, [(0, 10)]),
+    ([], 10, 4, [(0, 4), (4, 8), (8, 10)]),
+    ([0, 3, 6, 9], 12, 7, [(0, 6), (6, 12)]),
+    ([0, 3, 6, 9], 12, 3, [(0, 3), (3, 6), (6, 9), (9, 12)]),
+    ([0, 2, 12], 14, 4, [(0, 2), (2, 6), (6, 10), (10, 14)]),
+    ([0, 5, 20, 30], 12, 100, [(0, 12)]),
+    ([], 0, 10, [])])
+def test_read_windows(chunk_starts, size, max_cell_size, windows):
+    assert get_read_windows(chunk_starts, size, max_cell_size) == windows
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_read_windows_keep_small_chunks_whole(seed):
+    random = np.random.default_rng(seed)
+    size = int(random.integers(1, 500))
+    chunk_starts = sorted(set(random.integers(0, size, int(random.integers(0, 20)))) | {0})
+    max_cell_size = int(random.integers(1, 100))
+    windows = get_read_windows(chunk_starts, size, max_cell_size)
+
+    assert [window_start for window_start, window_end in windows] == \
+        [0] + [window_end for window_start, window_end in windows[:-1]]
+    assert windows[-1][1] == size
+    assert all(0 < window_end - window_start <= max_cell_size for window_start, window_end in windows)
+    boundaries = set(window_end for window_start, window_end in windows)
+    for chunk_start, chunk_end in zip(chunk_starts, chunk_starts[1:] + [size]):
+        if chunk_end - chunk_start <= max_cell_size:
+            assert not any(chunk_start < boundary < chunk_end for boundary in boundaries)
+
+
+def write_mixed_chunks(file_directory, size):
+    """ Particles with position chunked by 100 rows, momentum by 64 rows and contiguous weighting """
+
+    write_particles_h5(file_directory, size=size, chunks=(100,))
+    with h5py.File(file_directory, 'r+') as hdf_file:
+        species_group = hdf_file['data/100/particles/e']
+        for name, chunks in [('momentum/x', (64,)), ('momentum/y', (64,)), ('momentum/z', (64,)),
+                             ('weighting', None)]:
+            values = species_group[name][()]
+            attributes = dict(species_group[name].attrs)
+            del species_group[name]
+            dataset = species_group.create_dataset(name, data=values, chunks=chunks)
+            for attribute_name, value in attributes.items():
+                dataset.attrs[attribute_name] = value
+
+
+def test_chunk_starts_of_h5py_datasets(tmp_path):
+    file_directory = str(tmp_path / 'particles.h5')
+    write_mixed_chunks(file_directory, 300)
+
+    with h5py.File(file_directory, 'r') as hdf_file:
+        species_group = hdf_file['data/100/particles/e']
+        assert get_chunk_starts(None, species_group['position/x']) == [0, 100, 200]
+        assert get_chunk_starts(None, species_group['momentum/x']) == [0, 64, 128, 192, 256]
+        assert get_chunk_starts(None, species_group['weighting']) == []
+
+        series = openpmd_api.Series(file_directory, openpmd_api.Access.read_only)
+        metadata = get_species_metadata(series.iterations[100], 'e', hdf_file['data/100/particles'])
+        assert metadata['e'].chunk_starts == [0, 64, 100, 128, 192, 200, 256]
+        assert metadata['e'].records['weighting'][openpmd_api.Mesh_Record_Component.SCALAR].values is None
+        series.close()
+
+
+@pytest.mark.parametrize('max_cell_size', [1, 50, 100, 150, 10000])
+@pytest.mark.parametrize('mmap', [False, True])
+def test_mixed_chunks_give_the_same_file(tmp_path, max_cell_size, mmap):
+    file_directory = str(tmp_path / 'particles.h5')
+    write_mixed_chunks(file_directory, 1000)
+    result_directory = str(tmp_path / 'result.gdf')
+    reference_directory = str(tmp_path / 'reference.gdf')
+    hdf_to_gdf(file_directory, reference_directory, 1000000, None, None)
+    hdf_to_gdf(file_directory, result_directory, max_cell_size, None, None, mmap=mmap)
+
+    assert read_without_time(result_directory) == read_without_time(reference_directory)
+
+
+def test_windows_follow_hdf5_chunks_without_mmap(tmp_path, monkeypatch):
+    file_directory = str(tmp_path / 'particles.h5')
+    write_mixed_chunks(file_directory, 300)
+    windows = []
+
+    def get_recorded_windows(chunk_starts, size, max_cell_size):
+        windows.append(get_read_windows(chunk_starts, size, max_cell_size))
+        return windows[-1]
+
+    monkeypatch.setattr(openPMD_to_gdf, 'get_read_windows', get_recorded_windows)
+    hdf_to_gdf(file_directory, str(tmp_path / 'result.gdf'), 130, None, None)
+
+    assert windows == [[(0, 128), (128, 256), (256, 300)]]
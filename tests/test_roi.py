@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from conftest import read_last_step
+from openPMD_to_gdf import hdf_to_gdf, clip_windows, Region_of_interest
+
+
+@pytest.mark.parametrize('range_start, range_end, clipped', [
+    (5, 27, [(5, 10), (10, 25), (25, 27)]),
+    (11, 12, [(11, 12)]),
+    (0, 30, [(0, 10), (10, 25), (25, 30)]),
+    (10, 25, [(10, 25)]),
+    (30, 40, [])])
+def test_clip_windows(range_start, range_end, clipped):
+    windows = [(0, 10), (10, 25), (25, 30)]
+
+    assert list(clip_windows(windows, range_start, range_end)) == clipped
+
+
+def test_patches_overlap_and_inside():
+    roi = Region_of_interest('0:2,:,1:')
+    offsets = {'x': np.array([0., 1., 2., 3.]), 'y': np.zeros(4), 'z': np.array([1., 0., 1., 5.])}
+    extents = {'x': np.ones(4), 'y': np.ones(4), 'z': np.ones(4)}
+    overlap, inside = roi.get_patches_overlap(offsets, extents, 4)
+
+    assert list(overlap) == [True, False, True, False]
+    assert list(inside) == [True, False, False, False]
+
+
+@pytest.mark.parametrize('roi', ['16e-6:48e-6,:,:', '1e-5:3.3e-5,5e-6:2e-5,3e-6:', ':,:,:', ':,:,8e-6:', '1:2,:,:'])
+@pytest.mark.parametrize('max_cell_size', [100, 1000000])
+def test_roi_equals_filtered_conversion(tmp_path, patched_series, roi, max_cell_size):
+    full_directory = str(tmp_path / 'full.gdf')
+    roi_directory = str(tmp_path / 'roi.gdf')
+    hdf_to_gdf(patched_series, full_directory, max_cell_size, None, None)
+    hdf_to_gdf(patched_series, roi_directory, max_cell_size, None, None, roi=roi)
+
+    full_arrays = read_last_step(full_directory)
+    roi_arrays = read_last_step(roi_directory)
+    mask = Region_of_interest(roi).get_mask({axis: full_arrays[axis] for axis in 'xyz'})
+    assert list(roi_arrays) == list(full_arrays)
+    for name, values in full_arrays.items():
+        np.testing.assert_array_equal(roi_arrays[name], values[mask], err_msg=name)
@@ -0,0 +1,58 @@
+import pytest
+
+from conftest import write_particles_h5, read_without_time
+from openPMD_to_gdf import hdf_to_gdf, Shard
+from gdf_merge import gdf_merge
+
+
+def convert_shards(input_directory, directory, count, **kwargs):
+    shards_directories = []
+    for number in range(count):
+        shard_directory = str(directory / 'shard_{}.gdf'.format(number))
+        hdf_to_gdf(input_directory, shard_directory, 100, None, None, shard='{}/{}'.format(number, count), **kwargs)
+        shards_directories.append(shard_directory)
+    return shards_directories
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 7])
+@pytest.mark.parametrize('size', [5, 1000])
+def test_merged_shards_equal_single_pass(tmp_path, count, size):
+    input_directory = str(tmp_path / 'particles.h5')
+    write_particles_h5(input_directory, size=size, species=('e', 'i'))
+    single_directory = str(tmp_path / 'single.gdf')
+    merged_directory = str(tmp_path / 'merged.gdf')
+    hdf_to_gdf(input_directory, single_directory, 100, None, None)
+    gdf_merge(convert_shards(input_directory, tmp_path, count), merged_directory)
+
+    assert read_without_time(merged_directory) == read_without_time(single_directory)
+
+
+@pytest.mark.parametrize('count', [2, 5])
+def test_merged_shards_with_roi_equal_single_pass(tmp_path, patched_series, count):
+    roi = '1e-5:3.3e-5,:,3e-6:'
+    single_directory = str(tmp_path / 'single.gdf')
+    merged_directory = str(tmp_path / 'merged.gdf')
+    hdf_to_gdf(patched_series, single_directory, 100, None, None, roi=roi)
+    gdf_merge(convert_shards(patched_series, tmp_path, count, roi=roi), merged_directory)
+
+    assert read_without_time(merged_directory) == read_without_time(single_directory)
+
+
+@pytest.mark.parametrize('shard', ['2/2', '-1/3', '1/0'])
+def test_wrong_shard(shard):
+    with pytest.raises(ValueError):
+        Shard(shard)
+
+
+def test_merge_of_other_files_fails(tmp_path):
+    input_directory = str(tmp_path / 'particles.h5')
+    other_input_directory = str(tmp_path / 'other.h5')
+    write_particles_h5(input_directory, size=100, species=('e', 'i'))
+    write_particles_h5(other_input_directory, size=100, species=('e',))
+    shard_directory = str(tmp_path / 'shard_0.gdf')
+    other_shard_directory = str(tmp_path / 'shard_1.gdf')
+    hdf_to_gdf(input_directory, shard_directory, 100, None, None, shard='0/2')
+    hdf_to_gdf(other_input_directory, other_shard_directory, 100, None, None, shard='1/2')
+
+    with pytest.raises(ValueError):
+        gdf_merge([shard_directory, other_shard_directory], str(tmp_path / 'merged.gdf'))
@@ -0,0 +1,92 @@
+import itertools
+import h5py
+import numpy as np
+import pytest
+
+from OpenPMD_add_patches import OpenPMD_add_patches, quantize_coordinates, interleave_bits, hilbert_transpose, \
+    get_curve_keys
+
+
+def get_grid_cells(dimension, bits):
+    """ Integer coordinates of all cells of grid with 2**bits cells on each axis """
+
+    cells = np.array(list(itertools.product(range(2 ** bits), repeat=dimension)), dtype=np.uint64)
+    return [cells[:, axis].copy() for axis in range(dimension)]
+
+
+def get_morton_key(cell, bits):
+    key = 0
+    for bit in range(bits - 1, -1, -1):
+        for coordinate in cell:
+            key = (key << 1) | ((int(coordinate) >> bit) & 1)
+    return key
+
+
+@pytest.mark.parametrize('dimension, bits', [(2, 1), (2, 3), (3, 2)])
+def test_morton_keys_interleave_bits(dimension, bits):
+    cells = get_grid_cells(dimension, bits)
+    keys = interleave_bits(cells, bits)
+
+    assert list(keys) == [get_morton_key(cell, bits) for cell in zip(*cells)]
+    assert sorted(keys) == list(range(2 ** (dimension * bits)))
+
+
+def test_hilbert_curve_of_2x2_grid():
+    cells = get_grid_cells(2, 1)
+    keys = interleave_bits(hilbert_transpose([cells[0].copy(), cells[1].copy()], 1), 1)
+    path = [(int(cells[0][idx]), int(cells[1][idx])) for idx in np.argsort(keys)]
+
+    assert path == [(0, 0), (0, 1), (1, 1), (1, 0)]
+
+
+@pytest.mark.parametrize('dimension, bits', [(2, 1), (2, 2), (2, 4), (3, 1), (3, 2), (3, 3)])
+def test_hilbert_keys_walk_neighbour_cells(dimension, bits):
+    cells = get_grid_cells(dimension, bits)
+    keys = interleave_bits(hilbert_transpose([axis.copy() for axis in cells], bits), bits)
+
+    assert sorted(keys) == list(range(2 ** (dimension * bits)))
+    path = np.array(cells, dtype=np.int64)[:, np.argsort(keys)]
+    assert np.all(np.abs(np.diff(path, axis=1)).sum(axis=0) == 1)
+    assert np.all(path[:, 0] == 0)
+
+
+def test_quantize_coordinates():
+    coordinates = [np.array([-1., 0., 1.]), np.array([5., 5., 5.]), np.array([0., 0.5, 2.])]
+    integer_coordinates = quantize_coordinates(coordinates, 2)
+
+    assert [list(values) for values in integer_coordinates] == [[0, 1, 3], [0, 0, 0], [0, 0, 3]]
+
+
+@pytest.mark.parametrize('order', ['morton', 'hilbert'])
+def test_curve_keys_keep_nearby_particles_together(order):
+    random = np.random.default_rng(0)
+    coordinates = [random.random(4000) for axis in range(3)]
+    keys = get_curve_keys(coordinates, order)
+    permutation = np.argsort(keys, kind='stable')
+
+    assert len(np.unique(keys)) == 4000
+    sorted_coordinates = np.array(coordinates)[:, permutation]
+    steps = np.linalg.norm(np.diff(sorted_coordinates, axis=1), axis=0)
+    random_steps = np.linalg.norm(np.diff(np.array(coordinates), axis=1), axis=0)
+    assert np.mean(steps) < np.mean(random_steps) / 4
+
+
+@pytest.mark.parametrize('order', ['morton', 'hilbert'])
+def test_curve_patches_are_balanced_boxes(tmp_path, particles_h5, order):
+    result_directory = str(tmp_path / 'curve.h5')
+    OpenPMD_add_patches(particles_h5, result_directory, [0., 1., 0., 1., 0., 1.], [2, 2, 2], 1e-5, order=order)
+
+    with h5py.File(result_directory, 'r') as hdf_file:
+        species = hdf_file['data/100/particles/e']
+        patches = species['ParticlePatches']
+        numbers = patches['numParticles'][()]
+        offsets = patches['numParticlesOffset'][()]
+        assert list(numbers) == [187, 188] * 4
+        assert list(offsets) == list(np.cumsum(numbers) - numbers)
+        for axis in 'xyz':
+            coordinate = species['position'][axis][()] * 1e-6 + species['positionOffset'][axis][()] * 1e-6
+            for patch in range(8):
+                values = coordinate[offsets[patch]:offsets[patch] + numbers[patch]]
+                offset = patches['offset'][axis][patch]
+                assert values.min() == pytest.approx(offset)
+                assert values.max() == pytest.approx(offset + patches['extent'][axis][patch])
@@ -0,0 +1,84 @@
+import h5py
+import numpy as np
+import pytest
+
+from OpenPMD_add_patches import OpenPMD_add_patches, verify_patches, check_patches, print_patches_report, \
+    Patches_report
+
+GRID_SIZES = [0., 1., 0., 1., 0., 1.]
+
+
+def add_patches(particles_h5, result_directory, order=None):
+    OpenPMD_add_patches(particles_h5, result_directory, GRID_SIZES, [2, 2, 2], 1e-5, order=order)
+    return result_directory
+
+
+@pytest.mark.parametrize('order', [None, 'morton', 'hilbert'])
+def test_written_patches_have_no_violations(tmp_path, particles_h5, order):
+    result_directory = add_patches(particles_h5, str(tmp_path / 'patches.h5'), order)
+    reports = verify_patches(result_directory, GRID_SIZES, [2, 2, 2])
+
+    report = reports['/data/100/particles/e']
+    with h5py.File(result_directory, 'r') as hdf_file:
+        patch_group = hdf_file['data/100/particles/e/ParticlePatches']
+        # grid patches are stored with one more empty patch at the end
+        assert list(report['count']) == list(patch_group['numParticles'][:8])
+        assert list(report['start']) == list(patch_group['numParticlesOffset'][:8])
+    assert list(report['patch']) == list(range(8))
+    assert list(report['violations']) == [0] * 8
+    assert np.all(report['first_violations'] == -1)
+
+
+def test_moved_grid_particles_are_reported(tmp_path, particles_h5):
+    result_directory = add_patches(particles_h5, str(tmp_path / 'patches.h5'))
+    with h5py.File(result_directory, 'r+') as hdf_file:
+        offsets = hdf_file['data/100/particles/e/ParticlePatches/numParticlesOffset'][()]
+        position_x = hdf_file['data/100/particles/e/position/x']
+        first_row = int(offsets[0])
+        last_row = int(offsets[7])
+        values = position_x[()]
+        values[[first_row, last_row]] = values[[last_row, first_row]]
+        position_x[...] = values
+    report = verify_patches(result_directory, GRID_SIZES, [2, 2, 2])['/data/100/particles/e']
+
+    assert list(np.nonzero(report['violations'])[0]) == [0, 7]
+    assert report['first_violations'][0, 0] == first_row
+    assert report['first_violations'][7, 0] == last_row
+
+
+def test_moved_curve_particle_is_reported_by_its_box(tmp_path, particles_h5):
+    result_directory = add_patches(particles_h5, str(tmp_path / 'patches.h5'), 'hilbert')
+    with h5py.File(result_directory, 'r+') as hdf_file:
+        species = hdf_file['data/100/particles/e']
+        assert species['ParticlePatches/offset/z'].attrs['patchOrder'] == 'hilbert'
+        row = int(species['ParticlePatches/numParticlesOffset'][3])
+        position_offset = species['positionOffset/z']
+        values = position_offset[()]
+        values[row] += 1000
+        position_offset[...] = values
+    report = verify_patches(result_directory, GRID_SIZES, [2, 2, 2])['/data/100/particles/e']
+
+    assert list(report['violations']) == [0, 0, 0, 1, 0, 0, 0, 0]
+    assert report['first_violations'][3, 0] == row
+
+
+def test_violations_beyond_max_indices_are_counted(capsys):
+    x = np.array([0.1, 0.9, 0.8, 0.7, 0.2, 0.6])
+    report = check_patches([x], [0., 1.], [2], [0, 3], [3, 3], chunk_size=2, max_indices=1)
+
+    assert list(report['violations']) == [2, 1]
+    assert list(report['first_violations'][:, 0]) == [1, 4]
+    assert report.dtype == Patches_report.get_dtype(1)
+    print_patches_report({'e': report})
+    assert capsys.readouterr().out == 'e: 2 patches, 2 with violations\n' \
+        '  patch 0: 2 of 3 particles outside, first [1]\n  patch 1: 1 of 3 particles outside, first [4]\n'
+
+
+def test_check_patches_with_given_boxes():
+    x = np.array([0.5, 1.5, 3.5, 2.5])
+    lows = [np.array([0., 2.])]
+    highs = [np.array([2., 3.])]
+    report = check_patches([x], None, None, [0, 2], [2, 2], ranges=(lows, highs))
+
+    assert list(report['violations']) == [0, 1]
+    assert report['first_violations'][1, 0] == 2